@@ -0,0 +1,50 @@
+# coding: utf-8
+"""Throughput and latency of the tokenization server.
+
+Usage:
+    python benchmarks/bench_server.py --subwords bpe.file [--processes 2] < text_file.txt
+    python benchmarks/bench_server.py --port 8765 < text_file.txt
+With --subwords the server is started in this process, otherwise a running
+`subtokenizer serve` is used.
+"""
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import sys
+import json
+import asyncio
+import argparse
+from subtokenizer import server
+
+
+async def run(args, lines):
+    if args.subwords:
+        srv, batcher = await server.start_server(args.subwords, port=args.port, unix_path=args.unix,
+                                                 workers=args.processes, max_batch=args.max_batch,
+                                                 max_latency=args.max_latency)
+    stats, _ = await server.generate_load(lines, requests=args.requests, concurrency=args.concurrency,
+                                          connections=args.connections, port=args.port, unix_path=args.unix,
+                                          numeric=True)
+    if args.subwords:
+        stats['batches'] = batcher.batches
+        await server.stop_server(srv, batcher)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--subwords', default=None, type=str, help="start server with subwords dictionary")
+    parser.add_argument('-p', '--processes', default=1, type=int, help="number of server worker processes")
+    parser.add_argument('--port', default=server.DEFAULT_PORT, type=int, help="server port")
+    parser.add_argument('--unix', default=None, type=str, help="server unix socket")
+    parser.add_argument('--requests', default=10000, type=int, help="number of requests")
+    parser.add_argument('--concurrency', default=64, type=int, help="number of concurrent requests")
+    parser.add_argument('--connections', default=4, type=int, help="number of connections")
+    parser.add_argument('--max_batch', default=server.DEFAULT_MAX_BATCH, type=int, help="server batch size")
+    parser.add_argument('--max_latency', default=server.DEFAULT_MAX_LATENCY, type=float, help="server batch latency")
+    args = parser.parse_args()
+    lines = [l.rstrip('\n') for l in sys.stdin]
+    print(json.dumps(asyncio.run(run(args, lines)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# coding: utf-8
+"""Compares trie longest-match segmentation with the slicing search it replaced.
+
+Usage:
+    python benchmarks/bench_subwords.py [--words 20000] [--word_len 40]
+"""
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import random
+import timeit
+import argparse
+from subtokenizer.subwords import Subwords, RESERVED_TOKENS
+
+
+def slicing_segment(subwords, token):
+    start = 0
+    ret = []
+    token_len = len(token)
+    while start < token_len:
+        for end in range(min(token_len, start + subwords.max_subtoken_len), start, -1):
+            subtoken = token[start:end]
+            if subtoken in subwords.subtoken_string_to_id:
+                ret.append(subtoken)
+                start = end
+                break
+    return ret
+
+
+def make_vocabulary(rnd, alphabet, size, max_len):
+    vocab = set(alphabet)
+    while len(vocab) < size:
+        vocab.add(''.join(rnd.choice(alphabet) for _ in range(rnd.randint(2, max_len))))
+    return RESERVED_TOKENS + sorted(vocab)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', default=20000, type=int, help="number of words")
+    parser.add_argument('--word_len', default=40, type=int, help="length of words")
+    parser.add_argument('--vocab', default=32000, type=int, help="vocabulary size")
+    parser.add_argument('--max_subtoken_len', default=24, type=int, help="longest subtoken")
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    alphabet = 'abcdefghij'
+    subwords = Subwords(make_vocabulary(rnd, alphabet, args.vocab, args.max_subtoken_len))
+    words = [''.join(rnd.choice(alphabet) for _ in range(args.word_len)) for _ in range(args.words)]
+    for w in words[:1000]:
+        assert subwords.trie.segment(w)[0] == slicing_segment(subwords, w)
+
+    slicing = min(timeit.repeat(lambda: [slicing_segment(subwords, w) for w in words], number=1, repeat=3))
+    trie = min(timeit.repeat(lambda: [subwords.trie.segment(w) for w in words], number=1, repeat=3))
+    print("slicing: {0:.3f}s trie: {1:.3f}s speedup: {2:.2f}x".format(slicing, trie, slicing / trie))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# coding: utf-8
+"""Deterministic synthetic multilingual corpus for benchmarks.
+
+Words are drawn from per-script lexicons with Zipf distributed frequencies,
+so learned vocabularies and cache hit rates look like the ones of real text.
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import random
+import bisect
+from six.moves import range
+from six import unichr
+
+LATIN_SYLLABLES = ['ba', 'ce', 'di', 'fo', 'gu', 'ha', 'je', 'ki', 'lo', 'mu', 'na', 'pe', 'qui', 'ro', 'su',
+                   'ta', 've', 'wi', 'xo', 'ze', 'str', 'th', 'ing', 'tion', 'er']
+CYRILLIC_SYLLABLES = ['ба', 'ве', 'ги', 'до', 'жу', 'за', 'ке', 'ли', 'мо', 'ну', 'па', 'ре', 'си', 'то', 'фу',
+                      'ха', 'це', 'чи', 'шо', 'щу', 'ый', 'ость', 'ение', 'ать']
+HAN_RANGE = (0x4E00, 0x4E00 + 500)
+TAGS = ['<b>', '</b>', '<i>', '</i>', '<br/>', '<a href="x">', '</a>', '&amp;', '&lt;', '&gt;']
+CONTROLS = ['\t', '\x07', '\x1b', '\u200b', '\u00a0', '\ufeff']
+PUNCTUATION = [',', '.', '!', '?', ':', ';', '-', '"', '(', ')']
+SCRIPTS = ('latin', 'cyrillic', 'han', 'tags', 'controls')
+
+
+def _lexicon(rnd, syllables, size, capitalize):
+    words = set()
+    while len(words) < size:
+        word = ''.join(rnd.choice(syllables) for _ in range(rnd.randint(1, 4)))
+        if capitalize and rnd.random() < 0.1:
+            word = word.capitalize()
+        words.add(word)
+    return sorted(words)
+
+
+def _han_lexicon(rnd, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(unichr(rnd.randint(*HAN_RANGE)) for _ in range(rnd.randint(1, 3))))
+    return sorted(words)
+
+
+class ZipfSampler(object):
+    def __init__(self, rnd, items, exponent=1.1):
+        self.rnd = rnd
+        self.items = list(items)
+        rnd.shuffle(self.items)
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.items) + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+
+    def __call__(self):
+        return self.items[bisect.bisect_left(self.cumulative, self.rnd.random() * self.cumulative[-1])]
+
+
+def make_corpus(lines=10000, seed=0, scripts=SCRIPTS, lexicon_size=20000, words_per_line=(5, 30)):
+    """Returns list of lines without line breaks.
+    Args:
+        lines: number of lines.
+        seed: random seed, the same arguments always give the same corpus.
+        scripts: subset of SCRIPTS, every line is mostly in one of the
+            latin, cyrillic or han scripts, tags and controls are mixed in.
+        lexicon_size: number of distinct words per script.
+        words_per_line: range of number of words in a line.
+    """
+    rnd = random.Random(seed)
+    samplers = []
+    if 'latin' in scripts:
+        samplers.append(ZipfSampler(rnd, _lexicon(rnd, LATIN_SYLLABLES, lexicon_size, True)))
+    if 'cyrillic' in scripts:
+        samplers.append(ZipfSampler(rnd, _lexicon(rnd, CYRILLIC_SYLLABLES, lexicon_size, True)))
+    if 'han' in scripts:
+        samplers.append(ZipfSampler(rnd, _han_lexicon(rnd, lexicon_size)))
+    assert samplers, "at least one of latin, cyrillic or han scripts is required"
+    tags = 'tags' in scripts
+    controls = 'controls' in scripts
+    result = []
+    for _ in range(lines):
+        sampler = rnd.choice(samplers)
+        han = sampler is samplers[-1] and 'han' in scripts
+        parts = []
+        for _ in range(rnd.randint(*words_per_line)):
+            if rnd.random() < 0.05:
+                # words of other scripts inside line
+                parts.append(rnd.choice(samplers)())
+            else:
+                parts.append(sampler())
+            if rnd.random() < 0.1:
+                parts.append(rnd.choice(PUNCTUATION))
+            if tags and rnd.random() < 0.03:
+                parts.append(rnd.choice(TAGS))
+            if controls and rnd.random() < 0.01:
+                parts.append(rnd.choice(CONTROLS))
+            if rnd.random() < 0.02:
+                parts.append(str(rnd.randint(0, 10000)))
+        result.append(('' if han else ' ').join(parts))
+    return result
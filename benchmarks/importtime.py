@@ -0,0 +1,69 @@
+# coding: utf-8
+"""Import time check, python 3.7+.
+
+Usage:
+    python benchmarks/importtime.py [--max_ms 100] [--repeat 5]
+Runs `python -X importtime` for every statement, reports the best cumulative
+import time of subtokenizer and the slowest modules. Exits with status 1 if
+the time is over `--max_ms` or one of `--forbid` modules is imported, they are
+only needed by learning, multiprocessing or the command line and must be
+imported where they are used.
+"""
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import sys
+import argparse
+import subprocess
+
+STATEMENTS = ['import subtokenizer', 'from subtokenizer import SubTokenizer']
+FORBIDDEN = ['regex', 'multiprocessing', 'argparse', 'logging', 'tempfile', 'html', 'numpy']
+
+
+def import_times(statement):
+    """Returns list of (module, self microseconds, cumulative microseconds) imported
+    by subtokenizer, the last one is subtokenizer itself."""
+    output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c', statement],
+                                     stderr=subprocess.STDOUT).decode('utf-8')
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(self_us), int(cumulative_us)))
+        # Modules are listed after modules they import, top level ones are not indented.
+        if name[1:2] != ' ':
+            if name.strip() == 'subtokenizer':
+                return times
+            times = []
+    raise RuntimeError("subtokenizer is not imported by: {0}".format(statement))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max_ms', default=100.0, type=float, help="maximum cumulative import time")
+    parser.add_argument('--repeat', default=5, type=int, help="number of runs, the best one is reported")
+    parser.add_argument('--forbid', default=FORBIDDEN, nargs='*', help="modules which must not be imported")
+    parser.add_argument('--top', default=10, type=int, help="number of the slowest modules to print")
+    args = parser.parse_args()
+    failed = False
+    for statement in STATEMENTS:
+        runs = [import_times(statement) for _ in range(args.repeat)]
+        best = min(runs, key=lambda times: times[-1][2])
+        total = best[-1][2] / 1000
+        print("{0:40} {1:8.1f}ms".format(statement, total))
+        for name, self_us, cumulative_us in sorted(best, key=lambda t: -t[1])[:args.top]:
+            print("    {0:36} {1:8.1f}ms self {2:8.1f}ms cumulative".format(name, self_us / 1000, cumulative_us / 1000))
+        imported = {t[0] for t in best}
+        forbidden = [name for name in args.forbid if name in imported]
+        if forbidden:
+            print("    imported eagerly: {0}".format(', '.join(forbidden)))
+            failed = True
+        if total > args.max_ms:
+            print("    slower than {0}ms".format(args.max_ms))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
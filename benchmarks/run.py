@@ -0,0 +1,210 @@
+# coding: utf-8
+"""Benchmark suite of tokenize, detokenize, load, learn and the command line.
+
+Usage:
+    python benchmarks/run.py run -o results.json [--lines 20000] [--processes 4] [--only tokenize]
+    python benchmarks/run.py compare base.json results.json [--threshold 0.1]
+Every case is run `--repeat` times on a deterministic synthetic multilingual
+corpus and the best time is reported. `compare` prints relative changes and
+exits with status 1 if any case became slower than the threshold allows.
+"""
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from corpus import make_corpus
+from subtokenizer.tokenizer import ReTokenizer
+from subtokenizer.subtokenizer import SubTokenizer
+from subtokenizer.utils import prepare_text
+
+
+class Context(object):
+    """Corpus, learned model and files shared by benchmark cases."""
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.lines = make_corpus(args.lines, seed=args.seed)
+        self.corpus_file = os.path.join(workdir, 'corpus.txt')
+        with io.open(self.corpus_file, 'w', encoding='utf-8') as f:
+            for line in self.lines:
+                f.write(line + '\n')
+        self.token_counts = defaultdict(int)
+        for line in self.lines:
+            for token in ReTokenizer.tokenize(prepare_text(line)):
+                self.token_counts[token] += 1
+        self.model = SubTokenizer.learn(self.token_counts, args.vocab_size)
+        self.model_file = os.path.join(workdir, 'bpe.txt')
+        self.model.save(self.model_file)
+        self.compiled_file = os.path.join(workdir, 'bpe.bin')
+        self.model.compile(self.compiled_file)
+        self.tokens = [self.model.tokenize(line) for line in self.lines]
+        self.ids = [self.model.tokenize(line, numeric=True) for line in self.lines]
+
+    def fresh_model(self):
+        # cold cache, the corpus is tokenized once per repeat
+        return SubTokenizer.load(self.model_file)
+
+
+def cli(ctx, *args):
+    with io.open(ctx.corpus_file, 'rb') as stdin, io.open(os.devnull, 'wb') as stdout:
+        subprocess.check_call([sys.executable, '-m', 'subtokenizer'] + list(args), stdin=stdin, stdout=stdout)
+
+
+def tokenize_threads(model, lines, threads):
+    with ThreadPoolExecutor(threads) as executor:
+        return model.tokenize_many(lines, executor=executor)
+
+
+def cases(ctx):
+    """Yields (name, number of items, setup, function of setup result)."""
+    lines = ctx.lines
+    n = len(lines)
+    yield 'import', 1, None, lambda _: subprocess.check_call([sys.executable, '-c', 'import subtokenizer'])
+    yield 'retokenizer.tokenize', n, None, lambda _: [ReTokenizer.tokenize(l) for l in lines]
+    yield 'tokenize', n, ctx.fresh_model, lambda m: [m.tokenize(l) for l in lines]
+    yield 'tokenize.cached', n, lambda: ctx.model, lambda m: [m.tokenize(l) for l in lines]
+    yield 'tokenize.numeric', n, ctx.fresh_model, lambda m: [m.tokenize(l, numeric=True) for l in lines]
+    yield ('tokenize_many.threads', n, ctx.fresh_model,
+           lambda m: tokenize_threads(m, lines, ctx.args.processes))
+    yield 'detokenize', n, None, lambda _: [ctx.model.detokenize(t) for t in ctx.tokens]
+    yield ('detokenize.numeric', n, None,
+           lambda _: [ctx.model.detokenize(t, numeric=True) for t in ctx.ids])
+    yield 'load', 1, None, lambda _: SubTokenizer.load(ctx.model_file)
+    yield 'load.compiled', 1, None, lambda _: SubTokenizer.load(ctx.compiled_file)
+    for size in ctx.args.learn_sizes:
+        yield 'learn.{0}'.format(size), 1, None, lambda _, size=size: SubTokenizer.learn(ctx.token_counts, size)
+        yield ('learn.{0}.sample'.format(size), 1, None,
+               lambda _, size=size: SubTokenizer.learn(ctx.token_counts, size, sample=0.25))
+        yield ('learn.{0}.suffix_array'.format(size), 1, None,
+               lambda _, size=size: SubTokenizer.learn(ctx.token_counts, size, suffix_array=True))
+    for processes in range(1, ctx.args.processes + 1):
+        p = str(processes)
+        yield 'cli.tokenize.p{0}'.format(p), n, None, lambda _, p=p: cli(ctx, 'tokenize', '-s', ctx.model_file, '-p', p)
+        yield ('cli.learn.p{0}'.format(p), n, None,
+               lambda _, p=p: cli(ctx, 'learn', '-o', os.path.join(ctx.workdir, 'learned.txt'),
+                                  '-s', str(ctx.args.vocab_size), '-p', p))
+
+
+def measure(setup, func, repeat):
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.time()
+        func(arg)
+        times.append(time.time() - start)
+    return times
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='subtokenizer_bench')
+    try:
+        start = time.time()
+        ctx = Context(args, workdir)
+        sys.stderr.write("prepared {0} lines, vocab size {1} in {2:.1f}s\n".format(
+            len(ctx.lines), ctx.model.subwords.vocab_size, time.time() - start))
+        results = {}
+        for name, items, setup, func in cases(ctx):
+            if args.only and not re.search(args.only, name):
+                continue
+            times = measure(setup, func, args.repeat)
+            best = min(times)
+            results[name] = {'seconds': best, 'times': times, 'items': items,
+                             'items_per_second': items / best if best else None}
+            sys.stderr.write("{0:40} {1:9.4f}s\n".format(name, best))
+    finally:
+        shutil.rmtree(workdir)
+    report = {
+        'params': {'lines': args.lines, 'seed': args.seed, 'vocab_size': args.vocab_size, 'repeat': args.repeat},
+        'environment': {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+                        'platform': platform.platform(), 'cpu_count': multiprocessing.cpu_count()},
+        'results': results,
+    }
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+def compare_reports(base, new, threshold):
+    """Returns list of (name, base seconds, new seconds, relative change, status)."""
+    rows = []
+    for name in sorted(set(base['results']) | set(new['results'])):
+        if name not in base['results'] or name not in new['results']:
+            rows.append((name, base['results'].get(name, {}).get('seconds'),
+                         new['results'].get(name, {}).get('seconds'), None, 'missing'))
+            continue
+        base_seconds = base['results'][name]['seconds']
+        new_seconds = new['results'][name]['seconds']
+        change = new_seconds / base_seconds - 1 if base_seconds else 0.0
+        if change > threshold:
+            status = 'REGRESSION'
+        elif change < -threshold:
+            status = 'improvement'
+        else:
+            status = ''
+        rows.append((name, base_seconds, new_seconds, change, status))
+    return rows
+
+
+def compare(args):
+    with io.open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with io.open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+    if base['params'] != new['params']:
+        print("warning: runs have different parameters {0} and {1}".format(base['params'], new['params']))
+    if base['environment'] != new['environment']:
+        print("warning: runs are made in different environments")
+    rows = compare_reports(base, new, args.threshold)
+    for name, base_seconds, new_seconds, change, status in rows:
+        if change is None:
+            print("{0:40} {1}".format(name, status))
+        else:
+            print("{0:40} {1:9.4f}s {2:9.4f}s {3:+7.1%} {4}".format(name, base_seconds, new_seconds, change, status))
+    if any(row[4] == 'REGRESSION' for row in rows):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(help='modes: 1) run 2) compare', dest="mode")
+    parser_run = subparsers.add_parser('run', help='run benchmarks')
+    parser_run.add_argument('-o', '--output', default=None, type=str, help="json results file, stdout by default")
+    parser_run.add_argument('--lines', default=20000, type=int, help="number of corpus lines")
+    parser_run.add_argument('--seed', default=0, type=int, help="corpus random seed")
+    parser_run.add_argument('--vocab_size', default=8000, type=int, help="vocabulary size of the model")
+    parser_run.add_argument('--learn_sizes', default=[1000, 4000, 16000], type=int, nargs='+',
+                            help="vocabulary sizes to learn")
+    parser_run.add_argument('-p', '--processes', default=min(4, multiprocessing.cpu_count()), type=int,
+                            help="command line is run with -p 1..processes")
+    parser_run.add_argument('--repeat', default=3, type=int, help="number of runs of every case")
+    parser_run.add_argument('--only', default=None, type=str, help="regex of case names to run")
+    parser_compare = subparsers.add_parser('compare', help='compare two results files')
+    parser_compare.add_argument('base', type=str, help="base results")
+    parser_compare.add_argument('new', type=str, help="new results")
+    parser_compare.add_argument('--threshold', default=0.1, type=float, help="relative slowdown reported as regression")
+    args = parser.parse_args()
+    if args.mode == 'run':
+        run(args)
+    elif args.mode == 'compare':
+        compare(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# coding: utf-8
+"""Thread scaling of SubTokenizer.tokenize_many with one shared model, python 3.
+
+Usage:
+    python benchmarks/threads.py [--lines 20000] [--threads 1 2 4 8] [--repeat 3]
+Every run loads the model again, so caches are cold and filled concurrently.
+Results of every thread count are checked against sequential tokenization.
+Threads run in parallel only on free-threaded python (3.13t and later), with
+the GIL the speedup stays at about 1.
+"""
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from corpus import make_corpus
+from subtokenizer.tokenizer import ReTokenizer
+from subtokenizer.subtokenizer import SubTokenizer
+from subtokenizer.utils import prepare_text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', default=20000, type=int, help="number of corpus lines")
+    parser.add_argument('--seed', default=0, type=int, help="corpus random seed")
+    parser.add_argument('--vocab_size', default=4000, type=int, help="vocabulary size of the model")
+    parser.add_argument('--threads', default=[1, 2, 4, 8], type=int, nargs='+', help="numbers of threads")
+    parser.add_argument('--repeat', default=3, type=int, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+    lines = make_corpus(args.lines, seed=args.seed)
+    token_counts = defaultdict(int)
+    for line in lines:
+        for token in ReTokenizer.tokenize(prepare_text(line)):
+            token_counts[token] += 1
+    workdir = tempfile.mkdtemp(prefix='subtokenizer_threads')
+    try:
+        model_file = os.path.join(workdir, 'bpe.txt')
+        SubTokenizer.learn(token_counts, args.vocab_size).save(model_file)
+        expected = SubTokenizer.load(model_file).tokenize_many(lines, numeric=True)
+        gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+        print("python {0}, GIL {1}".format(sys.version.split()[0], 'enabled' if gil else 'disabled'))
+        base = None
+        for threads in args.threads:
+            times = []
+            for _ in range(args.repeat):
+                model = SubTokenizer.load(model_file)
+                with ThreadPoolExecutor(threads) as executor:
+                    start = time.time()
+                    result = model.tokenize_many(lines, executor=executor, numeric=True)
+                    times.append(time.time() - start)
+                if result != expected:
+                    raise AssertionError("{0} threads tokenized differently".format(threads))
+            best = min(times)
+            base = base or best
+            print("{0:3} threads {1:9.4f}s {2:10.0f} lines/s speedup {3:.2f}".format(
+                threads, best, len(lines) / best, base / best))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# coding: utf-8
+"""Memory of forked tokenizer workers, linux and python 3.
+
+Usage:
+    python benchmarks/workers.py [--lines 20000] [--vocab_size 16000] [--processes 4] [-s bpe.file]
+The model is loaded in the parent process as the command line does, then
+every worker is forked and tokenizes its share of lines. Private memory
+of a worker is the memory it does not share with the parent: pages of the
+model copied on write and its own caches. It is reported for text and
+compiled vocabularies and text vocabulary moved to shared memory by
+`SubTokenizer.share_memory`, with caches enabled and disabled.
+"""
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+from collections import defaultdict
+from corpus import make_corpus
+from subtokenizer.tokenizer import ReTokenizer
+from subtokenizer.subtokenizer import SubTokenizer
+from subtokenizer.stats import process_memory
+from subtokenizer.utils import prepare_text, WorkerPool
+
+MB = 2 ** 20
+
+
+def worker_memory(model, lines, processes):
+    """Returns list of private memory of workers in bytes after tokenizing lines."""
+    def tokenize(task):
+        for line in task:
+            model.tokenize(line)
+        return os.getpid(), process_memory()['private']
+
+    tasks = [lines[i::4 * processes] for i in range(4 * processes)]
+    pool = WorkerPool(tokenize, processes, chunk_size=1)
+    try:
+        # the last report of every process, memory only grows
+        return list(dict(pool.imap(tasks)).values())
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', default=20000, type=int, help="number of corpus lines")
+    parser.add_argument('--seed', default=0, type=int, help="corpus random seed")
+    parser.add_argument('--vocab_size', default=16000, type=int, help="vocabulary size of the learned model")
+    parser.add_argument('-s', '--subwords', default=None, type=str, help="text vocabulary instead of the learned one")
+    parser.add_argument('-p', '--processes', default=4, type=int, help="number of worker processes")
+    args = parser.parse_args()
+    if process_memory() is None:
+        sys.exit("/proc/self/smaps_rollup is not available")
+    lines = make_corpus(args.lines, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix='subtokenizer_workers')
+    try:
+        model_file = args.subwords
+        if model_file is None:
+            token_counts = defaultdict(int)
+            for line in lines:
+                for token in ReTokenizer.tokenize(prepare_text(line)):
+                    token_counts[token] += 1
+            model_file = os.path.join(workdir, 'bpe.txt')
+            SubTokenizer.learn(token_counts, args.vocab_size).save(model_file)
+        compiled_file = os.path.join(workdir, 'bpe.bin')
+        SubTokenizer.load(model_file).compile(compiled_file)
+        ReTokenizer.compile()
+        print("{0} lines, {1} processes".format(len(lines), args.processes))
+        print("{0:10} {1:8} {2:>24}".format('vocabulary', 'caches', 'worker private MB'))
+        for name, filename in (('text', model_file), ('shared', model_file), ('compiled', compiled_file)):
+            for caches in (False, True):
+                cache_sizes = {} if caches else {'cache_size': 0, 'word_cache_size': 0}
+                model = SubTokenizer.load(filename, **cache_sizes)
+                if name == 'shared':
+                    model = model.share_memory()
+                private = worker_memory(model, lines, args.processes)
+                print("{0:10} {1:8} {2:>24}".format(
+                    name, 'on' if caches else 'off', ' '.join('{0:.1f}'.format(p / MB) for p in private)))
+                del model
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,7 @@ setup(
     keywords='nlp tokenization',
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
     install_requires=['six', 'regex', 'future'],
+    extras_require={'numpy': ['numpy']},
     python_requires='>=2.6, <4.0',
     entry_points={
         'console_scripts': [
@@ -5,16 +5,125 @@ from __future__ import unicode_literals, division, absolute_import
 import io
 import sys
 import six
+import json
 import codecs
-import argparse
-from collections import defaultdict
-from subtokenizer.utils import wrap_text_reader, multiprocess, encode_controls, normalize_text, unescape, NOBREAK
-from subtokenizer.subwords import Subwords, EOS
+from subtokenizer.utils import (wrap_text_reader, multiprocess, prepare_text, unescape, NOBREAK,
+                                StreamingCounter, DEFAULT_CHUNK_SIZE, WorkerPool, file_ranges, read_range,
+                                read_files, map_file_shards)
+from subtokenizer.subwords import Subwords, EOS, DEFAULT_CACHE_SIZE
 from subtokenizer.tokenizer import ReTokenizer
-from subtokenizer.subtokenizer import SubTokenizer
+from subtokenizer.subtokenizer import SubTokenizer, DEFAULT_WORD_CACHE_SIZE
+from subtokenizer.stats import Stats, timed_iter, with_stats, timer
+from subtokenizer.binary import IdsWriter, read_ids
+from subtokenizer.counts import write_counts, merge_files, load_counts
 
 
 
+def _create_stats(args):
+    if args.stats or args.stats_json:
+        return Stats()
+    return None
+
+
+def _report_stats(args, stats):
+    if stats is None:
+        return
+    if args.stats:
+        sys.stderr.write(stats.format())
+    if args.stats_json:
+        stats.dump(args.stats_json)
+
+
+def _map_lines(func, lines, args, stats=None):
+    """Applies func to lines in args.processes processes.
+    With stats, time waiting for input and for worker processes is recorded and
+    stats collected by func in worker processes are merged into stats.
+    """
+    if args.processes > 1:
+        # compiled once and shared by forked workers
+        ReTokenizer.compile()
+    if stats is None:
+        if args.processes == 1:
+            return (func(l) for l in lines)
+        return multiprocess(func, lines, processes=args.processes, chunk_size=args.chunk_size)
+    lines = timed_iter(lines, stats, 'io.read')
+    if args.processes == 1:
+        return (func(l) for l in lines)
+    results = multiprocess(with_stats(func, stats), lines, processes=args.processes, chunk_size=args.chunk_size)
+    return _merge_worker_stats(timed_iter(results, stats, 'multiprocess.wait'), stats)
+
+
+def _input_lines(args):
+    if args.input:
+        return read_files(args.input)
+    return sys.stdin
+
+
+def _binary_stdout():
+    sys.stdout.flush()
+    if six.PY2:
+        # codecs writer
+        return sys.stdout.stream
+    return sys.stdout.buffer
+
+
+def _merge_worker_stats(results, stats):
+    for result, worker_stats in results:
+        stats.merge(worker_stats)
+        yield result
+
+
+def _count_tokens(args, stats=None):
+    """Counts tokens of input files or stdin, returns StreamingCounter."""
+    counter = StreamingCounter(args.max_tokens)
+
+    def tokenize(line):
+        line = prepare_text(line.strip('\r\n'), encode_controls=not args.no_encode_controls)
+        return ReTokenizer.tokenize(line, split_by_alphabets=not args.no_split_by_alphabets, lowercase = args.lowercase)
+
+    def count_range(task):
+        range_counter = StreamingCounter(args.max_tokens)
+        for line in read_range(*task):
+            range_counter.update(tokenize(line))
+        return range_counter
+
+    start = timer()
+    if args.input and args.processes > 1:
+        # Every process counts tokens of its own part of input files.
+        ReTokenizer.compile()
+        pool = WorkerPool(count_range, args.processes, chunk_size=1)
+        try:
+            for range_counter in pool.imap(file_ranges(args.input, args.processes)):
+                counter.merge(range_counter)
+        finally:
+            pool.close()
+    else:
+        for tokens in _map_lines(tokenize, _input_lines(args), args, stats):
+            counter.update(tokens)
+    if stats is not None:
+        stats.event('count_tokens', seconds=timer() - start, tokens=counter.total, distinct_tokens=len(counter))
+    if counter.error:
+        sys.stderr.write("token counts are underestimated by at most {0}, {1} tokens counted\n".format(counter.error, counter.total))
+    return counter
+
+
+def _tokenizer_options(args):
+    return dict(encode_controls=not args.no_encode_controls, split_by_alphabets=not args.no_split_by_alphabets,
+                lowercase=args.lowercase)
+
+
+def count(args):
+    stats = _create_stats(args)
+    counter = _count_tokens(args, stats)
+    write_counts(args.output, counter.counts(), total=counter.total, error=counter.error, **_tokenizer_options(args))
+    _report_stats(args, stats)
+
+
+def merge(args):
+    tokens = merge_files(args.input, args.output)
+    sys.stderr.write("{0} distinct tokens\n".format(tokens))
+
+
 def learn(args):
     reserved_tokens = None
     if args.reserved:
@@ -23,61 +132,118 @@ def learn(args):
         for subtoken in f:
             reserved_tokens.append(subtoken.strip('\r\n'))
         f.close()
-    token_counts = defaultdict(int)
+    stats = _create_stats(args)
+    if args.counts:
+        header, token_counts = load_counts(args.counts)
+        # the vocabulary is used with options tokens were counted with
+        args.no_split_by_alphabets = not header['split_by_alphabets']
+        args.lowercase = header['lowercase']
+        if header['error']:
+            sys.stderr.write("token counts are underestimated by at most {0}, {1} tokens counted\n".format(
+                header['error'], header['total']))
+    else:
+        token_counts = _count_tokens(args, stats).counts()
 
-    def tokenize(line):
-        line = normalize_text(line.strip('\r\n'))
-        if not args.no_encode_controls:
-            line = encode_controls(line)
-        return ReTokenizer.tokenize(line, split_by_alphabets=not args.no_split_by_alphabets, lowercase = args.lowercase)
+    def learn_subtokenizer(sample):
+        start = timer()
+        subdict = SubTokenizer.learn(token_counts, args.size, reserved_tokens=reserved_tokens,
+                                     min_symbol_count=args.min_symbol_count, reversed_bpe=args.reversed_bpe,
+                                     processes=args.processes, stats=stats, sample=sample, seed=args.seed,
+                                     subtoken_length_limit=args.subtoken_length_limit,
+                                     suffix_array=args.suffix_array)
+        subdict.split_by_alphabets = not args.no_split_by_alphabets
+        subdict.lowercase = args.lowercase
+        return subdict, timer() - start
 
-    if args.processes == 1:
-        for l in sys.stdin:
-            for token in tokenize(l):
-                token_counts[token] += 1
-    else:
-        for l in multiprocess(tokenize, sys.stdin, processes=args.processes):
-            for token in l:
-                token_counts[token] += 1
-    subdict = SubTokenizer.learn(token_counts, args.size, reserved_tokens=reserved_tokens, min_symbol_count=args.min_symbol_count, reversed_bpe=args.reversed_bpe)
+    subdict, seconds = learn_subtokenizer(args.sample)
     subdict.save(args.output)
+    if args.eval:
+        eval_lines = list(read_files([args.eval]))
+        report = {'learned': _quality(subdict, seconds, eval_lines)}
+        if args.sample is not None:
+            # Full data baseline to compare with.
+            baseline, seconds = learn_subtokenizer(None)
+            report['full'] = _quality(baseline, seconds, eval_lines)
+        sys.stderr.write(_format_quality(report))
+        if args.eval_json:
+            with io.open(args.eval_json, 'w', encoding='utf-8') as f:
+                f.write(six.text_type(json.dumps(report, indent=2, sort_keys=True)))
+    _report_stats(args, stats)
+
+
+def _quality(subdict, seconds, lines):
+    report = subdict.evaluate(lines)
+    report['learn_seconds'] = seconds
+    report['vocab_size'] = subdict.subwords.vocab_size
+    return report
+
+
+def _format_quality(report):
+    columns = sorted(report, reverse=True)
+    compare = len(columns) == 2
+    lines = ['{0:20}'.format('') + ''.join('{0:>14}'.format(column) for column in columns) +
+             ('{0:>10}'.format('change') if compare else '')]
+    for name in ('vocab_size', 'learn_seconds', 'tokens_per_word', 'compression_ratio', 'escapes', 'subtokens'):
+        values = [report[column][name] for column in columns]
+        line = '{0:20}'.format(name) + ''.join(
+            ('{0:>14.4f}' if isinstance(value, float) else '{0:>14}').format(value) for value in values)
+        if compare and values[1]:
+            line += '{0:>+10.1%}'.format(values[0] / values[1] - 1)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
 
 
 def tokenize(args):
     subtok = None
     if args.subwords:
-        subtok = SubTokenizer.load(args.subwords, numeric=args.numeric, split_by_alphabets=not args.no_split_by_alphabets, lowercase=args.lowercase, reversed_bpe=args.reversed_bpe)
+        subtok = SubTokenizer.load(args.subwords, numeric=args.numeric, split_by_alphabets=not args.no_split_by_alphabets,
+                                   lowercase=args.lowercase, reversed_bpe=args.reversed_bpe or None, cache_size=args.cache_size,
+                                   word_cache_size=args.word_cache_size, prewarm=args.prewarm)
+        if args.processes > 1:
+            # forked workers read the vocabulary without copying it
+            subtok = subtok.share_memory()
 
     def tok_func(l):
-        line = normalize_text(l.strip('\r\n'))
+        line = l.strip('\r\n')
         if subtok:
             enc_ctrl = not args.no_encode_controls
             tokens = subtok.tokenize(line, encode_controls=enc_ctrl,add_eos=args.add_eos)
             if args.numeric:
                 tokens = map(str, tokens)
             return tokens
-        if not args.no_encode_controls:
-            line = encode_controls(line)
+        line = prepare_text(line, encode_controls=not args.no_encode_controls)
         tokens = ReTokenizer.tokenize(line, split_by_alphabets=not args.no_split_by_alphabets, lowercase = args.lowercase)
         if args.add_eos:
             tokens.append(EOS)
         return tokens
 
-    if args.processes == 1:
-        for l in sys.stdin:
-            tokens = tok_func(l)
-            sys.stdout.write(' '.join(tokens))
-            sys.stdout.write('\n')
+    def ids_func(l):
+        return subtok.tokenize(l.strip('\r\n'), numeric=True, encode_controls=not args.no_encode_controls,
+                               add_eos=args.add_eos)
+
+    stats = _create_stats(args)
+    if subtok and stats is not None:
+        subtok.stats = stats
+    if args.binary:
+        with IdsWriter(args.binary, subtok.subwords.vocab_size) as writer:
+            for ids in _map_lines(ids_func, _input_lines(args), args, stats):
+                writer.write(ids)
+    elif args.input and args.processes > 1:
+        map_file_shards(lambda l: ' '.join(tok_func(l)), args.input, _binary_stdout(), processes=args.processes,
+                        stats=stats)
     else:
-        for tokens in multiprocess(tok_func, sys.stdin, processes=args.processes):
+        for tokens in _map_lines(tok_func, _input_lines(args), args, stats):
             sys.stdout.write(' '.join(tokens))
             sys.stdout.write('\n')
+    _report_stats(args, stats)
 
 
 def detokenize(args):
     subtok = None
     if args.subwords:
-        subtok = SubTokenizer.load(args.subwords, reversed_bpe=args.reversed_bpe, lowercase=args.lowercase, numeric=args.numeric)
+        subtok = SubTokenizer.load(args.subwords, reversed_bpe=args.reversed_bpe or None, lowercase=args.lowercase, numeric=args.numeric)
+        if args.processes > 1:
+            subtok = subtok.share_memory()
 
     def detok_func(l):
         tokens = l.strip('\r\n').split(' ')
@@ -94,20 +260,44 @@ def detokenize(args):
             text = unescape(text)
         return text
 
-    if args.processes == 1:
-        for l in sys.stdin:
-            line = detok_func(l)
+    def ids_detok_func(ids):
+        return subtok.detokenize(ids, numeric=True, decode=not args.no_decode)
+
+    stats = _create_stats(args)
+    if subtok and stats is not None:
+        subtok.stats = stats
+    if args.binary:
+        lines = (ids for filename in args.input for ids in read_ids(filename))
+        for line in _map_lines(ids_detok_func, lines, args, stats):
             sys.stdout.write(line)
             sys.stdout.write('\n')
+    elif args.input and args.processes > 1:
+        map_file_shards(detok_func, args.input, _binary_stdout(), processes=args.processes, stats=stats)
     else:
-        for line in multiprocess(detok_func, sys.stdin, processes=args.processes):
+        for line in _map_lines(detok_func, _input_lines(args), args, stats):
             sys.stdout.write(line)
             sys.stdout.write('\n')
+    _report_stats(args, stats)
+
+
+def compile_vocab(args):
+    subtok = SubTokenizer.load(args.subwords, reversed_bpe=args.reversed_bpe)
+    subtok.compile(args.output)
+
+
+def serve(args):
+    # asyncio server is python 3.7 or later only
+    from subtokenizer import server
+    model_options = dict(numeric=args.numeric, split_by_alphabets=not args.no_split_by_alphabets,
+                         lowercase=args.lowercase, reversed_bpe=args.reversed_bpe or None)
+    server.serve(args.subwords, host=args.host, port=args.port, unix_path=args.unix, workers=args.processes,
+                 max_batch=args.max_batch, max_latency=args.max_latency, model_options=model_options,
+                 line_limit=args.line_limit)
 
 
 def encode(args):
     for line in sys.stdin:
-        line = encode_controls(normalize_text(line))
+        line = prepare_text(line)
         sys.stdout.write(line)
 
 
@@ -119,35 +309,105 @@ def decode(args):
 
 
 def get_parser():
+    import argparse
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(help='there are following modes: '
-                                       '1) learn 2) tokenize 3) detokenize 4) encode 5) decode', dest="mode")
+                                       '1) learn 2) tokenize 3) detokenize 4) compile 5) serve 6) encode 7) decode 8) count 9) merge', dest="mode")
     parser_learn = subparsers.add_parser('learn', help='learn subtokens from text')
     parser_learn.add_argument('-r', '--reserved',  type=str, help="file with reserved tokens")
     parser_learn.add_argument('-o', '--output', required=True,  type=str, help="subwords dictionary")
     parser_learn.add_argument('-s', '--size', default=30000,  type=int, help="number of subtokens")
-    parser_learn.add_argument('-p', '--processes', default=1,  type=int, help="number of tokenizer processes")
+    parser_learn.add_argument('-p', '--processes', default=1,  type=int, help="number of tokenizer and substring counting processes")
+    parser_learn.add_argument('--chunk_size', default=DEFAULT_CHUNK_SIZE, type=int, help="number of lines sent to a process at once")
     parser_learn.add_argument('-m', '--min_symbol_count', default=1,  type=int, help="minimal character count to be in alphabet")
     parser_learn.add_argument('-c', '--no_encode_controls', action='store_true', help="do not encode control symbols")
     parser_learn.add_argument('-a', '--no_split_by_alphabets', action='store_true', help="do not split differnt alphabets")
     parser_learn.add_argument('--lowercase', action='store_true', help="lowercase text")
     parser_learn.add_argument('--reversed_bpe', action='store_true', help="revsrse bpe")
+    parser_learn.add_argument('--subtoken_length_limit', default=None, type=int, help="subtokens are shorter than the limit")
+    parser_learn.add_argument('--suffix_array', action='store_true', help="count only frequent substrings with "
+                              "a suffix array, uses less memory on long tokens")
+    parser_learn.add_argument('--sample', default=None, type=float, help="learn on frequency weighted sample of token types, "
+                              "fraction of types if less than 1 or number of types")
+    parser_learn.add_argument('--seed', default=0, type=int, help="random seed of the sample")
+    parser_learn.add_argument('--eval', default=None, type=str, help="held out text file, quality of the "
+                              "vocabulary on them is printed to stderr; with --sample it's compared to a vocabulary "
+                              "learned on all tokens")
+    parser_learn.add_argument('--eval_json', default=None, type=str, help="write quality report to json file")
+    parser_learn.add_argument('--stats', action='store_true', help="print time per stage and other statistics to stderr")
+    parser_learn.add_argument('--stats_json', default=None, type=str, help="write statistics to json file")
+    parser_learn.add_argument('input', nargs='*', help="input files, stdin by default; with several processes "
+                              "every process reads its own part of files")
+    parser_learn.add_argument('--max_tokens', default=None, type=int, help="maximal number of distinct tokens kept in memory while counting, "
+                              "least frequent tokens are pruned and counts become approximate")
+    parser_learn.add_argument('--counts', default=None, type=str, action='append', help="token counts file written by "
+                              "count or merge instead of text, can be repeated; tokenizer options are taken from it")
+    parser_count = subparsers.add_parser('count', help='count tokens of text to binary file sorted by token')
+    parser_count.add_argument('-o', '--output', required=True, type=str, help="token counts file")
+    parser_count.add_argument('-p', '--processes', default=1, type=int, help="number of tokenizer processes")
+    parser_count.add_argument('--chunk_size', default=DEFAULT_CHUNK_SIZE, type=int, help="number of lines sent to a process at once")
+    parser_count.add_argument('-c', '--no_encode_controls', action='store_true', help="do not encode control symbols")
+    parser_count.add_argument('-a', '--no_split_by_alphabets', action='store_true', help="do not split differnt alphabets")
+    parser_count.add_argument('--lowercase', action='store_true', help="lowercase text")
+    parser_count.add_argument('--max_tokens', default=None, type=int, help="maximal number of distinct tokens kept in memory while counting, "
+                              "least frequent tokens are pruned and counts become approximate")
+    parser_count.add_argument('--stats', action='store_true', help="print time per stage and other statistics to stderr")
+    parser_count.add_argument('--stats_json', default=None, type=str, help="write statistics to json file")
+    parser_count.add_argument('input', nargs='*', help="input files, stdin by default; with several processes "
+                              "every process reads its own part of files")
+    parser_merge = subparsers.add_parser('merge', help='merge token counts files')
+    parser_merge.add_argument('-o', '--output', required=True, type=str, help="merged token counts file")
+    parser_merge.add_argument('input', nargs='+', help="token counts files counted with the same tokenizer options")
     parser_tokenize = subparsers.add_parser('tokenize', help='tokenize text')
     parser_tokenize.add_argument('-s', '--subwords',  default=None, type=str, help="subwords dictionary")
     parser_tokenize.add_argument('-n', '--numeric',  action='store_true', help="numeric output")
     parser_tokenize.add_argument('-p', '--processes', default=1,  type=int, help="number of tokenizer processes") 
+    parser_tokenize.add_argument('--chunk_size', default=DEFAULT_CHUNK_SIZE, type=int, help="number of lines sent to a process at once")
     parser_tokenize.add_argument('-e', '--add_eos', action='store_true', help="add end of line")
     parser_tokenize.add_argument('-c', '--no_encode_controls', action='store_true', help="do not encode control symbols")
     parser_tokenize.add_argument('-a', '--no_split_by_alphabets', action='store_true', help="do not split differnt alphabets")
     parser_tokenize.add_argument('--lowercase', action='store_true', help="lowercase text")
     parser_tokenize.add_argument('--reversed_bpe', action='store_true', help="revsrse bpe")
+    parser_tokenize.add_argument('--stats', action='store_true', help="print time per stage and other statistics to stderr")
+    parser_tokenize.add_argument('--stats_json', default=None, type=str, help="write statistics to json file")
+    parser_tokenize.add_argument('input', nargs='*', help="input files, stdin by default; with several processes "
+                              "every process reads its own part of files")
+    parser_tokenize.add_argument('--cache_size', default=DEFAULT_CACHE_SIZE, type=int, help="number of cached segmented words, 0 disables cache")
+    parser_tokenize.add_argument('--word_cache_size', default=DEFAULT_WORD_CACHE_SIZE, type=int, help="number of cached tokenized words, 0 disables cache")
+    parser_tokenize.add_argument('--binary', default=None, type=str, help="write token ids to binary file and its "
+                                 "index to the file with .idx suffix, uint16 or uint32 by vocabulary size")
+    parser_tokenize.add_argument('--prewarm', default=0, type=int, help="number of the most frequent vocabulary words put in word cache on load")
     parser_detokenize = subparsers.add_parser('detokenize', help='restore tokenized text')
     parser_detokenize.add_argument('-s', '--subwords',  default=None, type=str, help="subwords dictionary")
     parser_detokenize.add_argument('-n', '--numeric',  action='store_true', help="numeric output")
     parser_detokenize.add_argument('-p', '--processes', default=1,  type=int, help="number of tokenizer processes")
+    parser_detokenize.add_argument('--chunk_size', default=DEFAULT_CHUNK_SIZE, type=int, help="number of lines sent to a process at once")
     parser_detokenize.add_argument('-d', '--no_decode', action='store_true', help="do not decode encoded symbols")
     parser_detokenize.add_argument('--lowercase', action='store_true', help="restore lowercased text")
     parser_detokenize.add_argument('--reversed_bpe', action='store_true', help="revsrse bpe")
+    parser_detokenize.add_argument('--binary', action='store_true', help="input files are binary token ids "
+                                   "written by tokenize --binary")
+    parser_detokenize.add_argument('--stats', action='store_true', help="print time per stage and other statistics to stderr")
+    parser_detokenize.add_argument('--stats_json', default=None, type=str, help="write statistics to json file")
+    parser_detokenize.add_argument('input', nargs='*', help="input files, stdin by default; with several processes "
+                              "every process reads its own part of files")
+    parser_compile = subparsers.add_parser('compile', help='compile subwords dictionary to memory mapped binary format')
+    parser_compile.add_argument('-s', '--subwords', required=True, type=str, help="subwords dictionary")
+    parser_compile.add_argument('-o', '--output', required=True, type=str, help="compiled subwords dictionary")
+    parser_compile.add_argument('--reversed_bpe', action='store_true', help="revsrse bpe")
+    parser_serve = subparsers.add_parser('serve', help='tokenization server with json lines protocol')
+    parser_serve.add_argument('-s', '--subwords', required=True, type=str, help="subwords dictionary")
+    parser_serve.add_argument('-n', '--numeric',  action='store_true', help="numeric output by default")
+    parser_serve.add_argument('-p', '--processes', default=1,  type=int, help="number of worker processes, 0 to work in a thread")
+    parser_serve.add_argument('--host', default='127.0.0.1', type=str, help="host to listen")
+    parser_serve.add_argument('--port', default=8765, type=int, help="port to listen")
+    parser_serve.add_argument('--unix', default=None, type=str, help="unix socket path to listen instead of host and port")
+    parser_serve.add_argument('--max_batch', default=64, type=int, help="maximal number of requests in a batch")
+    parser_serve.add_argument('--max_latency', default=0.005, type=float, help="maximal time in seconds to wait for a batch to fill")
+    parser_serve.add_argument('--line_limit', default=1 << 24, type=int, help="maximal length of a request line in bytes")
+    parser_serve.add_argument('-a', '--no_split_by_alphabets', action='store_true', help="do not split differnt alphabets")
+    parser_serve.add_argument('--lowercase', action='store_true', help="lowercase text")
+    parser_serve.add_argument('--reversed_bpe', action='store_true', help="revsrse bpe")
     parser_decode = subparsers.add_parser('decode', help='decoding encoded symbols')
     parser_encode = subparsers.add_parser('encode', help='unicode normalization and encodeing contrlos symbols')
     return parser
@@ -165,12 +425,30 @@ def main():
 
     parser = get_parser()
     args = parser.parse_args()
+    if getattr(args, 'binary', None) and not args.subwords:
+        parser.error("--binary requires subwords dictionary")
+    if args.mode == 'detokenize' and args.binary and not args.input:
+        parser.error("--binary requires input files")
+    if args.mode == 'learn' and args.counts and args.input:
+        parser.error("--counts can't be used with input files")
+    if args.mode == 'learn' and args.sample is not None and args.sample <= 0:
+        parser.error("--sample must be positive")
+    if args.mode == 'serve' and sys.version_info < (3, 7):
+        parser.error("serve requires python 3.7 or later")
     if args.mode == 'learn':
         learn(args)
+    elif args.mode == 'count':
+        count(args)
+    elif args.mode == 'merge':
+        merge(args)
     elif args.mode == 'tokenize':
         tokenize(args)
     elif args.mode == 'detokenize':
         detokenize(args)
+    elif args.mode == 'compile':
+        compile_vocab(args)
+    elif args.mode == 'serve':
+        serve(args)
     elif args.mode == 'decode':
         decode(args)
     elif args.mode == 'encode':
@@ -0,0 +1,165 @@
+# coding: utf-8
+"""Binary files of token ids.
+
+Ids of all lines are stored one after another in the data file as uint16
+if vocabulary has at most 65536 subtokens and as uint32 otherwise, in the
+byte order stored in the index header. Layout of the index file
+`<data file>.idx`:
+    INDEX_MAGIC
+    header length (uint32, little endian)
+    header: utf-8 json with byte order and dtype, padded to 8 bytes
+    offsets: uint64 offset of the first id of every line, then total number of ids
+
+Both files can be memory mapped as numpy arrays, ids of line i are
+ids[offsets[i]:offsets[i + 1]].
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import io
+import sys
+import json
+import mmap
+import six
+import struct
+from array import array
+
+INDEX_MAGIC = b'SUBTOKI1'
+OFFSET_SIZE = 8
+DTYPES = {'uint16': 2, 'uint32': 4}
+
+
+def index_filename(filename):
+    return filename + '.idx'
+
+
+def dtype_for_vocab_size(vocab_size):
+    return 'uint16' if vocab_size <= 2 ** 16 else 'uint32'
+
+
+def _typecode(size):
+    for typecode in 'HILQ':
+        try:
+            if array(str(typecode)).itemsize == size:
+                return typecode
+        except ValueError:
+            # 'Q' is not available in python 2
+            pass
+    raise ValueError("no array type of {0} bytes".format(size))
+
+
+def _read_header(data, filename):
+    if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError("{0} is not an index of token ids".format(filename))
+    position = len(INDEX_MAGIC)
+    header_len, = struct.unpack('<I', data[position:position + 4])
+    position += 4
+    header = json.loads(data[position:position + header_len].decode('utf-8'))
+    if header['byteorder'] != sys.byteorder:
+        raise ValueError("{0} was written on a machine with different byte order".format(filename))
+    return header, position + header_len
+
+
+class IdsWriter(object):
+    """Writes token ids of lines to data and index files.
+
+    Offsets are written as lines come, so memory use does not depend on
+    the number of lines.
+    """
+
+    def __init__(self, filename, vocab_size):
+        self.dtype = dtype_for_vocab_size(vocab_size)
+        self.typecode = _typecode(DTYPES[self.dtype])
+        self.offset_typecode = _typecode(OFFSET_SIZE)
+        self.data = io.open(filename, 'wb')
+        self.index = io.open(index_filename(filename), 'wb')
+        header = json.dumps({'byteorder': sys.byteorder, 'dtype': self.dtype}).encode('utf-8')
+        header += b' ' * (-(len(INDEX_MAGIC) + 4 + len(header)) % OFFSET_SIZE)
+        self.index.write(INDEX_MAGIC)
+        self.index.write(struct.pack('<I', len(header)))
+        self.index.write(header)
+        self.lines = 0
+        self.total = 0
+        self._write_offset()
+
+    def _write_offset(self):
+        self.index.write(array(str(self.offset_typecode), [self.total]).tobytes())
+
+    def write(self, ids):
+        values = array(str(self.typecode), ids)
+        self.data.write(values.tobytes())
+        self.total += len(values)
+        self.lines += 1
+        self._write_offset()
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _cast(view, typecode):
+    if six.PY2:
+        # memoryview.cast is not available, arrays are copied.
+        return array(str(typecode), view.tobytes())
+    return view.cast(str(typecode))
+
+
+def _release(views):
+    if not six.PY2:
+        # mmap can't be closed while views of it exist
+        for view in reversed(views):
+            view.release()
+
+
+def read_ids(filename):
+    """Yields lists of token ids of lines, numpy is not required.
+    Both files are memory mapped, memory use does not depend on their size.
+    """
+    with io.open(index_filename(filename), 'rb') as f:
+        index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    data = None
+    views = []
+    try:
+        header, position = _read_header(index, filename)
+        views.append(memoryview(index))
+        views.append(views[-1][position:])
+        offsets = _cast(views[-1], _typecode(OFFSET_SIZE))
+        views.append(offsets)
+        lines = len(offsets) - 1
+        if offsets[lines] == 0:
+            # mmap of an empty file fails
+            for _ in range(lines):
+                yield []
+            return
+        with io.open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        views.append(memoryview(data))
+        ids = _cast(views[-1], _typecode(DTYPES[header['dtype']]))
+        views.append(ids)
+        for i in range(lines):
+            yield ids[offsets[i]:offsets[i + 1]].tolist()
+    finally:
+        _release(views)
+        if data is not None:
+            data.close()
+        index.close()
+
+
+def load_ids(filename):
+    """Memory maps token ids, requires numpy.
+    Returns:
+        Tuple of 1-D ids and offsets arrays, ids of line i are ids[offsets[i]:offsets[i + 1]].
+    """
+    import numpy as np
+    with io.open(index_filename(filename), 'rb') as f:
+        header, position = _read_header(f.read(4096), filename)
+    offsets = np.memmap(index_filename(filename), dtype=np.uint64, mode='r', offset=position)
+    if offsets[-1] == 0:
+        return np.zeros(0, dtype=header['dtype']), offsets
+    ids = np.memmap(filename, dtype=header['dtype'], mode='r', shape=(int(offsets[-1]),))
+    return ids, offsets
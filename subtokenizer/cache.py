@@ -0,0 +1,137 @@
+# coding: utf-8
+from __future__ import unicode_literals, division, absolute_import
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Bounded least recently used cache with hit, miss and eviction counters.
+
+    Storage is allocated on the first insert, so unused caches cost nothing.
+    A cache with size 0 is disabled: it never stores anything.
+
+    The cache may be shared by threads without locks: every access is a
+    single dict operation and a race can only lose an entry, evict one more
+    entry or miscount statistics. Cached values must depend only on the key.
+    """
+
+    def __init__(self, size):
+        self.size = max(0, size or 0)
+        self.data = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data) if self.data is not None else 0
+
+    def get(self, key):
+        """Returns cached value for the key or None."""
+        data = self.data
+        if data is None:
+            self.misses += 1
+            return None
+        try:
+            # Another thread may pop the key at the same time, it's a miss then.
+            value = data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if not self.size:
+            return
+        data = self.data
+        if data is None:
+            data = self.data = OrderedDict()
+        elif key not in data and len(data) >= self.size:
+            try:
+                data.popitem(last=False)
+            except KeyError:
+                # emptied by other threads
+                pass
+            self.evictions += 1
+        data[key] = value
+
+    def clear(self):
+        self.data = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': self.size,
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class MemoCache(object):
+    """Bounded memo for hot loops, callers probe the `data` dict directly.
+
+    A miss in `data` is passed to `lookup_miss`, which looks in the previous
+    generation. When `data` is full it becomes the previous generation and
+    is cleared, so keys used since then survive and at most 2 * size entries
+    are kept. Callers add to `lookups`, hits are lookups that did not miss.
+
+    Like LRUCache it may be shared by threads without locks, a race can only
+    lose an entry or miscount statistics.
+    """
+
+    def __init__(self, size):
+        self.size = max(0, size or 0)
+        self.data = {}
+        self.previous = {}
+        self.lookups = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data) + len(self.previous)
+
+    def get(self, key):
+        """Returns cached value for the key or None."""
+        self.lookups += 1
+        value = self.data.get(key)
+        if value is None:
+            value = self.lookup_miss(key)
+        return value
+
+    def lookup_miss(self, key):
+        """Returns value of the key missing in `data` from the previous generation or None."""
+        value = self.previous.pop(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if not self.size:
+            return
+        if len(self.data) >= self.size:
+            self.evictions += len(self.previous)
+            # `data` keeps its identity, callers may hold a reference to it.
+            self.previous = dict(self.data)
+            self.data.clear()
+        self.data[key] = value
+
+    def clear(self):
+        self.data.clear()
+        self.previous = {}
+
+    def stats(self):
+        hits = self.lookups - self.misses
+        return {
+            'size': self.size,
+            'entries': len(self),
+            'hits': hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': hits / self.lookups if self.lookups else 0.0,
+        }
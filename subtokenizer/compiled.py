@@ -0,0 +1,292 @@
+# coding: utf-8
+"""Compiled binary vocabulary.
+
+Layout of the file (all integers are int32 in the byte order stored in the header):
+    MAGIC
+    header length (uint32, little endian)
+    header: utf-8 json with options, alphabet and array sizes, padded to 4 bytes
+    base, check, value: arrays of the double-array trie
+    string offsets: offset of every subtoken string and the end of the last one
+    subtoken strings, each followed by '\\n', utf-8
+
+The file is memory mapped on load, trie arrays and strings are used in place,
+so loading does not depend on vocabulary size and pages are shared between
+processes. No python object is created per subtoken, so forked processes
+reading the vocabulary don't copy its pages by reference counting or garbage
+collection.
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import io
+import sys
+import json
+import mmap
+import six
+import struct
+from array import array
+from collections import deque
+from subtokenizer.subwords import SubtokenTrie
+
+MAGIC = b'SUBTOKC2'
+INT_SIZE = 4
+
+
+def is_compiled(filename):
+    with io.open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class DoubleArrayTrie(object):
+    """Read-only prefix trie stored in three int arrays.
+
+    Characters are mapped to codes 1..N, the transition from state s by
+    code c leads to state t = base[s] + c if check[t] == s. value[t] is the
+    subtoken id ending in state t or -1.
+    """
+
+    def __init__(self, codes, base, check, value):
+        self.codes = codes
+        self.base = base
+        self.check = check
+        self.value = value
+
+    @classmethod
+    def build(cls, subtokens_list, alphabet_chars):
+        codes = {ch: i + 1 for i, ch in enumerate(alphabet_chars)}
+        base = [0]
+        check = [-2]  # root state is never a child
+        value = [-1]
+        first_free = 1
+        queue = deque([(SubtokenTrie(subtokens_list).root, 0)])
+        while queue:
+            node, state = queue.popleft()
+            children = sorted((codes[ch], child) for ch, child in node.items() if ch != SubtokenTrie.LEAF)
+            if SubtokenTrie.LEAF in node:
+                value[state] = node[SubtokenTrie.LEAF]
+            if not children:
+                continue
+            while first_free < len(check) and check[first_free] != -1:
+                first_free += 1
+            state_base = max(first_free - children[0][0], 1)
+            attempts = 0
+            while True:
+                for code, _ in children:
+                    position = state_base + code
+                    if position < len(check) and check[position] != -1:
+                        break
+                else:
+                    break
+                state_base += 1
+                attempts += 1
+            # Leave densely packed area behind, rare holes are not worth searching.
+            if attempts > 64:
+                first_free = state_base + children[0][0]
+            last = state_base + children[-1][0]
+            if last >= len(check):
+                grow = last + 1 - len(check)
+                base.extend([0] * grow)
+                check.extend([-1] * grow)
+                value.extend([-1] * grow)
+            base[state] = state_base
+            for code, child in children:
+                check[state_base + code] = state
+                queue.append((child, state_base + code))
+        return cls(codes, base, check, value)
+
+    def lookup(self, token):
+        """Returns id of the subtoken equal to token or None."""
+        codes = self.codes
+        base = self.base
+        check = self.check
+        size = len(check)
+        state = 0
+        for ch in token:
+            code = codes.get(ch)
+            if code is None:
+                return None
+            next_state = base[state] + code
+            if next_state >= size or check[next_state] != state:
+                return None
+            state = next_state
+        value = self.value[state] if token else -1
+        return value if value >= 0 else None
+
+    def segment(self, token):
+        """Same as SubtokenTrie.segment."""
+        codes = self.codes
+        base = self.base
+        check = self.check
+        value = self.value
+        size = len(check)
+        subtokens = []
+        ids = []
+        start = 0
+        token_len = len(token)
+        while start < token_len:
+            state = 0
+            position = start
+            end = start
+            subtoken_id = -1
+            while position < token_len:
+                code = codes.get(token[position])
+                if code is None:
+                    break
+                next_state = base[state] + code
+                if next_state >= size or check[next_state] != state:
+                    break
+                state = next_state
+                position += 1
+                match = value[state]
+                if match >= 0:
+                    end = position
+                    subtoken_id = match
+            assert subtoken_id >= 0, "Token substring not found in subtoken vocabulary."
+            subtokens.append(token[start:end])
+            ids.append(subtoken_id)
+            start = end
+        return subtokens, ids
+
+
+class TrieIds(object):
+    """Read-only mapping of subtoken string to id looked up in a DoubleArrayTrie."""
+
+    def __init__(self, trie, size):
+        self.trie = trie
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, subtoken):
+        return self.trie.lookup(subtoken) is not None
+
+    def __getitem__(self, subtoken):
+        subtoken_id = self.trie.lookup(subtoken)
+        if subtoken_id is None:
+            raise KeyError(subtoken)
+        return subtoken_id
+
+    def get(self, subtoken, default=None):
+        subtoken_id = self.trie.lookup(subtoken)
+        return default if subtoken_id is None else subtoken_id
+
+
+class MappedStrings(object):
+    """Read-only sequence of strings decoded from utf-8 buffer on access.
+    String i is data[start + offsets[i]:start + offsets[i + 1] - 1], the last byte is a separator.
+    """
+
+    def __init__(self, data, offsets, start=0):
+        self.data = data
+        self.offsets = offsets
+        self.start = start
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("subtoken index out of range")
+        start = self.start
+        return self.data[start + self.offsets[index]:start + self.offsets[index + 1] - 1].decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def _compiled_parts(subtokens_list, reversed_bpe):
+    alphabet = sorted({c for token in subtokens_list for c in token})
+    trie = DoubleArrayTrie.build(subtokens_list, alphabet)
+    # Every string is followed by '\n', so it ends one byte before the next offset.
+    strings = b''.join(s.encode('utf-8') + b'\n' for s in subtokens_list)
+    offsets = [0]
+    for s in subtokens_list:
+        offsets.append(offsets[-1] + len(s.encode('utf-8')) + 1)
+    header = json.dumps({
+        'byteorder': sys.byteorder,
+        'reversed_bpe': reversed_bpe,
+        'alphabet': ''.join(alphabet),
+        'max_subtoken_len': max(len(s) for s in subtokens_list),
+        'vocab_size': len(subtokens_list),
+        'array_size': len(trie.check),
+    }).encode('utf-8')
+    header += b' ' * (-len(header) % INT_SIZE)
+    parts = [MAGIC, struct.pack('<I', len(header)), header]
+    for values in (trie.base, trie.check, trie.value, offsets):
+        parts.append(array(str('i'), values).tobytes())
+    parts.append(strings)
+    return parts
+
+
+def compile_vocabulary(subtokens_list, filename, reversed_bpe=False):
+    """Writes compiled vocabulary.
+    Args:
+        subtokens_list: subtoken strings as used by Subwords, reversed for reversed bpe.
+        filename: output file name.
+        reversed_bpe: whether subtokens_list is reversed.
+    """
+    with io.open(filename, 'wb') as f:
+        for part in _compiled_parts(subtokens_list, reversed_bpe):
+            f.write(part)
+
+
+def _int_array(buf):
+    if six.PY2:
+        # memoryview.cast is not available, arrays are copied.
+        return array(str('i'), buf.tobytes())
+    return buf.cast('i')
+
+
+class CompiledVocabulary(object):
+    """Memory mapped compiled vocabulary."""
+
+    def __init__(self, filename=None, data=None):
+        if data is None:
+            with io.open(filename, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mmap = data
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError("{0} is not a compiled vocabulary".format(filename))
+        position = len(MAGIC)
+        header_len, = struct.unpack('<I', self.mmap[position:position + 4])
+        position += 4
+        header = json.loads(self.mmap[position:position + header_len].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError("{0} was compiled on a machine with different byte order".format(filename))
+        position += header_len
+        self.reversed_bpe = header['reversed_bpe']
+        self.max_subtoken_len = header['max_subtoken_len']
+        self.alphabet = set(header['alphabet'])
+        view = memoryview(self.mmap)
+        array_bytes = header['array_size'] * INT_SIZE
+        arrays = []
+        for _ in range(3):
+            arrays.append(_int_array(view[position:position + array_bytes]))
+            position += array_bytes
+        codes = {ch: i + 1 for i, ch in enumerate(header['alphabet'])}
+        self.trie = DoubleArrayTrie(codes, *arrays)
+        vocab_size = header['vocab_size']
+        offsets_bytes = (vocab_size + 1) * INT_SIZE
+        offsets = _int_array(view[position:position + offsets_bytes])
+        self.subtokens_list = MappedStrings(self.mmap, offsets, position + offsets_bytes)
+        self.subtoken_ids = TrieIds(self.trie, vocab_size)
+
+    @classmethod
+    def in_memory(cls, subtokens_list, reversed_bpe=False):
+        """Compiles vocabulary into anonymous shared memory, forked processes share its pages."""
+        parts = _compiled_parts(subtokens_list, reversed_bpe)
+        data = mmap.mmap(-1, sum(len(part) for part in parts))
+        for part in parts:
+            data.write(part)
+        return cls(data=data)
@@ -0,0 +1,161 @@
+# coding: utf-8
+"""Binary files of token counts sorted by token.
+
+Counting tokens and learning vocabulary are separate stages: counts of
+corpus parts are written by `subtokenizer count`, shards are merged by
+`subtokenizer merge` in one pass over sorted files and `subtokenizer learn`
+reads counts instead of text. Layout of a counts file:
+    COUNTS_MAGIC
+    header length (uint32, little endian)
+    header: utf-8 json with tokenizer options, total number of tokens and
+        counting error bound
+    records sorted by token: varint token length in bytes, utf-8 token,
+        varint count
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import io
+import json
+import heapq
+import struct
+from itertools import groupby
+
+COUNTS_MAGIC = b'SUBTOKN1'
+# options of ReTokenizer.tokenize and prepare_text, shards must have the same ones
+TOKENIZER_OPTIONS = ('encode_controls', 'split_by_alphabets', 'lowercase')
+BUFFER_SIZE = 1 << 20
+
+
+def _varint(value):
+    result = bytearray()
+    while value > 0x7f:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def write_counts(filename, token_counts, total=None, error=0, **options):
+    """Writes token counts sorted by token.
+    Args:
+        token_counts: dict of token to count or iterable of (token, count) sorted by token.
+        total: number of counted tokens, sum of counts by default.
+        error: upper bound of count underestimation, see StreamingCounter.
+        options: tokenizer options the tokens were produced with.
+    Returns:
+        Number of written tokens.
+    """
+    if isinstance(token_counts, dict):
+        if total is None:
+            total = sum(token_counts.values())
+        token_counts = sorted(token_counts.items())
+    header = dict(options, total=total, error=error)
+    header = json.dumps(header, sort_keys=True).encode('utf-8')
+    tokens = 0
+    with io.open(filename, 'wb') as f:
+        f.write(COUNTS_MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        buf = bytearray()
+        for token, count in token_counts:
+            token = token.encode('utf-8')
+            buf += _varint(len(token))
+            buf += token
+            buf += _varint(count)
+            tokens += 1
+            if len(buf) >= BUFFER_SIZE:
+                f.write(buf)
+                del buf[:]
+        f.write(buf)
+    return tokens
+
+
+def _read_header(f, filename):
+    if f.read(len(COUNTS_MAGIC)) != COUNTS_MAGIC:
+        raise ValueError("{0} is not a token counts file".format(filename))
+    header_len, = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(header_len).decode('utf-8'))
+
+
+def read_header(filename):
+    with io.open(filename, 'rb') as f:
+        return _read_header(f, filename)
+
+
+def iter_counts(filename):
+    """Yields (token, count) sorted by token, the file is read by blocks."""
+    with io.open(filename, 'rb') as f:
+        _read_header(f, filename)
+        buf = bytearray()
+        position = 0
+        eof = False
+        while True:
+            # A record is complete if both varints and the token are in the buffer.
+            end = len(buf)
+            while position < end:
+                length = shift = 0
+                i = position
+                while i < end and buf[i] & 0x80:
+                    length |= (buf[i] & 0x7f) << shift
+                    shift += 7
+                    i += 1
+                if i >= end:
+                    break
+                length |= buf[i] << shift
+                start = i + 1
+                i = start + length
+                count = shift = 0
+                while i < end and buf[i] & 0x80:
+                    count |= (buf[i] & 0x7f) << shift
+                    shift += 7
+                    i += 1
+                if i >= end:
+                    break
+                count |= buf[i] << shift
+                yield buf[start:start + length].decode('utf-8'), count
+                position = i + 1
+            if eof:
+                if position < end:
+                    raise ValueError("{0} is truncated".format(filename))
+                return
+            del buf[:position]
+            position = 0
+            block = f.read(BUFFER_SIZE)
+            eof = not block
+            buf += block
+
+
+def _merge_headers(filenames):
+    headers = [read_header(filename) for filename in filenames]
+    options = {name: headers[0].get(name) for name in TOKENIZER_OPTIONS}
+    for filename, header in zip(filenames, headers):
+        if any(header.get(name) != value for name, value in options.items()):
+            raise ValueError("{0} is counted with different tokenizer options than {1}".format(filename, filenames[0]))
+    # error bounds add up as in StreamingCounter.merge
+    return dict(options, total=sum(h['total'] for h in headers), error=sum(h['error'] for h in headers))
+
+
+def iter_merged_counts(filenames):
+    """Yields (token, count) of several counts files summed by token, k-way merge of sorted files.
+    Returns:
+        Tuple of merged header and iterator.
+    """
+    header = _merge_headers(filenames)
+    merged = heapq.merge(*[iter_counts(filename) for filename in filenames])
+    counts = ((token, sum(count for _, count in group)) for token, group in groupby(merged, key=lambda x: x[0]))
+    return header, counts
+
+
+def merge_files(filenames, output):
+    """Merges counts files into output, memory use does not depend on the number of tokens.
+    Returns:
+        Number of distinct tokens.
+    """
+    header, counts = iter_merged_counts(filenames)
+    return write_counts(output, counts, **header)
+
+
+def load_counts(filenames):
+    """Returns tuple of merged header and dict of token to count."""
+    header, counts = iter_merged_counts(filenames)
+    return header, dict(counts)
@@ -0,0 +1,311 @@
+# coding: utf-8
+"""Tokenization server, python 3.7 or later.
+
+Protocol is one json object per line in both directions:
+    request:  {"id": 1, "op": "tokenize", "text": "...", "numeric": true, "add_eos": false}
+              {"id": 2, "op": "detokenize", "tokens": [...], "numeric": true}
+    response: {"id": 1, "result": [...]} or {"id": 1, "error": "..."}
+Responses are sent as soon as they are ready, so a client can send many
+requests without waiting and match responses by id. A request line longer
+than `line_limit` bytes gets an error response with null id and the
+connection is closed, as the rest of the line can't be told from the next
+requests.
+
+Concurrent requests are collected into batches of at most `max_batch`
+requests waiting at most `max_latency` seconds, batches are processed by
+worker processes each holding a loaded model.
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import json
+import time
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from subtokenizer.subtokenizer import SubTokenizer
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_LATENCY = 0.005
+DEFAULT_LINE_LIMIT = 1 << 24
+
+_WORKER_MODEL = None
+
+
+def _init_worker(filename, model_options):
+    global _WORKER_MODEL
+    _WORKER_MODEL = SubTokenizer.load(filename, **model_options)
+
+
+def process_batch(requests, model=None):
+    """Processes list of request dicts, returns list of response dicts without ids."""
+    model = model or _WORKER_MODEL
+    responses = []
+    for request in requests:
+        try:
+            op = request.get('op')
+            if op == 'tokenize':
+                result = model.tokenize(request['text'], numeric=request.get('numeric'),
+                                        add_eos=request.get('add_eos', False),
+                                        encode_controls=request.get('encode_controls', True))
+            elif op == 'detokenize':
+                result = model.detokenize(request['tokens'], numeric=request.get('numeric'),
+                                          decode=request.get('decode', True))
+            else:
+                raise ValueError("unknown op: {0}".format(op))
+            responses.append({'result': result})
+        except Exception as e:
+            responses.append({'error': '{0}: {1}'.format(type(e).__name__, e)})
+    return responses
+
+
+class Batcher(object):
+    """Collects concurrent requests into batches processed in executor."""
+
+    def __init__(self, executor, func, max_batch=DEFAULT_MAX_BATCH, max_latency=DEFAULT_MAX_LATENCY,
+                 max_pending_batches=4):
+        self.executor = executor
+        self.func = func
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue = asyncio.Queue()
+        self.pending_batches = asyncio.Semaphore(max_pending_batches)
+        self.batches = 0
+        self.requests = 0
+        self.connections = set()
+
+    async def submit(self, request):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Waiting here stops batching when all workers are busy.
+            await self.pending_batches.acquire()
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_event_loop()
+        try:
+            responses = await loop.run_in_executor(self.executor, self.func, [request for request, _ in batch])
+        except Exception as e:
+            responses = [{'error': '{0}: {1}'.format(type(e).__name__, e)}] * len(batch)
+        finally:
+            self.pending_batches.release()
+        self.batches += 1
+        self.requests += len(batch)
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+def _write_response(writer, response):
+    writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+async def _handle_request(batcher, line, writer):
+    try:
+        # UnicodeDecodeError is a ValueError, it's answered like malformed json
+        request = json.loads(line.decode('utf-8'))
+        if not isinstance(request, dict):
+            raise ValueError("request is not a json object")
+    except ValueError as e:
+        response = {'id': None, 'error': 'ValueError: {0}'.format(e)}
+    else:
+        response = dict(await batcher.submit(request))
+        response['id'] = request.get('id')
+    _write_response(writer, response)
+
+
+async def _handle_connection(batcher, reader, writer):
+    connection = asyncio.current_task()
+    batcher.connections.add(connection)
+    tasks = set()
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError as e:
+                _write_response(writer, {'id': None, 'error': 'ValueError: {0}'.format(e)})
+                break
+            if not line:
+                break
+            task = asyncio.ensure_future(_handle_request(batcher, line, writer))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            await writer.drain()
+        if tasks:
+            await asyncio.wait(tasks)
+        await writer.drain()
+    finally:
+        writer.close()
+        batcher.connections.discard(connection)
+
+
+async def start_server(model, host='127.0.0.1', port=DEFAULT_PORT, unix_path=None, workers=0,
+                       max_batch=DEFAULT_MAX_BATCH, max_latency=DEFAULT_MAX_LATENCY, model_options=None,
+                       line_limit=DEFAULT_LINE_LIMIT):
+    """Starts server.
+    Args:
+        model: SubTokenizer instance used in threads if workers is 0,
+            or subwords file name loaded by every worker process.
+        unix_path: listen on unix socket instead of host and port.
+        workers: number of worker processes, 0 processes batches in a thread.
+        model_options: keyword arguments of SubTokenizer.load.
+        line_limit: maximal length of a request line in bytes.
+    Returns:
+        asyncio server and Batcher.
+    """
+    if workers:
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model, model_options or {}))
+        func = process_batch
+        max_pending_batches = 2 * workers
+        # Start workers before accepting connections, forked later they would
+        # inherit connection sockets and keep them open after close.
+        await asyncio.get_event_loop().run_in_executor(executor, process_batch, [])
+    else:
+        if not isinstance(model, SubTokenizer):
+            model = SubTokenizer.load(model, **(model_options or {}))
+        executor = ThreadPoolExecutor(1)
+        func = functools.partial(process_batch, model=model)
+        max_pending_batches = 2
+    batcher = Batcher(executor, func, max_batch, max_latency, max_pending_batches)
+    batcher.task = asyncio.ensure_future(batcher.run())
+    handler = functools.partial(_handle_connection, batcher)
+    if unix_path:
+        server = await asyncio.start_unix_server(handler, unix_path, limit=line_limit)
+    else:
+        server = await asyncio.start_server(handler, host, port, limit=line_limit)
+    return server, batcher
+
+
+async def stop_server(server, batcher):
+    """Stops accepting connections, waits for open ones and stops workers."""
+    server.close()
+    await server.wait_closed()
+    if batcher.connections:
+        await asyncio.wait(list(batcher.connections))
+    batcher.task.cancel()
+    try:
+        await batcher.task
+    except asyncio.CancelledError:
+        pass
+    batcher.executor.shutdown()
+
+
+def serve(model, **kwargs):
+    """Runs server until interrupted, arguments are the same as in start_server."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server, batcher = loop.run_until_complete(start_server(model, **kwargs))
+    try:
+        loop.run_until_complete(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(stop_server(server, batcher))
+        loop.close()
+
+
+class Client(object):
+    """Client sending requests over one connection without waiting for responses."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.read_task = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=DEFAULT_PORT, unix_path=None, line_limit=DEFAULT_LINE_LIMIT):
+        if unix_path:
+            reader, writer = await asyncio.open_unix_connection(unix_path, limit=line_limit)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=line_limit)
+        return cls(reader, writer)
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line.decode('utf-8'))
+            future = self.waiting.pop(response.pop('id'), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+        for future in self.waiting.values():
+            future.set_exception(ConnectionError("connection closed"))
+
+    async def request(self, op, **kwargs):
+        request_id = self.next_id
+        self.next_id += 1
+        future = asyncio.get_event_loop().create_future()
+        self.waiting[request_id] = future
+        kwargs.update(id=request_id, op=op)
+        self.writer.write(json.dumps(kwargs, ensure_ascii=False).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        response = await future
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    async def tokenize(self, text, **kwargs):
+        return await self.request('tokenize', text=text, **kwargs)
+
+    async def detokenize(self, tokens, **kwargs):
+        return await self.request('detokenize', tokens=tokens, **kwargs)
+
+    async def close(self):
+        self.writer.close()
+        await self.read_task
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def generate_load(lines, requests=1000, concurrency=32, connections=4, host='127.0.0.1',
+                        port=DEFAULT_PORT, unix_path=None, **request_options):
+    """Sends tokenize requests for lines with fixed concurrency.
+    Returns:
+        Tuple of statistics dict and dict of line index to result for checking.
+    """
+    clients = [await Client.connect(host, port, unix_path) for _ in range(connections)]
+    latencies = []
+    results = {}
+    counter = iter(range(requests))
+
+    async def user(client):
+        for i in counter:
+            start = time.time()
+            results[i % len(lines)] = await client.tokenize(lines[i % len(lines)], **request_options)
+            latencies.append(time.time() - start)
+
+    start = time.time()
+    await asyncio.gather(*(user(clients[i % connections]) for i in range(concurrency)))
+    seconds = time.time() - start
+    for client in clients:
+        await client.close()
+    stats = {
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else 0.0,
+        'latency_p50': _percentile(latencies, 0.5),
+        'latency_p95': _percentile(latencies, 0.95),
+        'latency_p99': _percentile(latencies, 0.99),
+    }
+    return stats, results
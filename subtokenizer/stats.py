@@ -0,0 +1,170 @@
+# coding: utf-8
+"""Opt-in instrumentation: time and calls per stage, counters, events and peak memory.
+
+Instrumented code checks `stats is not None` once per call and takes the
+uninstrumented path otherwise, so disabled instrumentation costs nothing.
+"""
+from __future__ import unicode_literals, division, absolute_import
+
+import sys
+import json
+from collections import defaultdict
+from timeit import default_timer as timer
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+def peak_memory():
+    """Peak resident memory of the process in bytes, None if unknown."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac os
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def process_memory():
+    """Dict of resident (rss), proportional (pss) and private memory of the process
+    in bytes, None if unknown. Private memory of a forked worker includes pages
+    copied from the parent on write, the shared ones are counted in pss in parts.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        # linux 4.14+ only
+        return None
+    fields = {}
+    for line in lines[1:]:
+        name, value = line.split(':', 1)
+        fields[name] = int(value.split()[0]) * 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'],
+            'private': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+class Stats(object):
+    """Cumulative time and number of calls per stage, counters and events.
+
+    Counters `lines`, `words` and `subtokens` are reported per second of
+    elapsed time, `<cache>.hits` and `<cache>.misses` as hit rate of the cache.
+    """
+
+    def __init__(self):
+        self.start = timer()
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self.events = []
+
+    def add(self, stage, seconds, calls=1):
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [seconds, calls]
+        else:
+            entry[0] += seconds
+            entry[1] += calls
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def event(self, name, **values):
+        """Records an event, for example a learn iteration, with current peak memory."""
+        values['name'] = name
+        values['time'] = timer() - self.start
+        values['peak_memory'] = peak_memory()
+        self.events.append(values)
+
+    def merge(self, other):
+        for stage, (seconds, calls) in other.stages.items():
+            self.add(stage, seconds, calls)
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        self.events.extend(other.events)
+
+    def pop(self):
+        """Returns stats collected so far and resets them, used to pass stats from worker processes."""
+        popped = Stats()
+        popped.stages, popped.counters, popped.events = self.stages, self.counters, self.events
+        self.stages = {}
+        self.counters = defaultdict(int)
+        self.events = []
+        return popped
+
+    def report(self):
+        """Returns json serializable dict."""
+        elapsed = timer() - self.start
+        total = sum(seconds for seconds, _ in self.stages.values())
+        hit_rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith('.hits'):
+                cache = name[:-len('.hits')]
+                lookups = hits + self.counters.get(cache + '.misses', 0)
+                hit_rates[cache] = hits / lookups if lookups else 0.0
+        return {
+            'elapsed': elapsed,
+            'stages': {stage: {'seconds': seconds, 'calls': calls, 'share': seconds / total if total else 0.0}
+                       for stage, (seconds, calls) in self.stages.items()},
+            'counters': dict(self.counters),
+            'rates': {name + '_per_second': self.counters[name] / elapsed
+                      for name in ('lines', 'words', 'subtokens') if name in self.counters and elapsed},
+            'hit_rates': hit_rates,
+            'peak_memory': peak_memory(),
+            'events': self.events,
+        }
+
+    def format(self):
+        """Returns human readable report."""
+        report = self.report()
+        lines = ['elapsed {0:.3f}s'.format(report['elapsed'])]
+        for name in sorted(report['counters']):
+            rate = report['rates'].get(name + '_per_second')
+            lines.append('{0:24} {1:>12}{2}'.format(
+                name, report['counters'][name], ' ({0:.1f}/s)'.format(rate) if rate is not None else ''))
+        for cache, rate in sorted(report['hit_rates'].items()):
+            lines.append('{0:24} {1:>11.1%}'.format(cache + ' hit rate', rate))
+        if report['stages']:
+            lines.append('{0:24} {1:>12} {2:>10} {3:>7}'.format('stage', 'seconds', 'calls', 'share'))
+            for stage, entry in sorted(report['stages'].items(), key=lambda x: -x[1]['seconds']):
+                lines.append('{0:24} {1:>12.4f} {2:>10} {3:>7.1%}'.format(
+                    stage, entry['seconds'], entry['calls'], entry['share']))
+        for event in report['events']:
+            values = (_format_value(k, v) for k, v in sorted(event.items()) if k != 'name')
+            lines.append('{0}: {1}'.format(event['name'], ' '.join(values)))
+        if report['peak_memory'] is not None:
+            lines.append('peak memory {0:.1f}MB'.format(report['peak_memory'] / 2**20))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+def _format_value(name, value):
+    if name == 'peak_memory' and value is not None:
+        return '{0}={1:.1f}MB'.format(name, value / 2**20)
+    if isinstance(value, float):
+        return '{0}={1:.4g}'.format(name, value)
+    return '{0}={1}'.format(name, value)
+
+
+def timed_iter(iterable, stats, stage):
+    """Yields items of iterable adding time spent waiting for them to the stage."""
+    iterator = iter(iterable)
+    while True:
+        start = timer()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        stats.add(stage, timer() - start)
+        yield item
+
+
+def with_stats(func, stats):
+    """Wraps function run in worker processes to return stats it collected along with the result."""
+    def wrapper(*args):
+        result = func(*args)
+        return result, stats.pop()
+    return wrapper
@@ -1,13 +1,21 @@
 # coding: utf-8
-from __future__ import unicode_literals, absolute_import
+from __future__ import unicode_literals, division, absolute_import
 
 import io
 import six
-from subtokenizer.utils import (encode_controls, encode_with_alphabet, unescape,
-                                alphabet_from_tokens, encode_tokens_with_alphabet,
-                                NOBREAK, ESCAPE_CHARS, normalize_text)
-from subtokenizer.subwords import Subwords, RESERVED_TOKENS, EOS, PAD
+from array import array
+from itertools import islice
+from timeit import default_timer as timer
+from subtokenizer.utils import (encode_controls, alphabet_table, unescape, prepare_text, normalize_text,
+                                alphabet_from_tokens, encode_tokens_with_alphabet, translate_with_positions,
+                                sample_token_counts,
+                                NOBREAK, NOSPACE, SPACESYMBOL, ESCAPE_CHARS, CONTROLS_TABLE)
+from subtokenizer.subwords import (Subwords, RESERVED_TOKENS, NUM_RESERVED_TOKENS, EOS, EOS_ID, PAD, PAD_ID,
+                                   DEFAULT_CACHE_SIZE)
+from subtokenizer.cache import MemoCache
 from subtokenizer.tokenizer import ReTokenizer
+from subtokenizer.compiled import compile_vocabulary, is_compiled, CompiledVocabulary, DoubleArrayTrie
+from subtokenizer.stats import Stats
 
 
 def UntilEOS(generator):
@@ -16,57 +24,431 @@ def UntilEOS(generator):
             break
         yield item
 
+
+def _cut_sequences(np, sequences):
+    """Yields int64 arrays of sequences cut at the first EOS_ID or PAD_ID."""
+    for sequence in sequences:
+        sequence = np.asarray(sequence, dtype=np.int64)
+        stops = np.flatnonzero((sequence == EOS_ID) | (sequence == PAD_ID))
+        yield sequence[:stops[0]] if len(stops) else sequence
+
+
+DEFAULT_WORD_CACHE_SIZE = 2 ** 16
+# lines tokenized by one task of tokenize_many
+DEFAULT_TASK_SIZE = 256
+
+
 class SubTokenizer(object):
+    """Subword tokenizer.
+
+    One instance may be shared by threads: the vocabulary is read only and
+    caches tolerate concurrent access without locks. Per stage `stats` are
+    not synchronized, enable them in one thread only.
+    """
 
-    def __init__(self, subtokens_list, numeric=False, split_by_alphabets=True, lowercase=False, reversed_bpe=False):
-        self.alphabet = {c for token in subtokens_list for c in token}
-        self.subwords = Subwords(subtokens_list)
+    def __init__(self, subtokens_list, numeric=False, split_by_alphabets=True, lowercase=False, reversed_bpe=False,
+                 cache_size=DEFAULT_CACHE_SIZE, alphabet=None, trie=None, word_cache_size=DEFAULT_WORD_CACHE_SIZE,
+                 subtoken_ids=None, max_subtoken_len=None):
+        self.alphabet = alphabet if alphabet is not None else {c for token in subtokens_list for c in token}
+        self.subwords = Subwords(subtokens_list, cache_size=cache_size, trie=trie, subtoken_ids=subtoken_ids,
+                                 max_subtoken_len=max_subtoken_len)
+        self.alphabet_table = alphabet_table(self.alphabet)
+        # Pretokenized word to final subtokens and ids, a hit skips alphabet
+        # encoding, reversing and segmentation of the word.
+        self.word_cache = MemoCache(word_cache_size)
         self.numeric = numeric
         self.split_by_alphabets = split_by_alphabets
         self.lowercase = lowercase
         self.reversed_bpe = reversed_bpe
+        # Stats instance collecting time per stage, None disables instrumentation.
+        self.stats = None
+        self._surfaces = None
+        self._surfaces_array = None
+
+    def enable_stats(self):
+        """Starts collecting per stage instrumentation into a new `Stats`, returns it."""
+        self.stats = Stats()
+        return self.stats
 
     def encode_controls(self, text):
         return encode_controls(text)
 
+    def cache_stats(self):
+        return self.subwords.cache.stats()
+
+    def word_cache_stats(self):
+        return self.word_cache.stats()
+
     def decode(self, text):
         text = text.replace(NOBREAK, '')
         return unescape(text)
 
+    def _final_subtokens_ids(self, subtokens, ids):
+        """Subtokens and ids of an encoded word as tuples in text order."""
+        if self.reversed_bpe:
+            return tuple(subtoken[::-1] for subtoken in reversed(subtokens)), tuple(reversed(ids))
+        return tuple(subtokens), tuple(ids)
+
+    def _segment_word(self, word):
+        encoded = word.translate(self.alphabet_table)
+        if self.reversed_bpe:
+            encoded = encoded[::-1]
+        return self._final_subtokens_ids(*self.subwords.token_to_subtokens_ids(encoded))
+
+    def _segment_missing_word(self, word):
+        segmented = self.word_cache.lookup_miss(word)
+        if segmented is None:
+            segmented = self._segment_word(word)
+            self.word_cache.put(word, segmented)
+        return segmented
+
+    def frequent_words(self, count):
+        """Returns up to count whole words of the vocabulary, most frequent first."""
+        words = []
+        for subtoken in self.subwords.all_subtoken_strings[NUM_RESERVED_TOKENS:]:
+            if len(words) >= count:
+                break
+            word = subtoken[::-1] if self.reversed_bpe else subtoken
+            # Encoded symbols can't be restored without the text, such words are skipped.
+            if word.endswith(SPACESYMBOL) and '&#' not in word:
+                words.append(word)
+        return words
+
+    def prewarm(self, words):
+        """Fills word cache with segmentation of pretokenized words."""
+        for word in words:
+            if word not in self.word_cache.data:
+                self.word_cache.put(word, self._segment_word(word))
+
     def tokenize(self, text, encode_controls=True, numeric=None, add_eos=False, split_by_alphabets=None, lowercase=None):
         numeric = numeric if numeric is not None else self.numeric
         split_by_alphabets = split_by_alphabets if split_by_alphabets is not None else self.split_by_alphabets
         lowercase = lowercase if lowercase is not None else self.lowercase
+        if self.stats is not None:
+            return self._tokenize_with_stats(text, encode_controls, numeric, add_eos, split_by_alphabets, lowercase)
+
+        text = prepare_text(text, encode_controls=encode_controls)
+        words = ReTokenizer.tokenize(text, split_by_alphabets=split_by_alphabets, lowercase=lowercase)
+        tokens = []
+        index = 1 if numeric else 0
+        memo = self.word_cache.data
+        self.word_cache.lookups += len(words)
+        for w in words:
+            segmented = memo.get(w)
+            if segmented is None:
+                segmented = self._segment_missing_word(w)
+            tokens.extend(segmented[index])
+        if add_eos:
+            tokens.append(EOS_ID if numeric else EOS)
+        return tokens
 
+    def tokenize_many(self, lines, executor=None, task_size=DEFAULT_TASK_SIZE, encode_controls=True, numeric=None,
+                      add_eos=False, split_by_alphabets=None, lowercase=None):
+        """Tokenizes lines, in parallel if executor is given.
+        Args:
+            lines: iterable of unicode strings.
+            executor: concurrent.futures executor running tasks in this process,
+                for example ThreadPoolExecutor, the model and caches are shared
+                by its threads. Threads run in parallel on free-threaded python only.
+            task_size: number of lines tokenized by one task.
+        Returns:
+            List of tokenize results of lines in the same order.
+        """
+        def tokenize_lines(task):
+            return [self.tokenize(line, encode_controls=encode_controls, numeric=numeric, add_eos=add_eos,
+                                  split_by_alphabets=split_by_alphabets, lowercase=lowercase) for line in task]
+
+        if executor is None:
+            return tokenize_lines(lines)
+        lines = iter(lines)
+        tasks = iter(lambda: list(islice(lines, task_size)), [])
+        results = []
+        for tokens in executor.map(tokenize_lines, tasks):
+            results.extend(tokens)
+        return results
+
+    def _tokenize_with_stats(self, text, encode_controls, numeric, add_eos, split_by_alphabets, lowercase):
+        """Same as tokenize, every stage is done for the whole line and timed."""
+        stats = self.stats
+        cache = self.subwords.cache
+        word_cache = self.word_cache
+        hits, misses = cache.hits, cache.misses
+        word_misses = word_cache.misses
+        start = timer()
         text = normalize_text(text)
+        now = timer()
+        stats.add('normalize', now - start)
         if encode_controls:
-            text = self.encode_controls(text)
+            start = now
+            text = text.translate(CONTROLS_TABLE)
+            now = timer()
+            stats.add('encode_controls', now - start)
+        start = now
         words = ReTokenizer.tokenize(text, split_by_alphabets=split_by_alphabets, lowercase=lowercase)
+        now = timer()
+        stats.add('retokenize', now - start)
+        start = now
+        word_cache.lookups += len(words)
+        segmented = [word_cache.data.get(w) or word_cache.lookup_miss(w) for w in words]
+        missing = [w for w, s in zip(words, segmented) if s is None]
+        now = timer()
+        stats.add('word_cache', now - start)
+        start = now
+        if self.reversed_bpe:
+            encoded = [w.translate(self.alphabet_table)[::-1] for w in missing]
+        else:
+            encoded = [w.translate(self.alphabet_table) for w in missing]
+        now = timer()
+        stats.add('encode_alphabet', now - start)
+        start = now
+        encoded = [self.subwords.token_to_subtokens_ids(w) for w in encoded]
+        now = timer()
+        stats.add('subwords', now - start)
+        start = now
+        missing = dict(zip(missing, encoded))
+        index = 1 if numeric else 0
         tokens = []
-        for w in words:
-            if self.reversed_bpe:
-                subtokens = self.subwords.token_to_subtokens(encode_with_alphabet(w, self.alphabet)[::-1])
-                for subtoken in subtokens[::-1]:
-                    tokens.append(subtoken[::-1])
-            else:
-                tokens.extend(self.subwords.token_to_subtokens(encode_with_alphabet(w, self.alphabet)))
+        for w, s in zip(words, segmented):
+            if s is None:
+                s = self._final_subtokens_ids(*missing[w])
+                word_cache.put(w, s)
+            tokens.extend(s[index])
         if add_eos:
-            tokens.append(EOS)
-        if numeric:
-            tokens = self.subwords.subtokens_to_ids(tokens)
+            tokens.append(EOS_ID if numeric else EOS)
+        stats.add('ids', timer() - start)
+        stats.count('lines')
+        stats.count('words', len(words))
+        stats.count('subtokens', len(tokens))
+        stats.count('cache.hits', cache.hits - hits)
+        stats.count('cache.misses', cache.misses - misses)
+        stats.count('word_cache.hits', len(words) - (word_cache.misses - word_misses))
+        stats.count('word_cache.misses', word_cache.misses - word_misses)
         return tokens
 
+    def tokenize_with_offsets(self, text, encode_controls=True, add_eos=False, split_by_alphabets=None, lowercase=None):
+        """Tokenizes text into ids and their positions in the text.
+        Returns:
+            Three int arrays: ids, starts and ends. Subtoken i comes from
+            normalize_text(text)[starts[i]:ends[i]]. Spans of inserted space markers
+            are empty, case markers share the span of the letter they mark.
+        """
+        split_by_alphabets = split_by_alphabets if split_by_alphabets is not None else self.split_by_alphabets
+        lowercase = lowercase if lowercase is not None else self.lowercase
+
+        text = normalize_text(text)
+        prepared = text
+        # Position in text of every symbol of prepared text, None if they are the same.
+        positions = None
+        if encode_controls:
+            prepared, positions = translate_with_positions(prepared, CONTROLS_TABLE)
+        if lowercase:
+            prepared, lower_positions = ReTokenizer.lower_with_positions(prepared)
+            if lower_positions is not None:
+                positions = lower_positions if positions is None else [positions[p] for p in lower_positions]
+        if positions is not None:
+            # the end of the last symbol
+            positions.append(len(text))
+        words = prepared.replace(' ', SPACESYMBOL)
+
+        ids = array(str('i'))
+        starts = array(str('i'))
+        ends = array(str('i'))
+        memo = self.word_cache.data
+        spans = ReTokenizer.word_spans(prepared, split_by_alphabets)
+        self.word_cache.lookups += len(spans)
+        for start, end, nospace, space in spans:
+            word = words[start:end]
+            if nospace:
+                word = NOSPACE + word
+            if space:
+                word += SPACESYMBOL
+            subtokens, subtoken_ids = memo.get(word) or self._segment_missing_word(word)
+            chars = end - start
+            # Markers have empty spans: NOSPACE at the first char, SPACESYMBOL after the last one.
+            if positions is None:
+                word_start = start
+                word_end = end if chars else start
+            else:
+                word_start = positions[start]
+                word_end = positions[end - 1] + 1 if chars else word_start
+            encoded_positions = None
+            if len(''.join(subtokens)) != len(word):
+                # Subtokens contain escape sequences of symbols out of the alphabet.
+                _, encoded_positions = translate_with_positions(word, self.alphabet_table)
+            ids.extend(subtoken_ids)
+            offset = 0
+            for subtoken in subtokens:
+                first = offset
+                offset += len(subtoken)
+                last = offset - 1
+                if encoded_positions is not None:
+                    first = encoded_positions[first]
+                    last = encoded_positions[last]
+                # chars of the word are prepared[start:end]
+                first -= nospace
+                last -= nospace
+                if first < 0:
+                    span_start = word_start
+                elif first >= chars:
+                    span_start = word_end
+                else:
+                    span_start = start + first if positions is None else positions[start + first]
+                if last < 0:
+                    span_end = word_start
+                elif last >= chars:
+                    span_end = word_end
+                else:
+                    span_end = (start + last if positions is None else positions[start + last]) + 1
+                starts.append(span_start)
+                ends.append(span_end if span_end > span_start else span_start)
+        if add_eos:
+            ids.append(EOS_ID)
+            starts.append(len(text))
+            ends.append(len(text))
+        return ids, starts, ends
+
+    def tokenize_batch(self, lines, max_len=None, pad=True, add_eos=False, encode_controls=True,
+                       split_by_alphabets=None, lowercase=None):
+        """Tokenizes lines into numpy id arrays.
+        Args:
+            lines: iterable of unicode strings.
+            max_len: truncate sequences to this length, EOS is kept as the last id.
+            pad: return padded matrix if True, flat ids and offsets otherwise.
+            add_eos: append EOS_ID to every sequence.
+        Returns:
+            If pad is True, int32 matrix padded with PAD_ID and int32 vector of lengths.
+            Otherwise flat int32 ids and int64 offsets (CSR style): ids of the i-th
+            line are ids[offsets[i]:offsets[i + 1]].
+        """
+        import numpy as np
+
+        ids = []
+        lengths = []
+        for line in lines:
+            line_ids = self.tokenize(line, encode_controls=encode_controls, numeric=True,
+                                     split_by_alphabets=split_by_alphabets, lowercase=lowercase)
+            if max_len is not None and len(line_ids) + add_eos > max_len:
+                del line_ids[max(0, max_len - add_eos):]
+            if add_eos and max_len != 0:
+                line_ids.append(EOS_ID)
+            ids.extend(line_ids)
+            lengths.append(len(line_ids))
+        ids = np.array(ids, dtype=np.int32)
+        lengths = np.array(lengths, dtype=np.int32)
+        if not pad:
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            return ids, offsets
+        width = max_len if max_len is not None else (int(lengths.max()) if len(lengths) else 0)
+        matrix = np.full((len(lengths), width), PAD_ID, dtype=np.int32)
+        matrix[np.arange(width) < lengths[:, None]] = ids
+        return matrix, lengths
+
     def detokenize(self, tokens, decode=True, numeric=None, restore_case=None):
         numeric = numeric if numeric is not None else self.numeric
         restore_case = restore_case if restore_case is not None else self.lowercase
+        if self.stats is not None:
+            start = timer()
+            text = self._detokenize(tokens, decode, numeric, restore_case)
+            self.stats.add('detokenize', timer() - start)
+            self.stats.count('lines')
+            return text
+        return self._detokenize(tokens, decode, numeric, restore_case)
 
+    def _detokenize(self, tokens, decode, numeric, restore_case):
         if numeric:
-            tokens = self.subwords.ids_to_subtokens(tokens)
-        text = ReTokenizer.detokenize(UntilEOS(tokens), restore_case=restore_case)
+            tokens = list(tokens)
+            if EOS_ID in tokens:
+                del tokens[tokens.index(EOS_ID):]
+            surfaces = self.surfaces()
+            text = ReTokenizer.detokenize_text(''.join([surfaces[i] for i in tokens]), restore_case=restore_case)
+        else:
+            text = ReTokenizer.detokenize(UntilEOS(tokens), restore_case=restore_case)
         if decode:
             text = self.decode(text)
         return text
 
+    def surfaces(self):
+        """List of subtoken surface forms by id: text order, spaces instead of SPACESYMBOL."""
+        if self._surfaces is None:
+            subtokens = self.subwords.all_subtoken_strings
+            if self.reversed_bpe:
+                subtokens = [subtoken[::-1] for subtoken in subtokens]
+            self._surfaces = [subtoken.replace(SPACESYMBOL, ' ') for subtoken in subtokens]
+        return self._surfaces
+
+    def detokenize_batch(self, ids, decode=True, restore_case=None):
+        """Detokenizes numeric sequences, for example beam search hypotheses.
+        Args:
+            ids: 2-D integer numpy array or list of 1-D arrays or lists of ids,
+                every sequence ends at the first EOS_ID or PAD_ID.
+            decode: decode encoded symbols.
+            restore_case: restore case of lowercased text, default is lowercase of the model.
+        Returns:
+            List of unicode strings, the same as detokenize(sequence, numeric=True)
+            of every sequence cut at EOS_ID or PAD_ID.
+        """
+        import numpy as np
+
+        restore_case = restore_case if restore_case is not None else self.lowercase
+        surfaces = self.surfaces()
+        if any('\n' in surface for surface in surfaces):
+            # Line break can't separate sequences, rare vocabularies are detokenized one by one.
+            return [self.detokenize(row, decode=decode, numeric=True, restore_case=restore_case)
+                    for row in _cut_sequences(np, ids)]
+        if self._surfaces_array is None:
+            # The last item separates sequences.
+            self._surfaces_array = np.array(surfaces + ['\n'], dtype=object)
+        separator = len(surfaces)
+        if isinstance(ids, np.ndarray) and ids.ndim == 2:
+            rows, width = ids.shape
+            extended = np.empty((rows, width + 1), dtype=np.int64)
+            extended[:, :width] = ids
+            stops = (extended == EOS_ID) | (extended == PAD_ID)
+            stops[:, width] = True
+            lengths = stops.argmax(axis=1)
+            extended[np.arange(rows), lengths] = separator
+            flat = extended[np.arange(width + 1) <= lengths[:, None]]
+        else:
+            rows = len(ids)
+            parts = []
+            for row in _cut_sequences(np, ids):
+                parts.append(row)
+                parts.append(np.array([separator], dtype=np.int64))
+            flat = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        # All passes are done once for the whole batch joined with line breaks,
+        # no marker or encoded symbol pattern matches across a line break.
+        text = ReTokenizer.detokenize_text(''.join(self._surfaces_array[flat]), restore_case=restore_case)
+        texts = text.split('\n')[:rows]
+        if decode:
+            # decoded text may have line breaks, rows are decoded after splitting
+            texts = [self.decode(text) for text in texts]
+        return texts
+
+    def evaluate(self, lines):
+        """Measures how well the vocabulary fits text, for example held out one.
+        Args:
+            lines: iterable of unicode lines.
+        Returns:
+            dict of numbers of lines, characters, words, subtokens and escapes
+            (symbols encoded because they are not in the alphabet), subtokens
+            per word and compression ratio (characters per subtoken).
+        """
+        report = {'lines': 0, 'characters': 0, 'words': 0, 'subtokens': 0, 'escapes': 0}
+        alphabet = self.alphabet
+        for line in lines:
+            line = line.strip('\r\n')
+            words = ReTokenizer.tokenize(prepare_text(line), split_by_alphabets=self.split_by_alphabets,
+                                         lowercase=self.lowercase)
+            report['lines'] += 1
+            report['characters'] += len(line)
+            report['words'] += len(words)
+            report['escapes'] += sum(1 for word in words for ch in word if ch not in alphabet)
+            report['subtokens'] += len(self.tokenize(line, numeric=False))
+        report['tokens_per_word'] = report['subtokens'] / report['words'] if report['words'] else 0.0
+        report['compression_ratio'] = report['characters'] / report['subtokens'] if report['subtokens'] else 0.0
+        return report
+
     def save(self, filename):
         f = io.TextIOWrapper(io.FileIO(filename, "w"), encoding='utf-8')
         for subtoken_string in self.subwords.all_subtoken_strings:
@@ -76,30 +458,96 @@ class SubTokenizer(object):
                 f.write(subtoken_string + "\n")
         f.close()
 
+    def compile(self, filename):
+        """Saves binary vocabulary which is memory mapped by `load`."""
+        compile_vocabulary(self.subwords.all_subtoken_strings, filename, reversed_bpe=self.reversed_bpe)
+
     @classmethod
-    def load(cls, filename, numeric=False, split_by_alphabets=True, lowercase=False, reversed_bpe=False):
-        f = io.TextIOWrapper(io.BufferedReader(io.FileIO(filename, "r")), encoding='utf-8')
-        subtokens_list = []
-        for subtoken in f:
-            if reversed_bpe:
-                subtokens_list.append(subtoken.strip('\n')[::-1])
-            else:
-                subtokens_list.append(subtoken.strip('\n'))
-        return cls(subtokens_list, numeric=numeric, split_by_alphabets=split_by_alphabets, lowercase=lowercase, reversed_bpe=reversed_bpe)
+    def load(cls, filename, numeric=False, split_by_alphabets=True, lowercase=False, reversed_bpe=None,
+             cache_size=DEFAULT_CACHE_SIZE, word_cache_size=DEFAULT_WORD_CACHE_SIZE, prewarm=0):
+        """Loads text vocabulary or vocabulary compiled by `compile`.
+        reversed_bpe is stored in compiled vocabulary, for text vocabulary None means False.
+        prewarm is the number of the most frequent vocabulary words put into the word cache.
+        """
+        if is_compiled(filename):
+            vocabulary = CompiledVocabulary(filename)
+            if reversed_bpe is not None and reversed_bpe != vocabulary.reversed_bpe:
+                raise ValueError("{0} is compiled with reversed_bpe={1}".format(filename, vocabulary.reversed_bpe))
+            tokenizer = cls._from_compiled(vocabulary, numeric=numeric, split_by_alphabets=split_by_alphabets,
+                                           lowercase=lowercase, cache_size=cache_size, word_cache_size=word_cache_size)
+        else:
+            reversed_bpe = bool(reversed_bpe)
+            f = io.TextIOWrapper(io.BufferedReader(io.FileIO(filename, "r")), encoding='utf-8')
+            subtokens_list = []
+            for subtoken in f:
+                if reversed_bpe:
+                    subtokens_list.append(subtoken.strip('\n')[::-1])
+                else:
+                    subtokens_list.append(subtoken.strip('\n'))
+            tokenizer = cls(subtokens_list, numeric=numeric, split_by_alphabets=split_by_alphabets, lowercase=lowercase,
+                            reversed_bpe=reversed_bpe, cache_size=cache_size, word_cache_size=word_cache_size)
+        if prewarm:
+            tokenizer.prewarm(tokenizer.frequent_words(min(prewarm, word_cache_size)))
+        return tokenizer
+
+    @classmethod
+    def _from_compiled(cls, vocabulary, **options):
+        return cls(vocabulary.subtokens_list, reversed_bpe=vocabulary.reversed_bpe, alphabet=vocabulary.alphabet,
+                   trie=vocabulary.trie, subtoken_ids=vocabulary.subtoken_ids,
+                   max_subtoken_len=vocabulary.max_subtoken_len, **options)
+
+    def share_memory(self):
+        """Returns tokenizer with the same options and the vocabulary compiled into
+        anonymous shared memory, for example before forking worker processes.
+        Forked processes read the vocabulary without copying its pages, only
+        their caches are private. Compiled vocabularies are already shared.
+        The word cache is kept and surfaces for detokenize are built here, so
+        forked processes inherit them instead of building their own.
+        """
+        tokenizer = self
+        if not isinstance(self.subwords.trie, DoubleArrayTrie):
+            vocabulary = CompiledVocabulary.in_memory(self.subwords.all_subtoken_strings, self.reversed_bpe)
+            tokenizer = self._from_compiled(vocabulary, numeric=self.numeric,
+                                            split_by_alphabets=self.split_by_alphabets, lowercase=self.lowercase,
+                                            cache_size=self.subwords.cache.size, word_cache_size=self.word_cache.size)
+            tokenizer.stats = self.stats
+            # segmentations don't change with the vocabulary storage, prewarmed words stay
+            tokenizer.word_cache.data.update(self.word_cache.data)
+            tokenizer.word_cache.previous.update(self.word_cache.previous)
+        tokenizer.surfaces()
+        return tokenizer
 
     @classmethod
-    def learn(cls, token_counts, size=8000, min_symbol_count=1, reserved_tokens=None, reversed_bpe=False):
+    def learn(cls, token_counts, size=8000, min_symbol_count=1, reserved_tokens=None, reversed_bpe=False, processes=1,
+              stats=None, sample=None, seed=0, subtoken_length_limit=None, suffix_array=False):
+        """Learns vocabulary of about `size` subtokens.
+        Args:
+            token_counts: dict of pretokenized word to count.
+            sample: learn on a frequency weighted sample of token types, fraction of
+                types if less than 1 or number of types, the alphabet is still
+                collected from all tokens. It's faster, check quality with `evaluate`.
+            seed: random seed of the sample.
+            subtoken_length_limit: subtokens are shorter than the limit.
+            suffix_array: count only substrings above the minimal count with a suffix
+                array, uses less memory on long tokens.
+        """
+        if sample is not None and sample <= 0:
+            raise ValueError("sample must be positive: {0}".format(sample))
         reserved_tokens = reserved_tokens or []
         reserved_tokens = RESERVED_TOKENS + reserved_tokens
         alphabet = alphabet_from_tokens(token_counts, min_symbol_count)
         alphabet |= {c for token in reserved_tokens for c in token}
         alphabet |= ESCAPE_CHARS
         token_counts = encode_tokens_with_alphabet(token_counts, alphabet)
+        # Upper bound heuristic, from all tokens as a sample may be shorter than size * 0.01
+        counts = sorted(token_counts.values())
+        upper_bound = max(counts[min(max(int(len(counts) - size * 0.01), 0), len(counts) - 1)], 1000)
+        if sample is not None:
+            token_counts = sample_token_counts(token_counts, sample, seed)
         if (reversed_bpe):
             token_counts = dict(map((lambda x: (x[0][::-1], x[1])), six.iteritems(token_counts)))
             reserved_tokens = list(map((lambda x: x[::-1]), reserved_tokens))
-        # Upper bound heuristic
-        counts = sorted(token_counts.values())
-        upper_bound = max(counts[int(len(counts) - size * 0.01)], 1000)
-        subwords = Subwords.build_to_target_size(size, token_counts, 1, upper_bound, reserved_tokens, alphabet)
+        subwords = Subwords.build_to_target_size(size, token_counts, 1, upper_bound, reserved_tokens, alphabet,
+                                                 subtoken_length_limit=subtoken_length_limit, processes=processes,
+                                                 stats=stats, suffix_array=suffix_array)
         return cls(subwords.all_subtoken_strings, reversed_bpe=reversed_bpe)
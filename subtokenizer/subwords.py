@@ -6,10 +6,12 @@ from __future__ import print_function
 
 import re
 import six
-import logging
+import math
 import collections
 from builtins import str
 from itertools import chain
+from timeit import default_timer as timer
+from subtokenizer.cache import LRUCache
 
 # Reserved tokens for things like padding and EOS symbols.
 PAD = "<pad>"
@@ -18,16 +20,89 @@ RESERVED_TOKENS = [PAD, EOS]
 NUM_RESERVED_TOKENS = len(RESERVED_TOKENS)
 PAD_ID = RESERVED_TOKENS.index(PAD)  # Normally 0
 EOS_ID = RESERVED_TOKENS.index(EOS)  # Normally 1
+DEFAULT_CACHE_SIZE = 2 ** 20
 
 
 
-class Subwords(object):
+class SubtokenTrie(object):
+    """Prefix trie over subtoken strings.
+
+    Walks every character of a token once to find the greedy longest match,
+    so no intermediate slices are built while searching.
+    """
+    LEAF = ''
+
     def __init__(self, subtokens_list):
+        self.root = {}
+        for i, subtoken in enumerate(subtokens_list):
+            if not subtoken:
+                continue
+            node = self.root
+            for ch in subtoken:
+                child = node.get(ch)
+                if child is None:
+                    child = node[ch] = {}
+                node = child
+            node[self.LEAF] = i
+
+    def segment(self, token):
+        """Splits a token on the longest subtokens from the trie.
+        Args:
+            token: An token as a unicode string.
+        Returns:
+            A tuple of two lists: subtoken strings and subtoken ids.
+        """
+        root = self.root
+        leaf = self.LEAF
+        subtokens = []
+        ids = []
+        start = 0
+        token_len = len(token)
+        while start < token_len:
+            node = root
+            position = start
+            end = start
+            subtoken_id = None
+            while position < token_len:
+                node = node.get(token[position])
+                if node is None:
+                    break
+                position += 1
+                match = node.get(leaf)
+                if match is not None:
+                    end = position
+                    subtoken_id = match
+            # No match is impossible and would be indicative of a bug.
+            assert subtoken_id is not None, "Token substring not found in subtoken vocabulary."
+            subtokens.append(token[start:end])
+            ids.append(subtoken_id)
+            start = end
+        return subtokens, ids
+
+
+class Subwords(object):
+    def __init__(self, subtokens_list, cache_size=DEFAULT_CACHE_SIZE, trie=None, subtoken_ids=None,
+                 max_subtoken_len=None):
+        """
+        Args:
+            subtokens_list: List of subtoken strings, position is the subtoken id.
+            cache_size: Maximum number of segmented tokens kept in the LRU cache,
+              0 disables caching. Any object with `get` and `put` methods can be
+              assigned to `self.cache` instead.
+            trie: prebuilt trie over subtokens_list, for example from a compiled vocabulary.
+            subtoken_ids: prebuilt mapping of subtoken string to id, for example from a
+              compiled vocabulary, subtokens_list is not iterated if it's given with trie.
+            max_subtoken_len: length of the longest subtoken if known.
+        """
         self.all_subtoken_strings = subtokens_list
-        self.max_subtoken_len = max([len(s) for s in subtokens_list])
-        self.cache_size = 2 ** 20
-        self.cache = [(None, None)] * self.cache_size
-        self.subtoken_string_to_id = {s: i for i, s in enumerate(subtokens_list) if s}
+        if max_subtoken_len is None:
+            max_subtoken_len = max([len(s) for s in subtokens_list])
+        self.max_subtoken_len = max_subtoken_len
+        self.cache = LRUCache(cache_size)
+        if subtoken_ids is None:
+            subtoken_ids = {s: i for i, s in enumerate(subtokens_list) if s}
+        self.subtoken_string_to_id = subtoken_ids
+        self.trie = trie if trie is not None else SubtokenTrie(subtokens_list)
 
     @property
     def vocab_size(self):
@@ -41,25 +116,21 @@ class Subwords(object):
         Returns:
             A list of subtokens as unicode strings.
         """
+        return self.token_to_subtokens_ids(token)[0]
+
+    def token_to_subtokens_ids(self, token):
+        """Converts an token string to subtoken strings and their ids.
+        Args:
+            token: An token as a unicode string.
+        Returns:
+            A tuple of two lists: subtokens as unicode strings and subtoken ids.
+        """
     # NOTE: This algorithm is greedy; it won't necessarily produce the "best"
     # list of subtokens.
-        cache_location = hash(token) % self.cache_size
-        cache_key, cache_value = self.cache[cache_location]
-        if cache_key == token:
-            return cache_value
-        start = 0
-        ret = []
-        token_len = len(token)
-        while start < token_len:
-            for end in range(min(token_len, start + self.max_subtoken_len), start, -1):
-                subtoken = token[start:end]
-                if subtoken in self.subtoken_string_to_id:
-                    ret.append(subtoken)
-                    start = end
-                    break
-            else:  # Did not break, impossible and would be indicative of a bug.
-                assert False, "Token substring not found in subtoken vocabulary."
-        self.cache[cache_location] = (token, ret)
+        ret = self.cache.get(token)
+        if ret is None:
+            ret = self.trie.segment(token)
+            self.cache.put(token, ret)
         return ret
 
     def subtokens_to_ids(self, subtokens):
@@ -68,9 +139,50 @@ class Subwords(object):
     def ids_to_subtokens(self, subtokens):
         return list(self.all_subtoken_strings[subtoken] for subtoken in subtokens)
 
+    @staticmethod
+    def _select_subtoken_strings(subtoken_counts, min_count, alphabet):
+        """Chooses the next vocabulary from substring counts.
+        Args:
+          subtoken_counts: a dictionary of substrings to counts, left unchanged.
+          min_count: an integer - discard subtokens with lower counts.
+          alphabet: allowed unicode symbols, always included.
+        Returns:
+          A list of subtoken strings sorted by decreasing count.
+        """
+        # Array of sets of candidate subtoken strings, by length.
+        len_to_subtoken_strings = []
+        for subtoken_string, count in six.iteritems(subtoken_counts):
+            lsub = len(subtoken_string)
+            if count >= min_count:
+                while len(len_to_subtoken_strings) <= lsub:
+                    len_to_subtoken_strings.append(set())
+                len_to_subtoken_strings[lsub].add(subtoken_string)
+        # Consider the candidates longest to shortest, so that if we accept
+        # a longer subtoken string, we can decrement the counts of its prefixes.
+        # Decrements are kept aside so the counts can be reused next iteration.
+        decrements = collections.defaultdict(int)
+        new_subtoken_strings = []
+        for lsub in range(len(len_to_subtoken_strings) - 1, 0, -1):
+            subtoken_strings = len_to_subtoken_strings[lsub]
+            for subtoken_string in subtoken_strings:
+                count = subtoken_counts[subtoken_string] - decrements.get(subtoken_string, 0)
+                if count >= min_count:
+                    # Exclude alphabet tokens here, as they must be included later,
+                    # explicitly, regardless of count.
+                    if subtoken_string not in alphabet:
+                        new_subtoken_strings.append((count, subtoken_string))
+                    for l in range(1, lsub):
+                        decrements[subtoken_string[:l]] += count
+
+        # Include the alphabet explicitly to guarantee all strings are encodable.
+        new_subtoken_strings.extend((subtoken_counts.get(a, 0) - decrements.get(a, 0), a) for a in alphabet)
+        new_subtoken_strings.sort(reverse=True)
+        return [subtoken for _, subtoken in new_subtoken_strings]
+
     @classmethod
     def build_from_token_counts(cls, token_counts, min_count, reserved_tokens, alphabet,
-                                num_iterations=4,  subtoken_length_limit=None):
+                                num_iterations=4,  subtoken_length_limit=None, processes=1, stats=None,
+                                suffix_array=False):
         """Train a Subwords based on a dictionary of word counts.
         Args:
           token_counts: a dictionary of Unicode strings to int.
@@ -83,67 +195,75 @@ class Subwords(object):
             then the runtime and memory use of creating the vocab is quadratic in
             the length of the longest token. If this is set, then it is instead
             O(subtoken_length_limit * length of longest token).
+          processes: number of processes counting substrings, each one owns
+            a share of `token_counts`.
+          stats: optional Stats collecting time of iteration stages and iteration events.
+          suffix_array: count substrings with SuffixArrayCounter, only the ones
+            occurring at least `min_count` times are kept in memory.
         Returns:
           A Subword instance.
         """
-        subwords_instance = cls(reserved_tokens + list(alphabet))
-        # We build iteratively.  On each iteration, we segment all the words,
-        # then count the resulting potential subtokens, keeping the ones
-        # with high enough counts for our new vocabulary.
-        min_count = max(1, min_count)
+        # Every token is segmented once per iteration, so caching only costs allocations.
+        subwords_instance = cls(reserved_tokens + list(alphabet), cache_size=0)
+        # Substring counts are updated by delta: only subtoken boundaries that
+        # appeared or disappeared since the previous iteration are recounted.
+        counter = _substring_counter(token_counts, processes, subtoken_length_limit, suffix_array)
+        try:
+            subwords_instance, _ = cls._refine(counter, collections.defaultdict(int), subwords_instance,
+                                               max(1, min_count), reserved_tokens, alphabet, num_iterations, stats)
+        finally:
+            counter.close()
+        return subwords_instance
+
+    @classmethod
+    def _refine(cls, counter, subtoken_counts, subwords_instance, min_count, reserved_tokens, alphabet,
+                num_iterations, stats=None):
+        """Refinement iterations of build_from_token_counts starting from subwords_instance.
+
+        On each iteration all the words are segmented, then the resulting potential
+        subtokens are counted, the ones with high enough counts are the new vocabulary.
+        subtoken_counts are counts of the current segmentation kept by counter,
+        so the same counter can be refined again from another vocabulary.
+        Returns:
+          The last Subwords instance and subtoken counts.
+        """
+        import logging
+
         for i in range(num_iterations):
+            start = timer()
+            changed = counter.segment(subwords_instance)
+            logging.debug("iteration {0}: {1} of {2} tokens changed segmentation".format(
+                i, changed, counter.num_tokens))
+            if i and not changed:
+                # Same counts give the same vocabulary.
+                break
+            segmented = timer()
             # Collect all substrings of the encoded token that break along current
-            # subtoken boundaries.
-            subtoken_counts = collections.defaultdict(int)
-            for token, count in six.iteritems(token_counts):
-                subtokens = subwords_instance.token_to_subtokens(token)
-                start = 0
-                for subtoken in subtokens:
-                    last_position = len(token) + 1
-                    if subtoken_length_limit is not None:
-                        last_position = min(last_position, start + subtoken_length_limit)
-                    for end in range(start + 1, last_position):
-                        new_subtoken = token[start:end]
-                        subtoken_counts[new_subtoken] += count
-                    start += len(subtoken)
-
-            # Array of sets of candidate subtoken strings, by length.
-            len_to_subtoken_strings = []
-            for subtoken_string, count in six.iteritems(subtoken_counts):
-                lsub = len(subtoken_string)
-                if count >= min_count:
-                    while len(len_to_subtoken_strings) <= lsub:
-                        len_to_subtoken_strings.append(set())
-                    len_to_subtoken_strings[lsub].add(subtoken_string)
-            # Consider the candidates longest to shortest, so that if we accept
-            # a longer subtoken string, we can decrement the counts of its prefixes.
-            new_subtoken_strings = []
-            for lsub in range(len(len_to_subtoken_strings) - 1, 0, -1):
-                subtoken_strings = len_to_subtoken_strings[lsub]
-                for subtoken_string in subtoken_strings:
-                    count = subtoken_counts[subtoken_string]
-                    if count >= min_count:
-                        # Exclude alphabet tokens here, as they must be included later,
-                        # explicitly, regardless of count.
-                        if subtoken_string not in alphabet:
-                            new_subtoken_strings.append((count, subtoken_string))
-                        for l in range(1, lsub):
-                            subtoken_counts[subtoken_string[:l]] -= count
-    
-            # Include the alphabet explicitly to guarantee all strings are encodable.
-            new_subtoken_strings.extend((subtoken_counts.get(a, 0), a) for a in alphabet)
-            new_subtoken_strings.sort(reverse=True)
-            # Reinitialize to the candidate vocabulary.
-            new_subtoken_strings = [subtoken for _, subtoken in new_subtoken_strings]
-            subwords_instance = cls(reserved_tokens + new_subtoken_strings)
-        return subwords_instance
+            # subtoken boundaries. Even when most tokens changed segmentation only
+            # a part of their boundaries did, so updating by delta is cheaper than
+            # counting from scratch.
+            full = not subtoken_counts
+            counter.count(subtoken_counts, full, min_count)
+            counted = timer()
+            new_subtoken_strings = cls._select_subtoken_strings(subtoken_counts, min_count, alphabet)
+            subwords_instance = cls(reserved_tokens + new_subtoken_strings, cache_size=0)
+            if stats is not None:
+                now = timer()
+                stats.add('learn.segment', segmented - start)
+                stats.add('learn.count', counted - segmented)
+                stats.add('learn.select', now - counted)
+                stats.event('iteration', min_count=min_count, changed=changed, full=full,
+                            vocab_size=subwords_instance.vocab_size, seconds=now - start)
+        return subwords_instance, subtoken_counts
 
     @classmethod
     def build_to_target_size(cls, target_size, token_counts, min_val, max_val,
-                             reserved_tokens, alphabet, subtoken_length_limit=None, num_iterations=4):
+                             reserved_tokens, alphabet, subtoken_length_limit=None, num_iterations=4,
+                             processes=1, stats=None, suffix_array=False):
         """Builds a Subwords that has `vocab_size` near `target_size`.
-        Uses simple recursive binary search to find a minimum token count that most
-        closely matches the `target_size`.
+        Uses recursive search to find a minimum token count that most closely
+        matches the `target_size`, probes are chosen by interpolation of vocabulary
+        sizes of previous probes and share substring counts.
         Args:
           target_size: Desired vocab_size to approximate.
           token_counts: A dictionary of token counts, mapping string to int.
@@ -157,6 +277,9 @@ class Subwords(object):
             the length of the longest token. If this is set, then it is instead
             O(subtoken_length_limit * length of longest token).
           num_iterations: An integer; how many iterations of refinement.
+          processes: number of processes counting substrings.
+          stats: optional Stats collecting learn stages, iteration and probe events.
+          suffix_array: count substrings with SuffixArrayCounter.
         Returns:
           A Subword instance.
         Raises:
@@ -167,13 +290,40 @@ class Subwords(object):
                              "is greater than the upper bound.")
         if target_size < 1:
             raise ValueError("Target size must be positive.")
+        import logging
+
+        # Counts are at least 1, so min_count 0 keeps the same subtokens as 1
+        # and probes stay positive for log scale search.
+        min_val = max(1, min_val)
+        max_val = max(min_val, max_val)
+
+        # All probes share one counter: a probe starts from the vocabulary of the
+        # probe with the nearest min_count and segmentation and counts left by the
+        # previous probe are updated by delta, instead of starting from the alphabet.
+        probes = []
+        counter = _substring_counter(token_counts, processes, subtoken_length_limit, suffix_array)
+        subtoken_counts = [collections.defaultdict(int)]
+
+        def build(present_count):
+            start = timer()
+            if probes:
+                _, initial = min(probes, key=lambda p: abs(math.log(p[0]) - math.log(present_count)))
+            else:
+                initial = cls(reserved_tokens + list(alphabet), cache_size=0)
+            subtokenizer, subtoken_counts[0] = cls._refine(
+                counter, subtoken_counts[0], initial, present_count, reserved_tokens, alphabet,
+                num_iterations, stats)
+            probes.append((present_count, subtokenizer))
+            if stats is not None:
+                stats.event('probe', min_count=present_count, vocab_size=subtokenizer.vocab_size,
+                            seconds=timer() - start)
+            return subtokenizer
 
         def bisect(min_val, max_val):
             """Bisection to find the right size."""
-            present_count = (max_val + min_val) // 2
-            subtokenizer = cls.build_from_token_counts(
-                token_counts, present_count, reserved_tokens, alphabet,
-                num_iterations, subtoken_length_limit=subtoken_length_limit)
+            present_count = _next_probe(min_val, max_val, target_size,
+                                        [(m, subtokenizer.vocab_size) for m, subtokenizer in probes])
+            subtokenizer = build(present_count)
 
             # Being within 1% of the target size is ok.
             is_ok = abs(subtokenizer.vocab_size - target_size) * 100 < target_size
@@ -182,8 +332,12 @@ class Subwords(object):
                 return subtokenizer
             logging.warning("vocab_size {0}, target_size: {1}, preset: {2}".format(subtokenizer.vocab_size, target_size, present_count))
             if subtokenizer.vocab_size > target_size:
+                if present_count >= max_val:
+                    return subtokenizer
                 other_subtokenizer = bisect(present_count + 1, max_val)
             else:
+                if present_count <= min_val:
+                    return subtokenizer
                 other_subtokenizer = bisect(min_val, present_count - 1)
 
             if other_subtokenizer is None:
@@ -194,5 +348,287 @@ class Subwords(object):
                 return other_subtokenizer
             return subtokenizer
 
-        return bisect(min_val, max_val)
+        try:
+            return bisect(min_val, max_val)
+        finally:
+            counter.close()
+
+
+# Vocabulary size falls roughly as a power of min_count, with exponent about
+# -0.5 on natural text.
+DEFAULT_SIZE_EXPONENT = -0.5
+
+
+def _next_probe(min_val, max_val, target_size, sizes):
+    """Chooses min_count to try next in [min_val, max_val].
+
+    Interpolates log vocabulary size as a linear function of log min_count
+    between the nearest probes on both sides of target size, or extrapolates
+    from the nearest probe.
+    Args:
+      sizes: list of (min_count, vocab_size) of previous probes.
+    """
+    if min_val >= max_val:
+        return min_val
+    larger = [(m, size) for m, size in sizes if size > target_size]
+    smaller = [(m, size) for m, size in sizes if size <= target_size]
+    if larger and smaller:
+        low = max(larger)
+        high = min(smaller)
+        if low[1] == high[1] or low[0] == high[0]:
+            exponent = DEFAULT_SIZE_EXPONENT
+        else:
+            exponent = (math.log(high[1]) - math.log(low[1])) / (math.log(high[0]) - math.log(low[0]))
+        nearest = low
+    elif sizes:
+        nearest = max(larger) if larger else min(smaller)
+        exponent = DEFAULT_SIZE_EXPONENT
+    else:
+        # Geometric middle, min_count is searched in log scale.
+        return min(max_val, max(min_val, int(round(math.sqrt(max(min_val, 1) * max_val)))))
+    if exponent >= 0:
+        exponent = DEFAULT_SIZE_EXPONENT
+    estimate = nearest[0] * math.exp((math.log(target_size) - math.log(nearest[1])) / exponent)
+    return min(max_val, max(min_val, int(round(estimate))))
+
+
+def subtoken_starts(subtokens):
+    """Returns tuple of start positions of subtokens in the token."""
+    starts = []
+    start = 0
+    for subtoken in subtokens:
+        starts.append(start)
+        start += len(subtoken)
+    return tuple(starts)
+
+
+def count_substrings(subtoken_counts, token, start, count, subtoken_length_limit=None):
+    """Adds count to every substring of token beginning at start, zero counts are removed."""
+    last_position = len(token) + 1
+    if subtoken_length_limit is not None:
+        last_position = min(last_position, start + subtoken_length_limit)
+    if count > 0:
+        for end in range(start + 1, last_position):
+            subtoken_counts[token[start:end]] += count
+        return
+    for end in range(start + 1, last_position):
+        new_subtoken = token[start:end]
+        new_count = subtoken_counts[new_subtoken] + count
+        if new_count:
+            subtoken_counts[new_subtoken] = new_count
+        else:
+            del subtoken_counts[new_subtoken]
+
+
+def merge_counts(subtoken_counts, other_counts):
+    """Adds other_counts to subtoken_counts, zero counts are removed."""
+    for subtoken, count in six.iteritems(other_counts):
+        new_count = subtoken_counts[subtoken] + count
+        if new_count:
+            subtoken_counts[subtoken] = new_count
+        else:
+            del subtoken_counts[subtoken]
+
+
+class SubstringCounter(object):
+    """Counts substrings starting at subtoken boundaries of a list of (token, count).
+
+    Keeps the segmentation of every token between iterations, so counts can be
+    updated by delta when only a few segmentations change.
+    """
+
+    def __init__(self, tokens, subtoken_length_limit=None):
+        self.tokens = tokens
+        self.subtoken_length_limit = subtoken_length_limit
+        self.token_starts = [()] * len(tokens)
+        self.changed = []
+
+    @property
+    def num_tokens(self):
+        return len(self.tokens)
+
+    def segment(self, subwords):
+        """Segments all tokens with the new vocabulary, returns number of changed tokens."""
+        token_starts = self.token_starts
+        self.changed = []
+        for index, (token, count) in enumerate(self.tokens):
+            starts = subtoken_starts(subwords.token_to_subtokens(token))
+            if starts != token_starts[index]:
+                self.changed.append((index, token_starts[index]))
+                token_starts[index] = starts
+        return len(self.changed)
+
+    def count(self, subtoken_counts, full, min_count=1):
+        """Counts all substrings if full is True, otherwise adds difference to the previous segmentation.
+        All substrings are counted whatever min_count is.
+        """
+        limit = self.subtoken_length_limit
+        if full:
+            for (token, count), starts in zip(self.tokens, self.token_starts):
+                for start in starts:
+                    count_substrings(subtoken_counts, token, start, count, limit)
+        else:
+            for index, old_starts in self.changed:
+                token, count = self.tokens[index]
+                new_starts = set(self.token_starts[index])
+                old_starts = set(old_starts)
+                for start in old_starts - new_starts:
+                    count_substrings(subtoken_counts, token, start, -count, limit)
+                for start in new_starts - old_starts:
+                    count_substrings(subtoken_counts, token, start, count, limit)
+        self.changed = []
+        return subtoken_counts
+
+    def close(self):
+        pass
+
+
+class SuffixArrayCounter(SubstringCounter):
+    """Counts only substrings occurring at least min_count times.
+
+    Suffixes of tokens starting at subtoken boundaries are kept as (token,
+    start, count) references and sorted by radix, one symbol at a time: a
+    substring is the common prefix of a group of suffixes and its count is the
+    sum of their token counts. A group below min_count is not split further,
+    as longer substrings can't occur more often, so substrings below min_count
+    are never built and suffixes are never copied. Memory is bounded by the
+    references and the result instead of all substrings, which is quadratic
+    in token length. Suffixes are grouped by the first symbol; with `parts` > 1
+    only symbols with code `part` modulo `parts` are counted, so counters of
+    different parts share the work.
+    """
+
+    def __init__(self, tokens, subtoken_length_limit=None, part=0, parts=1):
+        super(SuffixArrayCounter, self).__init__(tokens, subtoken_length_limit)
+        self.part = part
+        self.parts = parts
+
+    def count(self, subtoken_counts, full, min_count=1):
+        """Replaces subtoken_counts with counts of substrings occurring at least
+        min_count times and of all single symbols."""
+        limit = self.subtoken_length_limit
+        # Substrings are shorter than the limit, as in count_substrings.
+        max_length = limit - 1 if limit is not None else None
+        buckets = collections.defaultdict(list)
+        for (token, count), starts in zip(self.tokens, self.token_starts):
+            for start in starts:
+                if self.parts == 1 or ord(token[start]) % self.parts == self.part:
+                    buckets[token[start]].append((token, start, count))
+        subtoken_counts.clear()
+        for symbol in list(buckets):
+            suffixes = buckets.pop(symbol)
+            subtoken_counts[symbol] = sum(count for _, _, count in suffixes)
+            self._count_prefixes(subtoken_counts, suffixes, min_count, max_length)
+        self.changed = []
+        return subtoken_counts
+
+    @staticmethod
+    def _count_prefixes(subtoken_counts, suffixes, min_count, max_length):
+        """Counts common prefixes longer than one symbol of suffixes sharing the first symbol."""
+        # Stack of groups of suffixes sharing the first `length` symbols, depth first
+        # keeps every suffix in at most one group.
+        groups = [(1, suffixes)]
+        while groups:
+            length, group = groups.pop()
+            if max_length is not None and length >= max_length:
+                continue
+            next_groups = collections.defaultdict(list)
+            for suffix in group:
+                token, start, _ = suffix
+                if start + length < len(token):
+                    next_groups[token[start + length]].append(suffix)
+            for next_group in six.itervalues(next_groups):
+                total = sum(count for _, _, count in next_group)
+                if total < min_count:
+                    continue
+                token, start, _ = next_group[0]
+                if len(next_group) == 1:
+                    # All longer prefixes of a single suffix have the same count.
+                    end = len(token) if max_length is None else min(len(token), start + max_length)
+                    for l in range(start + length + 1, end + 1):
+                        subtoken_counts[token[start:l]] = total
+                else:
+                    subtoken_counts[token[start:start + length + 1]] = total
+                    groups.append((length + 1, next_group))
+
+
+def _counter_worker(conn, counter):
+    while True:
+        try:
+            command, arg = conn.recv()
+        except EOFError:
+            break
+        if command == 'close':
+            break
+        if command == 'segment':
+            conn.send(counter.segment(Subwords(arg, cache_size=0)))
+        elif command == 'count':
+            full, min_count = arg
+            conn.send(dict(counter.count(collections.defaultdict(int), full, min_count)))
+    conn.close()
+
+
+class ParallelSubstringCounter(object):
+    """SubstringCounter sharded across processes.
+
+    Each process owns a share of the tokens and their segmentations, only
+    vocabularies and partial counts are sent between processes. With
+    suffix_array every process segments all tokens and owns a share of first
+    symbols of substrings, as a substring count can't be split between tokens.
+    """
+
+    def __init__(self, token_counts, processes, subtoken_length_limit=None, suffix_array=False):
+        from multiprocessing import Process, Pipe
+        tokens = list(six.iteritems(token_counts))
+        self.num_tokens = len(tokens)
+        self.suffix_array = suffix_array
+        self.conns = []
+        self.procs = []
+        for i in range(processes):
+            if suffix_array:
+                counter = SuffixArrayCounter(tokens, subtoken_length_limit, part=i, parts=processes)
+            else:
+                counter = SubstringCounter(tokens[i::processes], subtoken_length_limit)
+            conn, child_conn = Pipe()
+            proc = Process(target=_counter_worker, args=(child_conn, counter))
+            proc.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def _broadcast(self, command, arg):
+        for conn in self.conns:
+            conn.send((command, arg))
+        return [conn.recv() for conn in self.conns]
+
+    def segment(self, subwords):
+        changed = self._broadcast('segment', subwords.all_subtoken_strings)
+        # every process segments all tokens
+        return changed[0] if self.suffix_array else sum(changed)
+
+    def count(self, subtoken_counts, full, min_count=1):
+        if self.suffix_array:
+            subtoken_counts.clear()
+        for partial_counts in self._broadcast('count', (full, min_count)):
+            merge_counts(subtoken_counts, partial_counts)
+        return subtoken_counts
+
+    def close(self):
+        # Other workers hold inherited copies of the pipes, so EOF is not enough.
+        for conn in self.conns:
+            try:
+                conn.send(('close', None))
+            except (IOError, OSError):
+                # the worker is dead, the error it caused is already raised
+                pass
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+
 
+def _substring_counter(token_counts, processes=1, subtoken_length_limit=None, suffix_array=False):
+    if processes > 1:
+        return ParallelSubstringCounter(token_counts, processes, subtoken_length_limit, suffix_array)
+    if suffix_array:
+        return SuffixArrayCounter(list(six.iteritems(token_counts)), subtoken_length_limit)
+    return SubstringCounter(list(six.iteritems(token_counts)), subtoken_length_limit)
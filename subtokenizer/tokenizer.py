@@ -1,11 +1,29 @@
 # coding: utf-8
 from __future__ import unicode_literals, absolute_import
 
-import regex
+import re
 from six import iteritems
 from subtokenizer.utils import NOSPACE, ENCODED, SPACESYMBOL, NOBREAK, TAGSYMBOL, ONEUPPER, ALLUPPER
 
 
+class LazyRegex(object):
+    """Class attribute compiled with `regex` module on first access.
+
+    Compiling the tokenizer regexes takes most of import time, so they are
+    compiled only when used and then kept.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.compiled = None
+
+    def __get__(self, instance, owner):
+        compiled = self.compiled
+        if compiled is None:
+            import regex
+            compiled = self.compiled = regex.compile(self.pattern)
+        return compiled
+
 
 class ReTokenizer(object):
     LANGUAGES = ["Arabic","Armenian","Bengali","Bopomofo","Braille","Buhid",
@@ -14,16 +32,29 @@ class ReTokenizer(object):
                  "Inherited","Kannada","Katakana","Khmer","Lao","Latin","Limb","Malayalam",
                  "Mongolian","Myanmar","Ogham","Oriya","Runic","Sinhala","Syriac","Tagalog",
                  "Tagbanwa","TaiLe","Tamil","Thaana","Thai","Tibetan","Yi","N"]
-    WORD = '(?P<WORD>' + '|'.join(r'{0}?[\p{{{1}}}][\p{{{1}}}\p{{M}}]*{2}?'.format(NOBREAK, lang, SPACESYMBOL) for lang in LANGUAGES) + ')'
+    # Same as REFERENCE_WORD, optional NOBREAK and SPACESYMBOL are matched once
+    # instead of backtracking through them in every alternative.
+    WORD = ('(?P<WORD>{0}?(?:'.format(NOBREAK) +
+            '|'.join(r'[\p{{{0}}}][\p{{{0}}}\p{{M}}]*'.format(lang) for lang in LANGUAGES) +
+            '){0}?)'.format(SPACESYMBOL))
+    REFERENCE_WORD = '(?P<WORD>' + '|'.join(r'{0}?[\p{{{1}}}][\p{{{1}}}\p{{M}}]*{2}?'.format(NOBREAK, lang, SPACESYMBOL) for lang in LANGUAGES) + ')'
     ALL_ALPH = ''.join(r'\p{{{0}}}'.format(lang) for lang in LANGUAGES)
     WORD_NO_ALPH_SPLIT = r'(?P<WORD>{0}?[{1}][{1}\p{{M}}]*{2}?)'.format(NOBREAK,ALL_ALPH,  SPACESYMBOL)
     ENCODED = '(?P<ENCODED>&#[0-9]+;)'
     TAG = '(?P<TAG>'+TAGSYMBOL+'[a-zA-Z0-9_]+'+SPACESYMBOL+'?)'
-    TOKENIZER_RE = regex.compile(r'(?V1p)' + '|'.join((WORD, ENCODED, TAG)))
-    TOKENIZER_NO_ALPH_SPLIT = regex.compile(r'(?V1p)' + '|'.join((WORD_NO_ALPH_SPLIT, ENCODED, TAG)))
-    REMOVE_SPACE_RE = regex.compile(r'(?V1p) ' + NOBREAK + '?' + NOSPACE)
-    LOWER_RE = regex.compile(r'(?V1p)(?P<CAPITAL>\p{Lu}+[\p{L}--\p{Lu}])|(?P<UPPER>\p{Lu}+)')
-    UPPER_RE = regex.compile(r'(?V1p)({0}\p{{L}})|({1}\p{{L}}+(?!p{{L}}))'.format(ONEUPPER, ALLUPPER))
+    TOKENIZER_RE = LazyRegex(r'(?V1p)' + '|'.join((WORD, ENCODED, TAG)))
+    REFERENCE_TOKENIZER_RE = LazyRegex(r'(?V1p)' + '|'.join((REFERENCE_WORD, ENCODED, TAG)))
+    TOKENIZER_NO_ALPH_SPLIT = LazyRegex(r'(?V1p)' + '|'.join((WORD_NO_ALPH_SPLIT, ENCODED, TAG)))
+    # Plain pattern, stdlib re is faster on it.
+    REMOVE_SPACE_RE = re.compile(' ' + NOBREAK + '?' + NOSPACE)
+    LOWER_RE = LazyRegex(r'(?V1p)(?P<CAPITAL>\p{Lu}+[\p{L}--\p{Lu}])|(?P<UPPER>\p{Lu}+)')
+    UPPER_RE = LazyRegex(r'(?V1p)({0}\p{{L}})|({1}\p{{L}}+(?!p{{L}}))'.format(ONEUPPER, ALLUPPER))
+
+    @classmethod
+    def compile(cls):
+        """Compiles all regexes now, for example before forking processes to share them."""
+        for name in ('TOKENIZER_RE', 'TOKENIZER_NO_ALPH_SPLIT', 'LOWER_RE', 'UPPER_RE'):
+            getattr(cls, name)
 
     @staticmethod
     def _do_lower(t):
@@ -49,14 +80,141 @@ class ReTokenizer(object):
             words.append(punctuation)
         return words
     
+    @staticmethod
+    def _append_punctuation(words, last_word, punctuation):
+        """Same as _add_punctuation, but the last word is a list of parts not yet in words."""
+        if punctuation[0] == NOBREAK and last_word:
+            last_word.append(punctuation)
+            return last_word
+        if last_word:
+            if last_word[-1][-1] != SPACESYMBOL:
+                last_word.append(SPACESYMBOL)
+                punctuation = NOSPACE + punctuation
+            words.append(''.join(last_word))
+        return [punctuation]
+
     @classmethod
     def tokenize(cls, text, split_by_alphabets=True, lowercase=False):
+        if lowercase:
+            text = cls.LOWER_RE.sub(cls._do_lower, text)
+        text = text.replace(' ', SPACESYMBOL)
+        tokenizer_re = cls.TOKENIZER_RE if split_by_alphabets else cls.TOKENIZER_NO_ALPH_SPLIT
+        words = []
+        # Parts of the last word, joined when the next word starts.
+        last_word = []
+        position = 0
+        for w_it in tokenizer_re.finditer(text):
+            if w_it.lastgroup == 'ENCODED':
+                continue
+            start, end = w_it.span()
+            if position < start:
+                last_word = cls._append_punctuation(words, last_word, text[position:start])
+            word = w_it.group()
+            if word[0] == NOBREAK and last_word:
+                last_word.append(word)
+            else:
+                if last_word:
+                    words.append(''.join(last_word))
+                last_word = [word]
+            position = end
+        if position != len(text):
+            last_word = cls._append_punctuation(words, last_word, text[position:])
+        elif last_word and last_word[-1][-1] != SPACESYMBOL:
+            last_word.append(SPACESYMBOL)
+            words.append(''.join(last_word))
+            last_word = [NOSPACE]
+        if last_word:
+            words.append(''.join(last_word))
+        return words
+
+    @classmethod
+    def word_spans(cls, text, split_by_alphabets=True):
+        """Word positions for `tokenize` without building the words.
+        Args:
+            text: unicode string, already lowercased if needed.
+        Returns:
+            List of (start, end, nospace, space) tuples: the word is text[start:end]
+            with spaces replaced by SPACESYMBOL, prefixed by NOSPACE if nospace is True
+            and followed by SPACESYMBOL if space is True.
+        """
+        tokenizer_re = cls.TOKENIZER_RE if split_by_alphabets else cls.TOKENIZER_NO_ALPH_SPLIT
+        text = text.replace(' ', SPACESYMBOL)
+        spans = []
+        last = None
+
+        def add_punctuation(last, start, end):
+            if text[start] == NOBREAK and last:
+                last[1] = end
+                return last
+            nospace = False
+            if last:
+                if text[last[1] - 1] != SPACESYMBOL:
+                    last[3] = True
+                    nospace = True
+                spans.append(tuple(last))
+            return [start, end, nospace, False]
+
+        position = 0
+        for w_it in tokenizer_re.finditer(text):
+            if w_it.lastgroup == 'ENCODED':
+                continue
+            start, end = w_it.span()
+            if position < start:
+                last = add_punctuation(last, position, start)
+            if text[start] == NOBREAK and last:
+                last[1] = end
+            else:
+                if last:
+                    spans.append(tuple(last))
+                last = [start, end, False, False]
+            position = end
+        if position != len(text):
+            last = add_punctuation(last, position, len(text))
+        elif last and text[last[1] - 1] != SPACESYMBOL:
+            last[3] = True
+            spans.append(tuple(last))
+            last = [len(text), len(text), True, False]
+        if last:
+            spans.append(tuple(last))
+        return spans
+
+    @classmethod
+    def lower_with_positions(cls, text):
+        """Lowercases text as `tokenize` does.
+        Returns:
+            Lowercased text and list of positions in text for every symbol of it,
+            or None if text is not changed. Case markers point to the next symbol.
+        """
+        positions = []
+        position = 0
+        parts = []
+        for match in cls.LOWER_RE.finditer(text):
+            start, end = match.span()
+            positions.extend(range(position, start))
+            parts.append(text[position:start])
+            lowered = cls._do_lower(match)
+            source = start
+            for ch in lowered:
+                positions.append(min(source, end - 1))
+                if ch != ONEUPPER and ch != ALLUPPER:
+                    source += 1
+            parts.append(lowered)
+            position = end
+        if not parts:
+            return text, None
+        positions.extend(range(position, len(text)))
+        parts.append(text[position:])
+        return ''.join(parts), positions
+
+    @classmethod
+    def reference_tokenize(cls, text, split_by_alphabets=True, lowercase=False):
+        """Original implementation of `tokenize`, kept to check it."""
         words = []
         position = 0
         if lowercase:
             text = cls.LOWER_RE.sub(cls._do_lower, text)
         text = text.replace(' ', SPACESYMBOL)
-        w_iter = cls.TOKENIZER_RE.finditer(text) if split_by_alphabets else cls.TOKENIZER_NO_ALPH_SPLIT.finditer(text)
+        w_iter = cls.REFERENCE_TOKENIZER_RE.finditer(text) if split_by_alphabets else cls.TOKENIZER_NO_ALPH_SPLIT.finditer(text)
         for w_it in w_iter:
             token_type = next(k for k, v in iteritems(w_it.groupdict()) if v is not None)
             if token_type == 'ENCODED':
@@ -81,8 +239,16 @@ class ReTokenizer(object):
 
     @classmethod
     def detokenize(cls, words, restore_case=False):
-        text = cls.REMOVE_SPACE_RE.sub('', ''.join(words).replace(SPACESYMBOL, ' '))
-        if (restore_case):
+        return cls.detokenize_text(''.join(words).replace(SPACESYMBOL, ' '), restore_case=restore_case)
+
+    @classmethod
+    def detokenize_text(cls, text, restore_case=False):
+        """Same as detokenize for joined words with spaces instead of SPACESYMBOL.
+        Regex passes are skipped when there is no marker they could match.
+        """
+        if NOSPACE in text:
+            text = cls.REMOVE_SPACE_RE.sub('', text)
+        if restore_case and (ONEUPPER in text or ALLUPPER in text):
             text = cls.UPPER_RE.sub(cls._do_upper, text)
         return text
 
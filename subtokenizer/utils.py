@@ -3,18 +3,22 @@
 from __future__ import unicode_literals, division, absolute_import
 
 import io
+import os
+import re
+import sys
 import six
-import regex
+import math
+import mmap
+import heapq
+import functools
 import unicodedata
-from threading import Thread
 from collections import defaultdict
-from multiprocessing import Process, Pipe
 
+# multiprocessing, threading, tempfile, traceback, random and html are imported where they are
+# used, they are not needed to load a model and take a good part of import time.
 if six.PY2:
     from HTMLParser import HTMLParser
     HTML_PARSER = HTMLParser()
-else:
-    import html
 
 NOSPACE = '˿'
 ENCODED = '&'
@@ -28,63 +32,264 @@ ESCAPE_CHARS = set("˿&↑↟·¬@#;0123456789")
 
 SPECIALSYMBOLS = set([NOSPACE, ENCODED, SPACESYMBOL, NOBREAK, TAGSYMBOL, ONEUPPER, ALLUPPER])
 ALLOWEDCONTROLS = set(['\n', ' ', '\t'])
-SYMBOLRE = regex.compile(r"&#([0-9]+);")
+SYMBOLRE = re.compile(r"&#([0-9]+);")
 
 
 def unescape(text):
     if six.PY2:
         return HTML_PARSER.unescape(text)
     else:
+        import html
         return html.unescape(text)
 
 
-def multiprocess(func, in_generator, processes=1):
-    in_pipes = list(map(lambda x: Pipe(False), range(processes)))
-    out_pipes = list(map(lambda x: Pipe(False), range(processes)))
-
-    def writer():
-        pipe_cnt = 0
-        for obj in in_generator:
-            in_pipes[pipe_cnt][1].send(obj)
-            pipe_cnt += 1
-            if pipe_cnt >= processes:
-                pipe_cnt = 0
-        for conn_recv, conn_send in in_pipes:
-            conn_send.close()
-
-    def proc_func(func, proc_num):
-        for conn_recv, conn_send in in_pipes:
-            conn_send.close()
-        conn_recv = in_pipes[proc_num][0]
-        conn_send = out_pipes[proc_num][1]
-        while True:
-            try:
-                line = conn_recv.recv()
-            except EOFError:
-                break
-            conn_send.send(func(line))
-        conn_send.close()
-
-    procs = list(map(lambda x: Process(target=proc_func, args=(func, x)), range(processes)))
-    for i in range(processes):
-        procs[i].start()
-        out_pipes[i][1].close()
-    write_proc = Thread(target=writer)
-    write_proc.start()
-
-    current_pipe = 0
-    live_pipes = [True] * processes
+DEFAULT_CHUNK_SIZE = 64
+# seconds between checks that workers are alive while waiting for results
+POLL_INTERVAL = 1.0
+
+
+def _chunks(iterable, chunk_size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _pool_worker(func, in_queue, out_queue):
+    # Results of an abandoned imap are never read, do not wait for them on exit.
+    out_queue.cancel_join_thread()
     while True:
-        if not any(live_pipes):
+        task = in_queue.get()
+        if task is None:
             break
-        if live_pipes[current_pipe]:
+        seq, chunk = task
+        try:
+            out_queue.put((seq, [func(item) for item in chunk]))
+        except Exception:
+            import traceback
+            out_queue.put((seq, WorkerError(traceback.format_exc())))
+
+
+class WorkerError(Exception):
+    """Exception raised by func in a worker process, message holds the traceback."""
+
+
+class WorkerPool(object):
+    """Pool of forked processes applying func to chunks of items.
+
+    Items are sent in chunks of `chunk_size` with sequence numbers, so results
+    are returned in input order no matter which worker finishes first. At most
+    `max_chunks` chunks are in flight, which bounds queues and memory when
+    input is faster than workers or output. Workers are forked once and keep
+    everything func refers to (a loaded model for example) between `imap` calls.
+    Sequence numbers are tagged with the `imap` call, so results left by an
+    abandoned or failed call are dropped by the next one. A worker killed
+    while the results are awaited raises WorkerError, an exception raised
+    by the input iterable is raised after the results of preceding items.
+    """
+
+    def __init__(self, func, processes=1, chunk_size=DEFAULT_CHUNK_SIZE, max_chunks=None):
+        self.chunk_size = max(1, chunk_size)
+        self.max_chunks = max_chunks or 4 * processes
+        from multiprocessing import Process, Queue
+        self.in_queue = Queue(self.max_chunks)
+        self.out_queue = Queue()
+        self.calls = 0
+        self.procs = [Process(target=_pool_worker, args=(func, self.in_queue, self.out_queue))
+                      for _ in range(processes)]
+        import gc
+        # Objects of the parent are left out of garbage collection in workers,
+        # otherwise collections write to them and copy their pages in every worker.
+        freeze = getattr(gc, 'freeze', None)
+        if freeze is not None:
+            freeze()
+        try:
+            for proc in self.procs:
+                proc.daemon = True
+                proc.start()
+        finally:
+            if freeze is not None:
+                gc.unfreeze()
+
+    def imap(self, iterable):
+        from threading import Thread, Semaphore
+        in_flight = Semaphore(self.max_chunks)
+        in_queue = self.in_queue
+        out_queue = self.out_queue
+        self.calls += 1
+        call = self.calls
+        # exc_info of the input iterable failed in the writer thread
+        input_error = []
+
+        def writer():
+            seq = 0
+            try:
+                for chunk in _chunks(iterable, self.chunk_size):
+                    in_flight.acquire()
+                    in_queue.put(((call, seq), chunk))
+                    seq += 1
+            except Exception:
+                input_error.append(sys.exc_info())
+            finally:
+                out_queue.put(((call, None), seq))
+
+        write_thread = Thread(target=writer)
+        write_thread.daemon = True
+        write_thread.start()
+
+        pending = {}
+        next_seq = 0
+        total = None
+        while total is None or next_seq < total:
+            (result_call, seq), result = self._get_result()
+            if result_call != call:
+                continue
+            if seq is None:
+                total = result
+                continue
+            if isinstance(result, WorkerError):
+                raise result
+            pending[seq] = result
+            while next_seq in pending:
+                for item in pending.pop(next_seq):
+                    yield item
+                next_seq += 1
+                in_flight.release()
+        if input_error:
+            six.reraise(*input_error[0])
+
+    def _get_result(self):
+        from six.moves.queue import Empty
+        while True:
             try:
-                yield out_pipes[current_pipe][0].recv()
-            except EOFError:
-                live_pipes[current_pipe] = False
-        current_pipe = current_pipe + 1
-        if current_pipe >= processes:
-            current_pipe = 0
+                return self.out_queue.get(timeout=POLL_INTERVAL)
+            except Empty:
+                pass
+            for proc in self.procs:
+                # workers exit only when the pool is closed
+                if not proc.is_alive():
+                    raise WorkerError("worker process {0} exited with code {1}".format(proc.pid, proc.exitcode))
+
+    def close(self):
+        if any(not proc.is_alive() for proc in self.procs):
+            # A killed worker may hold a queue lock, the others can't be stopped by a message.
+            for proc in self.procs:
+                proc.terminate()
+        else:
+            for _ in self.procs:
+                self.in_queue.put(None)
+        for proc in self.procs:
+            proc.join()
+
+
+def file_ranges(filenames, parts):
+    """Splits files into newline aligned byte ranges.
+    Returns:
+        List of (filename, start, end) in file order, about `parts` ranges of
+        similar size in total, empty files are skipped.
+    """
+    sizes = [os.path.getsize(filename) for filename in filenames]
+    range_size = max(1, -(-sum(sizes) // max(1, parts)))
+    ranges = []
+    for filename, size in zip(filenames, sizes):
+        if not size:
+            continue
+        with io.open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = start + range_size
+                if end >= size:
+                    end = size
+                else:
+                    newline = data.find(b'\n', end - 1)
+                    end = size if newline < 0 else newline + 1
+                ranges.append((filename, start, end))
+                start = end
+        finally:
+            data.close()
+    return ranges
+
+
+def read_range(filename, start=0, end=None):
+    """Yields utf-8 lines of the byte range of file with line ends, as lines of sys.stdin."""
+    with io.open(filename, 'rb') as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        if start >= end:
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        data.seek(start)
+        while data.tell() < end:
+            yield data.readline().decode('utf-8')
+    finally:
+        data.close()
+
+
+def read_files(filenames):
+    for filename in filenames:
+        for line in read_range(filename):
+            yield line
+
+
+def _write_shard(func, directory, stats, task):
+    index, (filename, start, end) = task
+    path = os.path.join(directory, 'shard{0}'.format(index))
+    with io.open(path, 'wb') as out:
+        for line in read_range(filename, start, end):
+            out.write(func(line).encode('utf-8'))
+            out.write(b'\n')
+    if stats is not None:
+        return path, stats.pop()
+    return path
+
+
+def map_file_shards(func, filenames, output, processes=1, parts=None, directory=None, stats=None):
+    """Applies func to lines of files in worker processes reading their own byte ranges.
+
+    Every worker reads byte ranges of the files and writes func(line) and a
+    line break for every line into a shard file per range, shards are appended
+    to output in order, so only file names pass between processes.
+    Args:
+        func: function of a line returning unicode string.
+        output: binary stream.
+        parts: number of byte ranges, 4 per process by default.
+        directory: where shards are written, system temporary directory by default.
+        stats: Stats collected by func in workers, merged into it after every range.
+    """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix='subtokenizer', dir=directory)
+    try:
+        ranges = file_ranges(filenames, parts or 4 * processes)
+        pool = WorkerPool(functools.partial(_write_shard, func, directory, stats), processes, chunk_size=1)
+        try:
+            for path in pool.imap(enumerate(ranges)):
+                if stats is not None:
+                    path, worker_stats = path
+                    stats.merge(worker_stats)
+                with io.open(path, 'rb') as shard:
+                    shutil.copyfileobj(shard, output)
+                os.remove(path)
+        finally:
+            pool.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def multiprocess(func, in_generator, processes=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    pool = WorkerPool(func, processes, chunk_size)
+    try:
+        for item in pool.imap(in_generator):
+            yield item
+    finally:
+        pool.close()
 
 
 if six.PY2:
@@ -113,8 +318,15 @@ def wrap_text_reader(stream, *args, **kwargs):
     return io.TextIOWrapper(stream, *args, **kwargs)
 
 
-def normalize_text(text):
-    return unicodedata.normalize('NFKC', text)
+if hasattr(six.text_type, 'isascii'):
+    def normalize_text(text):
+        # NFKC doesn't change ascii text
+        if text.isascii():
+            return text
+        return unicodedata.normalize('NFKC', text)
+else:
+    def normalize_text(text):
+        return unicodedata.normalize('NFKC', text)
 
 
 def encode_symbol(ch):
@@ -131,8 +343,28 @@ def encode_control_symbol(ch):
     return ch
 
 
+class EncodingTable(dict):
+    """Translation table for `str.translate` filled on first lookup of a code point.
+
+    Maps code point to encode_func(symbol), so a text is encoded by a single
+    translate call instead of a Python call per symbol.
+    """
+
+    def __init__(self, encode_func):
+        super(EncodingTable, self).__init__()
+        self.encode_func = encode_func
+
+    def __missing__(self, code):
+        value = self.encode_func(six.unichr(code))
+        self[code] = value
+        return value
+
+
+CONTROLS_TABLE = EncodingTable(encode_control_symbol)
+
+
 def encode_controls(text):
-    return "".join(encode_control_symbol(ch) for ch in text)
+    return text.translate(CONTROLS_TABLE)
 
 
 def encode_with_alphabet_symbol(ch, alphabet):
@@ -141,10 +373,45 @@ def encode_with_alphabet_symbol(ch, alphabet):
     return ch
 
 
+def alphabet_table(alphabet):
+    """Translation table for encode_with_alphabet."""
+    return EncodingTable(lambda ch: encode_with_alphabet_symbol(ch, alphabet))
+
+
 def encode_with_alphabet(text, alphabet):
     return "".join(encode_with_alphabet_symbol(ch, alphabet) for ch in text)
 
 
+def translate_with_positions(text, table):
+    """Translates text with EncodingTable.
+    Returns:
+        Translated text and list of positions in text for every symbol of it,
+        or None if every symbol is translated to one symbol.
+    """
+    translated = text.translate(table)
+    if len(translated) == len(text):
+        return translated, None
+    # Only symbols translated to several symbols are looked at one by one.
+    expanded = [re.escape(ch) for ch in set(text) if len(table[ord(ch)]) != 1]
+    positions = []
+    position = 0
+    for match in re.finditer('[{0}]'.format(''.join(expanded)), text):
+        i = match.start()
+        positions.extend(range(position, i))
+        positions.extend([i] * len(table[ord(text[i])]))
+        position = i + 1
+    positions.extend(range(position, len(text)))
+    return translated, positions
+
+
+def prepare_text(text, encode_controls=True):
+    """Unicode normalization and control symbols encoding in one step."""
+    text = normalize_text(text)
+    if encode_controls:
+        text = text.translate(CONTROLS_TABLE)
+    return text
+
+
 def alphabet_from_tokens(word_counts, min_count=0):
     symbolcount = defaultdict(int)
     for token, val in six.iteritems(word_counts):
@@ -156,7 +423,114 @@ def alphabet_from_tokens(word_counts, min_count=0):
 
 
 def encode_tokens_with_alphabet(word_counts, alphabet):
+    table = alphabet_table(alphabet)
     new_word_counts = defaultdict(int)
     for token, val in six.iteritems(word_counts):
-        new_word_counts[encode_with_alphabet(token, alphabet)] += val
+        new_word_counts[token.translate(table)] += val
     return new_word_counts
+
+
+def sample_token_counts(token_counts, sample, seed=0):
+    """Frequency weighted sample of token types without replacement.
+    Args:
+        token_counts: dict of token to count.
+        sample: fraction of token types if less than 1, number of token types otherwise.
+        seed: random seed.
+    Returns:
+        dict of sampled tokens with their counts.
+    """
+    if sample <= 0:
+        raise ValueError("sample must be positive: {0}".format(sample))
+    # a small fraction of few types still samples one of them
+    size = max(1, int(round(sample * len(token_counts))) if sample < 1 else int(sample))
+    if size >= len(token_counts):
+        return dict(token_counts)
+    import random
+    rnd = random.Random(seed)
+    # Keys log(u) / count of uniform u, tokens with the largest keys are
+    # a sample with probabilities proportional to counts (Efraimidis-Spirakis).
+    keys = ((math.log(1.0 - rnd.random()) / count, token) for token, count in six.iteritems(token_counts))
+    return {token: token_counts[token] for _, token in heapq.nlargest(size, keys)}
+
+
+class StreamingCounter(object):
+    """Token counter with bounded number of entries.
+
+    When the number of distinct tokens exceeds `max_size`, entries with the
+    lowest counts are pruned until half of `max_size` remain (lossy counting).
+    Every kept token remembers `error` at the time it was (re)inserted, so
+    for each token in `counts()`:
+        count <= true count <= count + token error <= count + self.error
+    Any token with true count greater than `self.error` is kept. Without
+    pruning (`max_size` is None or never reached) counts are exact.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.token_counts = defaultdict(int)
+        self.token_errors = {}
+        self.error = 0
+        self.total = 0
+
+    def __len__(self):
+        return len(self.token_counts)
+
+    def update(self, tokens):
+        token_counts = self.token_counts
+        total = 0
+        if self.error:
+            token_errors = self.token_errors
+            error = self.error
+            for token in tokens:
+                if token not in token_counts:
+                    token_errors[token] = error
+                token_counts[token] += 1
+                total += 1
+        else:
+            for token in tokens:
+                token_counts[token] += 1
+                total += 1
+        self.total += total
+        if self.max_size is not None and len(token_counts) > self.max_size:
+            self.prune(self.max_size // 2)
+
+    def prune(self, size):
+        """Removes least frequent tokens leaving at most size of them."""
+        token_counts = self.token_counts
+        token_errors = self.token_errors
+        upper_bounds = sorted(count + token_errors.get(token, 0) for token, count in six.iteritems(token_counts))
+        threshold = upper_bounds[-size - 1] if size < len(upper_bounds) else 0
+        for token, count in list(six.iteritems(token_counts)):
+            if count + token_errors.get(token, 0) <= threshold:
+                del token_counts[token]
+                token_errors.pop(token, None)
+        self.error = max(self.error, threshold)
+
+    def merge(self, other):
+        """Adds counts of other counter, for example of another part of the text."""
+        token_counts = self.token_counts
+        token_errors = self.token_errors
+        other_counts = other.token_counts
+        if self.error or other.error:
+            # A token missing in one of counters may have been pruned from it.
+            if other.error:
+                for token in token_counts:
+                    if token not in other_counts:
+                        token_errors[token] = token_errors.get(token, 0) + other.error
+            for token, count in six.iteritems(other_counts):
+                error = other.token_errors.get(token, 0)
+                error += token_errors.get(token, 0) if token in token_counts else self.error
+                if error:
+                    token_errors[token] = error
+                token_counts[token] += count
+        else:
+            for token, count in six.iteritems(other_counts):
+                token_counts[token] += count
+        self.error += other.error
+        self.total += other.total
+        if self.max_size is not None and len(token_counts) > self.max_size:
+            self.prune(self.max_size // 2)
+
+    def counts(self):
+        """Returns token counts, lower bounds of true counts."""
+        return self.token_counts
@@ -1,12 +1,29 @@
 # coding: utf-8
 from __future__ import unicode_literals, division, absolute_import
 
+import io
+import os
+import sys
+import six
+import json
+import time
+import random
+import pytest
+import subprocess
 from builtins import str
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from subtokenizer.cache import LRUCache, MemoCache
+from subtokenizer.stats import Stats, process_memory
+from subtokenizer.binary import IdsWriter, read_ids, load_ids
+from subtokenizer import counts
+from subtokenizer.counts import write_counts, iter_counts, merge_files, load_counts, read_header
+from subtokenizer.compiled import is_compiled
 from subtokenizer.subtokenizer import SubTokenizer
-from subtokenizer.subwords import PAD_ID
+from subtokenizer.subwords import (Subwords, RESERVED_TOKENS, PAD_ID, SubstringCounter, SuffixArrayCounter,
+                                   ParallelSubstringCounter, _next_probe)
 from subtokenizer.tokenizer import ReTokenizer
-from subtokenizer.utils import TAGSYMBOL, SPACESYMBOL
+from subtokenizer.utils import (TAGSYMBOL, SPACESYMBOL, NOBREAK, StreamingCounter, WorkerError, WorkerPool, multiprocess,
+                                file_ranges, read_range, map_file_shards, sample_token_counts, encode_controls, encode_control_symbol, encode_with_alphabet_symbol, alphabet_table)
 
 TEXT = ('The store is just across from my house.\r\n'
             'The store is close to my house.\n'
@@ -133,3 +150,613 @@ def test_numeric():
     tokens = st_test.tokenize(s)
     assert not TAGSYMBOL + 'store' in tokens
     assert s == st_test.detokenize(tokens.__iter__())
+
+
+def test_trie_segmentation():
+    subwords = Subwords(RESERVED_TOKENS + ['a', 'b', 'c', 'ab', 'abc', 'bcab', 'cc'])
+    subtokens, ids = subwords.token_to_subtokens_ids('abcabccab')
+    assert subtokens == ['abc', 'abc', 'c', 'ab']
+    assert ids == subwords.subtokens_to_ids(subtokens)
+    assert subwords.token_to_subtokens('bcabcc') == ['bcab', 'cc']
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    assert cache.data is None
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (3, 1, 1)
+
+    disabled = LRUCache(0)
+    disabled.put('a', 1)
+    assert disabled.get('a') is None and disabled.data is None
+
+
+def test_memo_cache():
+    cache = MemoCache(2)
+    data = cache.data
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('c', 3)
+    assert cache.data is data and data == {'c': 3}
+    assert cache.get('a') == 1 and 'a' in data
+    assert cache.get('d') is None
+    cache.put('d', 4)
+    assert cache.get('b') is None and cache.get('c') == 3
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 2, 1)
+
+
+def _learn_test_subtokenizer(lowercase=False, **kwargs):
+    words_count = defaultdict(int)
+    for l in TEXT.splitlines():
+        for r in ReTokenizer.tokenize(l.strip('\n'), lowercase=lowercase):
+            words_count[r] += 1
+    st_test = SubTokenizer.learn(words_count, min_symbol_count=2, size=70, reserved_tokens=[TAGSYMBOL + 'name'], **kwargs)
+    st_test.lowercase = lowercase
+    return st_test
+
+
+def test_word_cache(tmpdir):
+    lines = TEXT.splitlines()
+    for kwargs in ({}, {'reversed_bpe': True}):
+        st_test = _learn_test_subtokenizer(**kwargs)
+        st_test.save(str(tmpdir.join('bpe.txt')))
+        reference = SubTokenizer.load(str(tmpdir.join('bpe.txt')), word_cache_size=0, **kwargs)
+        for word_cache_size in (1, 5, 1000):
+            for numeric in (False, True):
+                st_test = SubTokenizer.load(str(tmpdir.join('bpe.txt')), word_cache_size=word_cache_size, **kwargs)
+                for _ in range(2):
+                    for l in lines:
+                        assert st_test.tokenize(l, numeric=numeric) == reference.tokenize(l, numeric=numeric)
+                assert len(st_test.word_cache) <= 2 * word_cache_size
+        assert reference.word_cache_stats()['entries'] == 0
+
+        st_test = SubTokenizer.load(str(tmpdir.join('bpe.txt')), prewarm=10, **kwargs)
+        words = st_test.frequent_words(10)
+        assert words and all(w.endswith(SPACESYMBOL) for w in words)
+        assert st_test.frequent_words(0) == [] and st_test.frequent_words(-1) == []
+        assert SubTokenizer.load(str(tmpdir.join('bpe.txt')), prewarm=0, **kwargs).word_cache_stats()['entries'] == 0
+        assert set(st_test.word_cache.data) == set(words)
+        for l in lines:
+            assert st_test.tokenize(l) == reference.tokenize(l)
+        assert st_test.word_cache_stats()['hits'] > 0
+
+
+def test_concurrent_tokenize():
+    futures = pytest.importorskip('concurrent.futures')
+    st_test = _learn_test_subtokenizer()
+    vocabulary = st_test.subwords.all_subtoken_strings
+    random.seed(3)
+    words = TEXT.split() + ['Ёлка', 'x' * 50, '\x01', 'McDonalds']
+    lines = [' '.join(random.choice(words) for _ in range(random.randint(0, 20))) for _ in range(3000)]
+    uncached = SubTokenizer(vocabulary, cache_size=0, word_cache_size=0)
+    expected = [uncached.tokenize(l, numeric=True) for l in lines]
+    # tiny caches are evicted and swapped by threads all the time
+    shared = SubTokenizer(vocabulary, cache_size=8, word_cache_size=4)
+    # python 2 has no switch interval
+    switch_interval = getattr(sys, 'getswitchinterval', lambda: None)()
+    if switch_interval is not None:
+        sys.setswitchinterval(1e-6)
+    try:
+        with futures.ThreadPoolExecutor(8) as executor:
+            assert shared.tokenize_many(lines, executor=executor, numeric=True, task_size=7) == expected
+            offsets = list(executor.map(shared.tokenize_with_offsets, lines))
+            texts = list(executor.map(lambda ids: shared.detokenize(ids, numeric=True), expected))
+    finally:
+        if switch_interval is not None:
+            sys.setswitchinterval(switch_interval)
+    assert [list(ids) for ids, _, _ in offsets] == expected
+    assert texts == [uncached.detokenize(ids, numeric=True) for ids in expected]
+    assert shared.tokenize_many(lines, numeric=True) == expected
+    assert shared.tokenize_many([]) == []
+
+    # Races at fixed points: another thread clears the cache during get
+    # and empties its dict during eviction in put.
+    class RacingDict(OrderedDict):
+        def pop(self, key):
+            cache.clear()
+            return OrderedDict.pop(self, key)
+
+        def popitem(self, last=True):
+            self.clear()
+            return OrderedDict.popitem(self, last)
+
+    cache = LRUCache(2)
+    cache.data = RacingDict([('a', 1), ('b', 2)])
+    assert cache.get('a') == 1
+    cache.data = RacingDict([('a', 1), ('b', 2)])
+    cache.put('c', 3)
+    assert len(cache) <= 2
+
+
+def test_tokenize_batch():
+    np = pytest.importorskip('numpy')
+    st_test = _learn_test_subtokenizer()
+    lines = ['Some rare symbols: ¦~.', '', 'The store is closed today.']
+    expected = [st_test.tokenize(l, numeric=True, add_eos=True) for l in lines]
+
+    matrix, lengths = st_test.tokenize_batch(lines, add_eos=True)
+    assert matrix.dtype == np.int32 and matrix.shape == (3, max(map(len, expected)))
+    for row, length, exp in zip(matrix, lengths, expected):
+        assert list(row[:length]) == exp
+        assert all(row[length:] == PAD_ID)
+
+    ids, offsets = st_test.tokenize_batch(lines, pad=False, add_eos=True)
+    assert [list(ids[offsets[i]:offsets[i + 1]]) for i in range(3)] == expected
+
+    matrix, lengths = st_test.tokenize_batch(lines, max_len=4, add_eos=True)
+    assert matrix.shape == (3, 4)
+    assert list(matrix[0]) == expected[0][:3] + [expected[0][-1]]
+
+
+def test_stats():
+    stats = Stats()
+    st_test = _learn_test_subtokenizer(stats=stats)
+    probes = [e for e in stats.events if e['name'] == 'probe']
+    assert probes and probes[-1]['vocab_size'] == st_test.subwords.vocab_size
+    assert stats.stages['learn.count'][1] == len([e for e in stats.events if e['name'] == 'iteration'])
+
+    lines = TEXT.splitlines()
+    for reversed_bpe in (False, True):
+        st_test = _learn_test_subtokenizer(reversed_bpe=reversed_bpe)
+        expected = [st_test.tokenize(l, numeric=numeric, add_eos=True) for l in lines for numeric in (False, True)]
+        st_test.subwords.cache.clear()
+        st_test.word_cache.clear()
+        stats = st_test.enable_stats()
+        assert [st_test.tokenize(l, numeric=numeric, add_eos=True) for l in lines for numeric in (False, True)] == expected
+        assert st_test.detokenize(expected[0]) == lines[0]
+        report = stats.report()
+        assert report['counters']['lines'] == 2 * len(lines) + 1
+        assert report['counters']['subtokens'] == sum(len(e) for e in expected)
+        assert 0 < report['hit_rates']['word_cache'] < 1
+        assert report['counters']['word_cache.misses'] == report['counters']['cache.misses']
+        assert set(report['stages']) == {'normalize', 'encode_controls', 'retokenize', 'word_cache',
+                                         'encode_alphabet', 'subwords', 'ids', 'detokenize'}
+        assert stats.format().startswith('elapsed')
+
+    merged = Stats()
+    merged.merge(stats.pop())
+    assert merged.counters['lines'] == 2 * len(lines) + 1 and not stats.counters
+
+
+def test_detokenize_batch():
+    np = pytest.importorskip('numpy')
+    # encoded line break is decoded inside the row
+    lines = TEXT.splitlines() + ['Some rare symbols: ¦~. HEY McDonalds', 'two\nlines &#10;', '']
+    for kwargs in ({}, {'reversed_bpe': True}, {'lowercase': True}):
+        st_test = _learn_test_subtokenizer(**kwargs)
+        assert '\n' in st_test.detokenize(st_test.tokenize(lines[-2]))
+        expected = [st_test.detokenize(st_test.tokenize(l)) for l in lines]
+        ids = [st_test.tokenize(l, numeric=True, add_eos=True) for l in lines]
+        assert [st_test.detokenize(i, numeric=True) for i in ids] == expected
+        assert [st_test.detokenize(i, numeric=True, decode=False) for i in ids] == \
+            [st_test.detokenize(st_test.tokenize(l), decode=False) for l in lines]
+        matrix, _ = st_test.tokenize_batch(lines, add_eos=True)
+        assert st_test.detokenize_batch(matrix) == expected
+        assert st_test.detokenize_batch(ids) == expected
+        assert st_test.detokenize_batch([np.array(i[:-1]) for i in ids]) == expected
+        matrix, _ = st_test.tokenize_batch(lines)
+        assert st_test.detokenize_batch(matrix, decode=False) == \
+            [st_test.detokenize(i[:-1], numeric=True, decode=False) for i in ids]
+    assert st_test.detokenize_batch([]) == []
+    assert st_test.detokenize_batch(np.zeros((2, 0), dtype=np.int32)) == ['', '']
+
+
+def test_binary_ids(tmpdir):
+    st_test = _learn_test_subtokenizer()
+    lines = TEXT.splitlines() + ['']
+    filename = str(tmpdir.join('ids.bin'))
+    large = str(tmpdir.join('large.bin'))
+    with IdsWriter(large, 2 ** 16 + 1) as writer:
+        writer.write([2 ** 16, 1])
+    with IdsWriter(filename, st_test.subwords.vocab_size) as writer:
+        for l in lines:
+            writer.write(st_test.tokenize(l, numeric=True))
+    assert [st_test.detokenize(ids, numeric=True) for ids in read_ids(filename)] == lines
+    assert list(read_ids(large)) == [[2 ** 16, 1]]
+    # mapped files are closed when reading stops early
+    ids = read_ids(filename)
+    assert next(ids) == st_test.tokenize(lines[0], numeric=True)
+    ids.close()
+    empty = str(tmpdir.join('empty.bin'))
+    with IdsWriter(empty, st_test.subwords.vocab_size) as writer:
+        writer.write([])
+        writer.write([])
+    assert list(read_ids(empty)) == [[], []]
+    pytest.importorskip('numpy')
+    ids, offsets = load_ids(filename)
+    assert ids.dtype.name == 'uint16' and len(offsets) == len(lines) + 1
+    assert st_test.detokenize_batch([ids[offsets[i]:offsets[i + 1]] for i in range(len(lines))]) == lines
+    assert load_ids(large)[0].dtype.name == 'uint32'
+
+
+def test_counts_files(tmpdir, monkeypatch):
+    # records cross buffer boundaries, multibyte varints of long tokens and large counts
+    monkeypatch.setattr(counts, 'BUFFER_SIZE', 7)
+    shards = []
+    for i, l in enumerate(TEXT.splitlines() + ['длинное' * 30]):
+        shard = defaultdict(int)
+        for r in ReTokenizer.tokenize(l):
+            shard[r] += 200 ** i
+        shards.append(shard)
+    words_count = defaultdict(int)
+    for shard in shards:
+        for r, c in shard.items():
+            words_count[r] += c
+    filenames = []
+    for i, shard in enumerate(shards):
+        filenames.append(str(tmpdir.join('{0}.counts'.format(i))))
+        write_counts(filenames[-1], shard, error=1, lowercase=False)
+    assert list(iter_counts(filenames[0])) == sorted(shards[0].items())
+    merged = str(tmpdir.join('merged.counts'))
+    assert merge_files(filenames, merged) == len(words_count)
+    assert list(iter_counts(merged)) == sorted(words_count.items())
+    header = read_header(merged)
+    assert header['total'] == sum(words_count.values()) and header['error'] == len(shards)
+    assert load_counts([merged, filenames[0]])[1] == {r: c + shards[0].get(r, 0) for r, c in words_count.items()}
+    assert not is_compiled(merged)
+    other = str(tmpdir.join('other.counts'))
+    write_counts(other, shards[0], lowercase=True)
+    with pytest.raises(ValueError):
+        merge_files([filenames[0], other], merged)
+
+
+def test_lazy_imports():
+    code = ("import sys, subtokenizer; "
+            "print(' '.join(m for m in ('regex', 'multiprocessing', 'argparse') if m in sys.modules))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=root).strip() == b''
+    ReTokenizer.compile()
+    assert ReTokenizer.tokenize('Hello world') == ['Hello·', 'world·', '˿']
+
+
+def test_parallel_learn():
+    words_count = defaultdict(int)
+    for l in TEXT.splitlines():
+        for r in ReTokenizer.tokenize(l.strip('\n')):
+            words_count[r] += 1
+    alphabet = {c for token in words_count for c in token}
+    expected = Subwords.build_from_token_counts(words_count, 2, RESERVED_TOKENS, alphabet)
+    parallel = Subwords.build_from_token_counts(words_count, 2, RESERVED_TOKENS, alphabet, processes=3)
+    assert parallel.all_subtoken_strings == expected.all_subtoken_strings
+    # closing a counter with a dead worker doesn't hide the original error
+    counter = ParallelSubstringCounter(words_count, 1)
+    counter.procs[0].terminate()
+    counter.procs[0].join()
+    counter.close()
+
+
+def test_build_to_target_size():
+    words_count = defaultdict(int)
+    for l in (TEXT * 3).splitlines():
+        for r in ReTokenizer.tokenize(l.strip('\n')):
+            words_count[r] += 1
+    alphabet = {c for token in words_count for c in token}
+    # Counts kept between refinements from different vocabularies match counts from scratch.
+    counter = SubstringCounter(list(words_count.items()))
+    subtoken_counts = defaultdict(int)
+    subwords = Subwords(RESERVED_TOKENS + list(alphabet), cache_size=0)
+    for min_count in (2, 20, 5):
+        subwords, subtoken_counts = Subwords._refine(counter, subtoken_counts, subwords, min_count,
+                                                     RESERVED_TOKENS, alphabet, 4)
+        expected = Subwords.build_from_token_counts(words_count, min_count, RESERVED_TOKENS, alphabet)
+        assert abs(subwords.vocab_size - expected.vocab_size) <= 0.1 * expected.vocab_size
+        assert dict(subtoken_counts) == dict(counter.count(defaultdict(int), True))
+    # vocabulary sizes are 92 for min_count 3 and 77 for 4 to 6
+    subwords = Subwords.build_to_target_size(80, words_count, 1, 100, RESERVED_TOKENS, alphabet)
+    assert subwords.vocab_size == 77
+    # a target above any vocabulary size leads probes down to the lower bound 0
+    largest = Subwords.build_to_target_size(10000, words_count, 0, 100, RESERVED_TOKENS, alphabet)
+    assert largest.all_subtoken_strings == \
+        Subwords.build_to_target_size(10000, words_count, 1, 100, RESERVED_TOKENS, alphabet).all_subtoken_strings
+    assert _next_probe(1, 1000, 500, []) == 32
+    assert _next_probe(1, 1000, 500, [(32, 2000)]) == 512
+    assert _next_probe(33, 99, 500, [(32, 2000), (100, 400)]) == 85
+    assert _next_probe(33, 40, 500, [(32, 2000), (100, 400)]) == 40
+
+
+def test_suffix_array_counter():
+    words_count = defaultdict(int)
+    for l in TEXT.splitlines():
+        for r in ReTokenizer.tokenize(l.strip('\n')):
+            words_count[r] += 1
+    alphabet = {c for token in words_count for c in token}
+    subwords = Subwords.build_from_token_counts(words_count, 3, RESERVED_TOKENS, alphabet)
+    for limit in (None, 4):
+        counter = SubstringCounter(list(words_count.items()), limit)
+        counter.segment(subwords)
+        all_counts = counter.count(defaultdict(int), True)
+        for min_count in (1, 3):
+            # single symbols are always counted
+            expected = {s: c for s, c in all_counts.items() if c >= min_count or len(s) == 1}
+            suffix_counter = SuffixArrayCounter(list(words_count.items()), limit)
+            suffix_counter.segment(subwords)
+            assert dict(suffix_counter.count(defaultdict(int), True, min_count)) == expected
+            parallel = ParallelSubstringCounter(words_count, 3, limit, suffix_array=True)
+            try:
+                parallel.segment(subwords)
+                assert dict(parallel.count(defaultdict(int), True, min_count)) == expected
+            finally:
+                parallel.close()
+    expected = Subwords.build_to_target_size(80, words_count, 1, 100, RESERVED_TOKENS, alphabet)
+    suffix_array = Subwords.build_to_target_size(80, words_count, 1, 100, RESERVED_TOKENS, alphabet, suffix_array=True)
+    assert suffix_array.all_subtoken_strings == expected.all_subtoken_strings
+    limited = SubTokenizer.learn(words_count, 80, subtoken_length_limit=4, suffix_array=True)
+    assert max(len(s) for s in limited.subwords.all_subtoken_strings if s not in RESERVED_TOKENS) < 4
+
+
+def test_sampled_learn():
+    words_count = defaultdict(int)
+    for l in TEXT.splitlines():
+        for r in ReTokenizer.tokenize(l.strip('\n')):
+            words_count[r] += 1
+    sample = sample_token_counts(words_count, 0.5, seed=1)
+    assert len(sample) == round(len(words_count) * 0.5)
+    assert all(words_count[token] == count for token, count in sample.items())
+    assert sample == sample_token_counts(words_count, 0.5, seed=1)
+    assert len(sample_token_counts(words_count, 10)) == 10
+    assert sample_token_counts(words_count, 10 ** 6) == words_count
+    assert len(sample_token_counts(words_count, 1e-6)) == 1
+    for sample in (0, -0.5):
+        with pytest.raises(ValueError):
+            sample_token_counts(words_count, sample)
+        with pytest.raises(ValueError):
+            SubTokenizer.learn(words_count, 80, sample=sample)
+    full = SubTokenizer.learn(words_count, 80)
+    sampled = SubTokenizer.learn(words_count, 80, sample=0.5)
+    assert sampled.alphabet == full.alphabet
+    # the sample is shorter than size * 0.01
+    assert SubTokenizer.learn(words_count, 8000, sample=10).alphabet == full.alphabet
+    report = sampled.evaluate(TEXT.splitlines() + ['Новый текст'])
+    assert report['lines'] == len(TEXT.splitlines()) + 1
+    assert report['escapes'] == len('Новыйтекст')
+    assert report['subtokens'] >= report['words'] > 0
+    assert report['compression_ratio'] == report['characters'] / report['subtokens']
+    assert sampled.detokenize(sampled.tokenize(TEXT)) == TEXT
+
+
+def test_streaming_counter():
+    tokens = TEXT.split()
+    exact = defaultdict(int)
+    for t in tokens:
+        exact[t] += 1
+    counter = StreamingCounter(max_size=20)
+    for l in TEXT.splitlines():
+        counter.update(l.split())
+    assert len(counter) <= 20 and counter.error > 0
+    assert counter.total == len(tokens)
+    counts = counter.counts()
+    for token, count in exact.items():
+        if count > counter.error:
+            assert token in counts
+        if token in counts:
+            assert counts[token] <= count <= counts[token] + counter.error
+
+
+def test_streaming_counter_merge():
+    lines = TEXT.splitlines()
+    exact = defaultdict(int)
+    for t in TEXT.split():
+        exact[t] += 1
+    merged = StreamingCounter()
+    for part in (lines[:10], lines[10:]):
+        counter = StreamingCounter()
+        for l in part:
+            counter.update(l.split())
+        merged.merge(counter)
+    assert merged.counts() == exact and merged.error == 0
+    merged = StreamingCounter(max_size=20)
+    for part in (lines[:7], lines[7:15], lines[15:]):
+        counter = StreamingCounter(max_size=20)
+        for l in part:
+            counter.update(l.split())
+        merged.merge(counter)
+    assert len(merged) <= 20 and merged.total == sum(exact.values())
+    for token, count in merged.counts().items():
+        assert count <= exact[token] <= count + merged.error
+
+
+def test_file_shards(tmpdir):
+    filenames = [str(tmpdir.join('a.txt')), str(tmpdir.join('empty.txt')), str(tmpdir.join('b.txt'))]
+    texts = [TEXT + '\n', '', 'Последняя строка без перевода']
+    for filename, text in zip(filenames, texts):
+        with io.open(filename, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+    lines = [l for text in texts for l in text.splitlines(True)]
+    for parts in (1, 3, 100):
+        ranges = file_ranges(filenames, parts)
+        assert [l for r in ranges for l in read_range(*r)] == lines
+    output = io.BytesIO()
+    map_file_shards(lambda l: l.strip().upper(), filenames, output, processes=2)
+    assert output.getvalue().decode('utf-8').splitlines() == [l.strip().upper() for l in lines]
+
+
+def _slow_square(x):
+    time.sleep(0.001 * (x % 3))
+    return x * x
+
+
+def test_multiprocess_order():
+    assert list(multiprocess(_slow_square, range(200), processes=3, chunk_size=7)) == [x * x for x in range(200)]
+    assert list(multiprocess(_slow_square, [], processes=2)) == []
+    with pytest.raises(WorkerError):
+        list(multiprocess(lambda x: 1 // x, [1, 0, 2], processes=2, chunk_size=1))
+    # results of a failed imap are not taken for results of the next one
+    pool = WorkerPool(lambda x: 10 // x, processes=2, chunk_size=1)
+    try:
+        with pytest.raises(WorkerError):
+            list(pool.imap([0] + list(range(1, 50))))
+        assert list(pool.imap(range(50, 100))) == [10 // x for x in range(50, 100)]
+
+        # an input error is raised in the caller instead of waiting for the end of input forever
+        def failing_input():
+            for x in range(1, 20):
+                yield x
+            raise IOError("bad input")
+
+        results = []
+        with pytest.raises(IOError):
+            for result in pool.imap(failing_input()):
+                results.append(result)
+        assert results == [10 // x for x in range(1, 20)]
+        assert list(pool.imap(range(1, 10))) == [10 // x for x in range(1, 10)]
+    finally:
+        pool.close()
+    # a killed worker is reported instead of waiting for its results forever
+    with pytest.raises(WorkerError):
+        list(multiprocess(lambda x: os.kill(os.getpid(), 9) if x == 5 else x, range(10), processes=2, chunk_size=1))
+
+
+def test_compiled_vocabulary(tmpdir):
+    text = 'The store is just across from my house and McDonalds. Some rare symbols: ¦~. Email abc@site.com'
+    for reversed_bpe in (False, True):
+        st_test = _learn_test_subtokenizer(reversed_bpe=reversed_bpe)
+        text_file = str(tmpdir.join('bpe.txt'))
+        compiled_file = str(tmpdir.join('bpe.bin'))
+        st_test.save(text_file)
+        SubTokenizer.load(text_file, reversed_bpe=reversed_bpe).compile(compiled_file)
+        st_compiled = SubTokenizer.load(compiled_file)
+        assert st_compiled.reversed_bpe == reversed_bpe
+        assert st_compiled.subwords.all_subtoken_strings == st_test.subwords.all_subtoken_strings
+        assert st_compiled.tokenize(text, numeric=True) == st_test.tokenize(text, numeric=True)
+        assert st_compiled.detokenize(st_compiled.tokenize(text)) == text
+        with pytest.raises(ValueError):
+            SubTokenizer.load(compiled_file, reversed_bpe=not reversed_bpe)
+        strings = st_compiled.subwords.all_subtoken_strings
+        assert strings[-1] == strings[len(strings) - 1] and strings[2:5] == st_test.subwords.all_subtoken_strings[2:5]
+        subtokens = st_test.subwords.ids_to_subtokens(st_test.tokenize(text, numeric=True))
+        assert st_compiled.subwords.subtokens_to_ids(subtokens) == st_test.subwords.subtokens_to_ids(subtokens)
+        assert 'no such subtoken' not in st_compiled.subwords.subtoken_string_to_id
+
+
+def test_share_memory():
+    text = 'The store is just across from my house and McDonalds. Some rare symbols: ¦~. Email abc@site.com'
+    for reversed_bpe in (False, True):
+        st_test = _learn_test_subtokenizer(reversed_bpe=reversed_bpe)
+        st_test.prewarm(st_test.frequent_words(8))
+        shared = st_test.share_memory()
+        assert shared.share_memory() is shared
+        assert shared.word_cache.data == st_test.word_cache.data and len(shared.word_cache) > 0
+        assert shared._surfaces is not None and shared._surfaces == st_test.surfaces()
+        assert not isinstance(shared.subwords.subtoken_string_to_id, dict)
+        assert shared.reversed_bpe == reversed_bpe and shared.alphabet == st_test.alphabet
+        assert shared.subwords.all_subtoken_strings == st_test.subwords.all_subtoken_strings
+        lines = TEXT.splitlines() + [text]
+        expected = [st_test.tokenize(l, numeric=True) for l in lines]
+        assert list(multiprocess(lambda l: shared.tokenize(l, numeric=True), lines, processes=2)) == expected
+        assert [shared.detokenize(ids, numeric=True) for ids in expected] == lines
+    memory = process_memory()
+    if memory is not None:
+        assert 0 < memory['private'] <= memory['rss']
+
+
+def test_translate_encoding():
+    rnd = random.Random(0)
+    alphabet = set('abc &#;0123456789')
+    table = alphabet_table(alphabet)
+    for _ in range(200):
+        text = ''.join(six.unichr(rnd.choice([rnd.randint(0, 0x3000), rnd.randint(0, 0x7f)])) for _ in range(30))
+        assert encode_controls(text) == ''.join(encode_control_symbol(ch) for ch in text)
+        assert text.translate(table) == ''.join(encode_with_alphabet_symbol(ch, alphabet) for ch in text)
+
+
+MULTILINGUAL_PIECES = ['The', 'McDonalds', 'HEY', 'ordinary', 'Straße', 'naïve', 'café', 'щиążе', 'Москва', 'ПРИВЕТ',
+                       '北京', '東京タワー', 'ひらがな', '한국어', 'العربية', 'עברית', 'हिन्दी', 'ภาษาไทย', 'Ελληνικά', 'ქართული',
+                       'e\u0301', '\u0301', '42', '3.14', '١٢٣', '१२', 'Ⅻ', TAGSYMBOL + 'tag_1', '&#10;', '&#64;', NOBREAK,
+                       NOBREAK + 'join', ' ', '  ', '.', ', ', '!?', '¦~', '-', "'", '"', '(', ')', '\t', '@', 'x@y.com']
+
+
+def test_tokenizer_reference():
+    rnd = random.Random(0)
+    for _ in range(2000):
+        line = ''.join(rnd.choice(MULTILINGUAL_PIECES) for _ in range(rnd.randint(0, 12)))
+        for split_by_alphabets in (True, False):
+            for lowercase in (False, True):
+                assert (ReTokenizer.tokenize(line, split_by_alphabets, lowercase) ==
+                        ReTokenizer.reference_tokenize(line, split_by_alphabets, lowercase)), line
+
+
+def test_tokenize_with_offsets():
+    text = 'The store is just across from my house and McDonalds. Some rare symbols: ¦~. Email abc@site.com \x01 end '
+    for reversed_bpe in (False, True):
+        st_test = _learn_test_subtokenizer(reversed_bpe=reversed_bpe)
+        # word cache lookups are counted as in tokenize
+        for line in TEXT.splitlines():
+            st_test.tokenize_with_offsets(line)
+        word_cache = st_test.word_cache_stats()
+        assert 0 < word_cache['misses'] and 0 <= word_cache['hits'] and 0 <= word_cache['hit_rate'] <= 1
+        for lowercase in (False, True):
+            ids, starts, ends = st_test.tokenize_with_offsets(text, lowercase=lowercase, add_eos=True)
+            assert list(ids) == st_test.tokenize(text, numeric=True, lowercase=lowercase, add_eos=True)
+            assert list(starts) == sorted(starts)
+            assert all(0 <= a <= b <= len(text) for a, b in zip(starts, ends))
+            subtokens = st_test.subwords.ids_to_subtokens(ids)
+            if reversed_bpe:
+                subtokens = [subtoken[::-1] for subtoken in subtokens]
+            for subtoken, a, b in zip(subtokens, starts, ends):
+                if subtoken.isalpha() and not lowercase:
+                    assert text[a:b] == subtoken
+            # escape sequences of symbols out of the alphabet and of control symbols come from one symbol
+            for symbol, escaped in (('¦', '&#166;'), ('~', '&#126;'), ('\x01', '&#1;')):
+                position = text.index(symbol)
+                assert ''.join(subtoken for subtoken, a, b in zip(subtokens, starts, ends)
+                               if (a, b) == (position, position + 1)) == escaped
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="server is python 3.7 or later only")
+def test_server(tmpdir):
+    import asyncio
+    from subtokenizer import server
+    st_test = _learn_test_subtokenizer()
+    st_test.save(str(tmpdir.join('bpe.txt')))
+    lines = TEXT.splitlines()
+    loop = asyncio.new_event_loop()
+    try:
+        for workers, model in ((0, st_test), (2, str(tmpdir.join('bpe.txt')))):
+            unix_path = str(tmpdir.join('server{0}.sock'.format(workers)))
+            srv, batcher = loop.run_until_complete(server.start_server(model, unix_path=unix_path, workers=workers))
+            stats, results = loop.run_until_complete(
+                server.generate_load(lines, requests=200, concurrency=16, connections=2, unix_path=unix_path, numeric=True))
+            assert stats['requests'] == 200
+            assert batcher.batches < batcher.requests
+            for i, result in results.items():
+                assert result == st_test.tokenize(lines[i], numeric=True)
+            client = loop.run_until_complete(server.Client.connect(unix_path=unix_path))
+            assert loop.run_until_complete(client.detokenize(results[0], numeric=True)) == lines[0].strip('\r\n')
+            with pytest.raises(RuntimeError):
+                loop.run_until_complete(client.request('unknown'))
+            loop.run_until_complete(client.close())
+            # longer than the default stream limit of 64KiB
+            long_line = ' '.join([lines[0].strip('\r\n')] * 2000)
+            client = loop.run_until_complete(server.Client.connect(unix_path=unix_path))
+            assert loop.run_until_complete(client.tokenize(long_line, numeric=True)) == st_test.tokenize(long_line, numeric=True)
+            loop.run_until_complete(client.close())
+            reader, writer = loop.run_until_complete(asyncio.open_unix_connection(unix_path))
+            for line in (b'[1, 2]\n', b'{"id": 1, "text": "\xff"}\n'):
+                writer.write(line)
+                response = json.loads(loop.run_until_complete(reader.readline()).decode('utf-8'))
+                assert response['id'] is None and 'error' in response
+            # the connection still works
+            writer.write(b'{"id": 2, "op": "tokenize", "text": "The store", "numeric": true}\n')
+            response = json.loads(loop.run_until_complete(reader.readline()).decode('utf-8'))
+            assert response == {'id': 2, 'result': st_test.tokenize('The store', numeric=True)}
+            writer.close()
+            loop.run_until_complete(server.stop_server(srv, batcher))
+        unix_path = str(tmpdir.join('limit.sock'))
+        srv, batcher = loop.run_until_complete(server.start_server(st_test, unix_path=unix_path, line_limit=1024))
+        reader, writer = loop.run_until_complete(asyncio.open_unix_connection(unix_path))
+        writer.write(json.dumps({'id': 1, 'op': 'tokenize', 'text': 'a' * 2000}).encode('utf-8') + b'\n')
+        response = json.loads(loop.run_until_complete(reader.readline()).decode('utf-8'))
+        assert response['id'] is None and 'error' in response
+        # the connection is closed
+        assert loop.run_until_complete(reader.readline()) == b''
+        writer.close()
+        loop.run_until_complete(server.stop_server(srv, batcher))
+    finally:
+        loop.close()
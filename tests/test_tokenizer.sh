@@ -38,6 +38,9 @@ echo "$TEXT" | python -m subtokenizer learn -o bpe.file -s 70 -m 2
 echo "$TEXT" | python -m subtokenizer tokenize | python -m subtokenizer detokenize | diff - <( echo "$TEXT" )
 # subwords
 echo "$TEXT" | python -m subtokenizer tokenize -s bpe.file | python -m subtokenizer detokenize -s bpe.file | diff - <( echo "$TEXT" )
+# compiled subwords
+python -m subtokenizer compile -s bpe.file -o bpe.bin
+echo "$TEXT" | python -m subtokenizer tokenize -s bpe.bin | python -m subtokenizer detokenize -s bpe.bin | diff - <( echo "$TEXT" )
 # eos
 echo "$TEXT" | python -m subtokenizer tokenize -s bpe.file -e | python -m subtokenizer detokenize -s bpe.file | diff - <( echo "$TEXT" )
 # numeric
@@ -46,6 +49,33 @@ echo "$TEXT" | python -m subtokenizer tokenize -s bpe.file -n | python -m subtok
 echo "$TEXT" | python -m subtokenizer tokenize -s bpe.file -n -e | python -m subtokenizer detokenize -s bpe.file -n | diff - <( echo "$TEXT" )
 # python2 multyprocessing
 echo "$TEXT" | python -m subtokenizer tokenize -p 2 | python -m subtokenizer detokenize -p 2 | diff - <( echo "$TEXT" )
+# statistics
+echo "$TEXT" | python -m subtokenizer tokenize -s bpe.file -n -p 2 --stats_json stats.json | python -m subtokenizer detokenize -s bpe.file -n --stats 2> /dev/null | diff - <( echo "$TEXT" )
+python -c "import json; assert json.load(open('stats.json'))['counters']['lines'] == $(echo "$TEXT" | wc -l)"
+# sampled learning with quality report
+echo "$TEXT" > text.txt
+echo "$TEXT" | python -m subtokenizer learn -o bpe_s.file -s 70 -m 2 --sample 0.5 --eval text.txt --eval_json quality.json 2> /dev/null
+python -c "import json; assert json.load(open('quality.json'))['full']['lines'] == $(echo "$TEXT" | wc -l)"
+if echo "$TEXT" | python -m subtokenizer learn -o bpe_z.file -s 70 --sample 0 2> /dev/null; then exit 1; fi
+# suffix array counting gives the same vocabulary
+echo "$TEXT" | python -m subtokenizer learn -o bpe_sa.file -s 70 -m 2 --suffix_array 2> /dev/null
+echo "$TEXT" | python -m subtokenizer learn -o bpe_d.file -s 70 -m 2 2> /dev/null
+diff bpe_sa.file bpe_d.file
+# token counts shards merged and learned from
+echo "$TEXT" | head -n 5 | python -m subtokenizer count -o 1.counts
+echo "$TEXT" | tail -n +6 | python -m subtokenizer count -o 2.counts
+python -m subtokenizer merge -o text.counts 1.counts 2.counts 2> /dev/null
+python -m subtokenizer learn -o bpe_c.file -s 70 -m 2 --counts text.counts 2> /dev/null
+diff bpe.file bpe_c.file
+# binary ids
+echo "$TEXT" | python -m subtokenizer tokenize -s bpe.file -e -p 2 --binary ids.bin
+python -m subtokenizer detokenize -s bpe.file --binary ids.bin | diff - <( echo "$TEXT" )
+# input files split between processes
+echo "$TEXT" > text.txt
+python -m subtokenizer tokenize -s bpe.file -n -p 2 text.txt text.txt > tokenized.txt
+python -m subtokenizer detokenize -s bpe.file -n -p 2 tokenized.txt | diff - <( echo "$TEXT"; echo "$TEXT" )
+python -m subtokenizer learn -o bpe_f.file -s 70 -m 2 -p 2 text.txt
+diff bpe.file bpe_f.file
 # python3 multyprocessing
 #echo "$TEXT" | python3 -m subtokenizer tokenize -p 2 | python3 -m subtokenizer detokenize -p 2 | diff - <( echo "$TEXT" )
 
@@ -57,6 +87,8 @@ echo "$TEXT" | python -m subtokenizer tokenize --lowercase -s bpe_l.file | pytho
 # reversed bpe
 echo "$TEXT" | python -m subtokenizer learn --reversed_bpe -o bpe_r.file -s 70 -m 2
 echo "$TEXT" | python -m subtokenizer tokenize --reversed_bpe -s bpe_r.file | python -m subtokenizer detokenize --reversed_bpe -s bpe_r.file | diff - <( echo "$TEXT" )
+python -m subtokenizer compile --reversed_bpe -s bpe_r.file -o bpe_r.bin
+echo "$TEXT" | python -m subtokenizer tokenize -s bpe_r.bin | python -m subtokenizer detokenize -s bpe_r.bin | diff - <( echo "$TEXT" )
 
 # test windows end of lines
 echo "$ENDOFLINES" | python -m subtokenizer learn -o eof.file -s 70 -m 2